@@ -0,0 +1,5 @@
+import logging
+
+# the engine modules log through whatever handlers the application configures; without any (i.e. under the unit tests)
+# their warnings are dropped rather than reported as "No handlers could be found"
+logging.getLogger(__name__).addHandler(logging.NullHandler())
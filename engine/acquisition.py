@@ -0,0 +1,343 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import multiprocessing
+import threading
+import time
+import logging
+import Queue
+from hit_detector import HitDetector, CALIBRATING, READY, FAILED
+from engine.io.accel import SensorStats
+
+log = logging.getLogger(__name__)
+
+FIELDS_PER_SAMPLE = 4  # timestamp, x, y, z
+# number of detected hit positions remembered by a SampleRingBuffer
+MAX_HIT_MARKS = 32
+# number of samples between copies of the sensor stats into shared memory
+STATS_PUBLISH_INTERVAL = 100
+
+# detector methods that may be invoked from the parent process
+REMOTE_METHODS = frozenset(['calibrate_hit', 'wait_for_hit', 'wait_for_stability', 'has_valid_calibration',
+                            'update_settings', 'measure_peak'])
+
+
+class SampleRingBuffer(object):
+    """
+    Fixed-size ring buffer of (timestamp, x, y, z) samples backed by shared memory so samples written by the
+    acquisition process can be read by other processes without being copied through a pipe. There must be exactly one
+    writer (the process that owns the sensor); any number of readers may call read().
+    """
+
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self.data = multiprocessing.Array('d', capacity * FIELDS_PER_SAMPLE, lock=False)
+        # total number of samples ever written. This is only incremented after a slot is fully written.
+        self.written = multiprocessing.Value('L', 0, lock=False)
+        # sequence numbers of the samples at which hits were detected
+        self.hit_marks = multiprocessing.Array('L', MAX_HIT_MARKS, lock=False)
+        self.hits_marked = multiprocessing.Value('L', 0, lock=False)
+
+    def append(self, timestamp, sample):
+        """
+        Writes a sample into the next slot of the buffer, overwriting the oldest sample if the buffer is full.
+        :param timestamp:
+        :param sample:
+        :return:
+        """
+        seq = self.written.value
+        idx = (seq % self.capacity) * FIELDS_PER_SAMPLE
+        self.data[idx] = timestamp
+        self.data[idx + 1] = sample[0]
+        self.data[idx + 2] = sample[1]
+        self.data[idx + 3] = sample[2]
+        self.written.value = seq + 1
+
+    def read(self, since=0):
+        """
+        Returns a tuple of (next_seq, samples) where samples is a list of (timestamp, x, y, z) tuples for every sample
+        with a sequence number >= since that is still in the buffer. Pass next_seq back in as since on the next call to
+        receive only new samples.
+        :param since:
+        :return:
+        """
+        end = self.written.value
+        return end, self.read_range(since, end)
+
+    def read_range(self, start, end):
+        """
+        Returns the (timestamp, x, y, z) samples with sequence numbers in [start, end) that are still in the buffer.
+        The slot of the oldest sample (written - capacity) is the one the writer fills next, so it may be partially
+        overwritten at any moment and is never returned.
+        :param start:
+        :param end:
+        :return:
+        """
+        start = max(start, self.written.value - self.capacity + 1)
+        samples = []
+        for seq in range(start, end):
+            idx = (seq % self.capacity) * FIELDS_PER_SAMPLE
+            samples.append(tuple(self.data[idx:idx + FIELDS_PER_SAMPLE]))
+        # the writer may have lapped us while we were copying; drop anything that could have been overwritten
+        overwritten = self.written.value - self.capacity - start + 1
+        if overwritten > 0:
+            samples = samples[overwritten:]
+        return samples
+
+    def mark_hit(self):
+        """
+        Records the most recently written sample as the one at which a hit was detected. This may be called from a
+        different process than the one writing samples but there must only be one process marking hits.
+        :return: the timestamp of the marked sample, or None if no samples have been written
+        """
+        written = self.written.value
+        seq = max(written - 1, 0)
+        count = self.hits_marked.value
+        self.hit_marks[count % MAX_HIT_MARKS] = seq
+        self.hits_marked.value = count + 1
+        if not written:
+            return None
+        return self.data[(seq % self.capacity) * FIELDS_PER_SAMPLE]
+
+    def get_hit_marks(self):
+        """
+        Returns the sequence numbers of the most recent hits, oldest first.
+        :return:
+        """
+        count = self.hits_marked.value
+        return [self.hit_marks[i % MAX_HIT_MARKS] for i in range(max(0, count - MAX_HIT_MARKS), count)]
+
+
+class SharedSensorStats(object):
+    """
+    Copy of the acquisition process's SensorStats counters kept in shared memory so they can be read from the parent.
+    """
+
+    def __init__(self):
+        self.values = multiprocessing.Array('d', len(SensorStats.FIELDS), lock=False)
+        self.available = multiprocessing.Value('b', 0, lock=False)
+
+    def update(self, stats):
+        for i, field in enumerate(SensorStats.FIELDS):
+            self.values[i] = stats[field]
+        self.available.value = 1
+
+    def to_dict(self):
+        if not self.available.value:
+            return None
+        return dict((field, self.values[i] if field == "achieved_rate" else int(self.values[i]))
+                    for i, field in enumerate(SensorStats.FIELDS))
+
+
+class RecordingSensor(object):
+    """
+    Wraps a sensor so that every sample read is also published to a SampleRingBuffer. If shared_stats is supplied, the
+    sensor's stats are periodically copied to it.
+    """
+
+    def __init__(self, sensor, ring, clock=time.time, shared_stats=None):
+        self.sensor = sensor
+        self.ring = ring
+        self.clock = clock
+        self.shared_stats = shared_stats if hasattr(sensor, "get_stats") else None
+        self.count = 0
+
+    def get_sample(self):
+        val = self.sensor.get_sample()
+        self.ring.append(self.clock(), val)
+        self.count += 1
+        if self.shared_stats is not None and self.count % STATS_PUBLISH_INTERVAL == 0:
+            self.shared_stats.update(self.sensor.get_stats())
+        return val
+
+    def begin_sampling(self):
+        if hasattr(self.sensor, "begin_sampling"):
+            self.sensor.begin_sampling()
+
+    def get_stats(self):
+        if hasattr(self.sensor, "get_stats"):
+            return self.sensor.get_stats()
+        return None
+
+
+class RemoteHitDetector(object):
+    """
+    Implements the HitDetector interface by running the sensor and the real HitDetector in a separate process. Each
+    call is sent over a command queue and the result (the hit event) is returned over an event queue. This keeps
+    sensor acquisition on its own core and out of contention for the GIL with the web server. Raw samples are
+    published to a shared-memory SampleRingBuffer that any thread in this process can read.
+    """
+
+    def __init__(self, threshold, timeout, samples, detect_dir=True, sensor_factory=None, ring=None,
+                 start_timeout=30, background=False, on_ready=None, **detector_options):
+        self.ring = ring if ring is not None else SampleRingBuffer()
+        self.shared_stats = SharedSensorStats()
+        self.commands = multiprocessing.Queue()
+        self.events = multiprocessing.Queue()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.status = CALIBRATING
+        self.calibration_error = None
+        self.calibrated = threading.Event()
+        self.on_ready = on_ready
+        self.process = multiprocessing.Process(target=run_acquisition,
+                                               args=(self.commands, self.events, self.ring,
+                                                     (threshold, timeout, samples),
+                                                     dict(detector_options, detect_dir=detect_dir),
+                                                     sensor_factory, self.shared_stats))
+        self.process.daemon = True
+        self.process.start()
+        if background:
+            thread = threading.Thread(target=self.__await_start, args=(start_timeout + timeout,))
+            thread.daemon = True
+            thread.start()
+        else:
+            self.__await_start(start_timeout + timeout)
+            self.wait_until_ready()
+
+    def __await_start(self, timeout):
+        """
+        Waits for the acquisition process to report that the detector has been calibrated. No commands can be sent
+        until this completes.
+        :param timeout:
+        :return:
+        """
+        with self.lock:
+            try:
+                self.__get_result(timeout)
+                self.status = READY
+            except Exception as e:
+                self.calibration_error = e
+                self.status = FAILED
+                self.__stop_process()
+            self.calibrated.set()
+        if self.on_ready is not None:
+            self.on_ready(self.status)
+
+    def get_status(self):
+        return self.status
+
+    def wait_until_ready(self, timeout=None):
+        self.calibrated.wait(timeout)
+        if self.calibration_error is not None:
+            raise self.calibration_error
+        return self.status == READY
+
+    def __get_result(self, timeout=None):
+        """
+        Waits for the next message from the acquisition process. Raises any error reported by the child and raises
+        an IOError if the child exits without responding.
+        :param timeout:
+        :return:
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                status, value = self.events.get(timeout=1)
+                break
+            except Queue.Empty:
+                if not self.process.is_alive():
+                    raise IOError("Acquisition process exited with code {code}".format(code=self.process.exitcode))
+                if deadline is not None and time.time() > deadline:
+                    raise IOError("Timed out waiting for the acquisition process")
+        if status == 'error':
+            raise value
+        return value
+
+    def __call(self, method, *args):
+        if not self.calibrated.is_set():
+            self.wait_until_ready()
+        with self.lock:
+            self.commands.put((method, args))
+            return self.__get_result()
+
+    def calibrate_hit(self, side, timeout):
+        return self.__call('calibrate_hit', side, timeout)
+
+    def wait_for_hit(self, side, timeout):
+        return self.__call('wait_for_hit', side, timeout)
+
+    def wait_for_stability(self, timeout):
+        return self.__call('wait_for_stability', timeout)
+
+    def measure_peak(self, hit):
+        return self.__call('measure_peak', hit)
+
+    def update_settings(self, settings):
+        return self.__call('update_settings', settings)
+
+    def has_valid_calibration(self):
+        return self.__call('has_valid_calibration')
+
+    def get_sensor_stats(self):
+        """
+        Returns the most recent sensor stats published by the acquisition process. This doesn't go through the command
+        queue so it never waits on a running detector call.
+        :return:
+        """
+        return self.shared_stats.to_dict()
+
+    def close(self, timeout=5):
+        """
+        Asks the acquisition process to exit and waits up to timeout seconds for it to do so.
+        :return:
+        """
+        if self.process.is_alive() and self.status != FAILED and not self.closed:
+            self.commands.put(None)
+        self.__stop_process(timeout)
+
+    def __stop_process(self, timeout=1):
+        """
+        Waits for the acquisition process to exit (terminating it if it doesn't) and then closes the queues. Nothing
+        is sent to a process that has failed since it may already have exited, leaving the queue's feeder thread
+        writing to a closed pipe.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        for queue in (self.commands, self.events):
+            queue.close()
+            queue.join_thread()
+
+
+def run_acquisition(commands, events, ring, detector_args, detector_kwargs, sensor_factory=None, shared_stats=None):
+    """
+    Entry point of the acquisition process. Builds the sensor and HitDetector (which calibrates) and then executes
+    detector methods sent over the commands queue until a None command is received.
+    :param commands:
+    :param events:
+    :param ring:
+    :param detector_args:
+    :param detector_kwargs:
+    :param sensor_factory: callable returning the sensor to use. Defaults to the ADXL345 Accelerometer.
+    :param shared_stats: SharedSensorStats to publish the sensor's stats to
+    :return:
+    """
+    try:
+        if sensor_factory is None:
+            from engine.io import accel
+            sensor = accel.Accelerometer()
+        else:
+            sensor = sensor_factory()
+        detector = HitDetector(*detector_args, sensor=RecordingSensor(sensor, ring, shared_stats=shared_stats),
+                               **detector_kwargs)
+    except Exception as e:
+        events.put(('error', e))
+        return
+    events.put(('ok', None))
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        method, args = command
+        try:
+            if method not in REMOTE_METHODS:
+                raise ValueError("Unsupported detector method {m}".format(m=method))
+            events.put(('ok', getattr(detector, method)(*args)))
+        except Exception as e:
+            log.error("Acquisition command {m} failed: {msg}".format(m=method, msg=e))
+            events.put(('error', e))
@@ -0,0 +1,341 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import json
+import math
+import threading
+from array import array
+from collections import OrderedDict
+import history
+
+try:
+    import numpy
+except ImportError:
+    # the pure python fallback is slower but fine for a single session
+    numpy = None
+
+SIDES = ('r', 'c', 'l')
+# number of consecutive hits averaged for the fatigue curves
+FATIGUE_WINDOW = 10
+# width in seconds of the reaction time histogram bins
+HISTOGRAM_BIN = 0.1
+PERCENTILES = (10, 50, 90)
+# minimum number of seconds between the first and last hit with a force reading to report a force trend
+MIN_TREND_SPAN = 60
+# number of completed sessions whose results are kept
+CACHE_SIZE = 32
+
+
+class SessionColumns(object):
+    """
+    The hits of a session stored as parallel columns (numpy arrays when numpy is installed, otherwise array.arrays)
+    ordered by time: time (seconds since the start of the session), side (index into SIDES), reaction_time, correct
+    (1 or 0) and force (peak acceleration in m/s^2, NaN if it was not captured).
+    """
+
+    def __init__(self, start, hits):
+        """
+        :param start: epoch time at which the session started
+        :param hits: iterable of (timestamp, side, reaction_time, correct, force) tuples
+        """
+        self.start = start
+        hits = sorted(hits)
+        self.time = column('d', [h[0] - start for h in hits])
+        self.side = column('b', [SIDES.index(h[1]) for h in hits])
+        self.reaction_time = column('d', [h[2] for h in hits])
+        self.correct = column('b', [1 if h[3] else 0 for h in hits])
+        self.force = column('d', [h[4] if h[4] is not None else float('nan') for h in hits])
+
+    def __len__(self):
+        return len(self.time)
+
+
+def load_events(events):
+    """
+    Builds SessionColumns from the history events of a single session.
+    :param events: iterable of event dictionaries as written by WorkoutState
+    :return:
+    """
+    start = None
+    hits = []
+    for event in events:
+        if event["type"] == "workout_start":
+            start = event.get("workout", event["time"])
+        elif event["type"] == "hit":
+            hits.append((event["time"], event["side"], event["reaction_time"], event["correct"], event.get("force")))
+    if start is None:
+        start = hits[0][0] - hits[0][2] if hits else 0
+    return SessionColumns(start, hits)
+
+
+def load_snapshot(start, snapshot):
+    """
+    Builds SessionColumns from a StateSnapshot.
+    :param start: epoch time at which the workout started
+    :param snapshot:
+    :return:
+    """
+    # timestamps are rounded the same way as in the history so both give the same results
+    hits = [(round(h.timestamp, 4), h.direction, h.time, correct, h.force)
+            for hit_list, correct in ((snapshot.correct_hits, True), (snapshot.incorrect_hits, False))
+            for h in hit_list]
+    return SessionColumns(start, hits)
+
+
+def analyze(columns, window=FATIGUE_WINDOW):
+    """
+    Computes the analytics for a session:
+    sides - per side reaction time distribution of correct hits (count, mean, std, min, max, percentiles and a
+    histogram of HISTOGRAM_BIN wide bins) along with the number of misses
+    fatigue - rolling mean reaction time over window consecutive correct hits, plotted against session time, and the
+    relative change between the first and last windows
+    hits_per_minute - number of correct hits and all hits in each minute of the session
+    force - per minute and rolling mean peak force and its trend (change per minute, once there are MIN_TREND_SPAN
+    seconds of readings), or None if force was not captured
+    :param columns: SessionColumns
+    :param window:
+    :return: dictionary
+    """
+    correct = mask(columns.correct, 1)
+    result = {"start": columns.start, "hits": len(columns), "correct": int(total(columns.correct)),
+              "backend": "numpy" if numpy is not None else "array", "sides": {}}
+    for idx, side in enumerate(SIDES):
+        on_side = mask(columns.side, idx)
+        times = select(columns.reaction_time, both(on_side, correct))
+        stats = distribution(times)
+        stats["misses"] = int(total(on_side)) - stats["count"]
+        result["sides"][side] = stats
+    correct_times = select(columns.time, correct)
+    correct_reaction = select(columns.reaction_time, correct)
+    result["fatigue"] = fatigue_curve(correct_times, correct_reaction, window)
+    minutes = int(columns.time[-1] // 60) + 1 if len(columns) else 0
+    result["hits_per_minute"] = {"correct": per_minute(correct_times, minutes),
+                                 "all": per_minute(columns.time, minutes)}
+    captured = finite(columns.force)
+    if total(captured):
+        force_times = select(columns.time, captured)
+        forces = select(columns.force, captured)
+        counts = per_minute(force_times, minutes)
+        sums = per_minute(force_times, minutes, forces)
+        result["force"] = {"per_minute": [round(s / c, 2) if c else None for s, c in zip(sums, counts)],
+                           "rolling": fatigue_curve(force_times, forces, window),
+                           "trend_per_minute": None}
+        if force_times[-1] - force_times[0] >= MIN_TREND_SPAN:
+            result["force"]["trend_per_minute"] = round(slope(force_times, forces) * 60, 3)
+    else:
+        result["force"] = None
+    return result
+
+
+class SessionAnalytics(object):
+    """
+    Computes and caches the analytics of workout sessions. Completed sessions never change so their JSON encoding is
+    cached (up to CACHE_SIZE sessions). A session that is still running is cached per StateSnapshot version so polling
+    clients only cause a recomputation when a hit has been recorded.
+    """
+
+    def __init__(self, history_dir=None, cache_size=CACHE_SIZE):
+        self.history_dir = history_dir
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.live = (None, None)
+        self.lock = threading.Lock()
+
+    def for_state(self, state):
+        """
+        Returns the analytics JSON for a WorkoutState, which may still be running.
+        :param state:
+        :return:
+        """
+        # read the snapshot once; the workout thread may publish a new one at any time
+        snapshot = state.snapshot
+        if state.finished:
+            return self.__cached(state.server_time, lambda: load_snapshot(state.server_time, snapshot))
+        key = (state.server_time, snapshot.version)
+        live_key, encoded = self.live
+        if live_key != key:
+            encoded = json.dumps(analyze(load_snapshot(state.server_time, snapshot)))
+            self.live = (key, encoded)
+        return encoded
+
+    def for_workout(self, workout_id):
+        """
+        Returns the analytics JSON for a completed workout read from the history, or None if it was not found.
+        :param workout_id: start time of the workout
+        :return:
+        """
+        if self.history_dir is None:
+            return None
+        return self.__cached(workout_id, lambda: self.__load_workout(workout_id))
+
+    def __load_workout(self, workout_id):
+        events = list(read_session(self.history_dir, workout_id))
+        return load_events(events) if events else None
+
+    def __cached(self, workout_id, loader):
+        with self.lock:
+            encoded = self.cache.get(workout_id)
+        if encoded is None:
+            columns = loader()
+            if columns is None:
+                return None
+            encoded = json.dumps(analyze(columns))
+            with self.lock:
+                self.cache[workout_id] = encoded
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return encoded
+
+
+def read_session(history_dir, workout_id):
+    """
+    Generator yielding the history events of the workout that started at workout_id, stopping at its workout_end
+    event. Only the history from the start of the workout onwards is read.
+    """
+    # event times are rounded so start a little early to be sure of including the workout_start event
+    for event in history.iter_records(history_dir, history.EVENTS, workout_id - 1):
+        if event.get("workout") != workout_id:
+            continue
+        yield event
+        if event["type"] == "workout_end":
+            return
+
+
+def fatigue_curve(times, values, window):
+    """
+    Returns the rolling mean of values over window consecutive entries as a list of [time, mean] pairs (each mean is
+    plotted at the time of the last value in its window) along with the relative change from the first to the last
+    window. If there are fewer values than window a single window covering all of them is used.
+    """
+    window = max(1, min(window, len(values)))
+    means = rolling_mean(values, window)
+    curve = [[round(t, 2), round(m, 4)] for t, m in zip(list(times)[window - 1:], means)]
+    change = None
+    if len(means) > 1 and means[0]:
+        change = round((means[-1] - means[0]) / means[0], 4)
+    return {"window": window, "curve": curve, "change": change}
+
+
+def distribution(values):
+    count = len(values)
+    stats = {"count": count, "mean": None, "std": None, "min": None, "max": None, "histogram": []}
+    for pct in PERCENTILES:
+        stats["p{pct}".format(pct=pct)] = None
+    if not count:
+        return stats
+    ordered = sort(values)
+    mean = total(values) / count
+    stats["mean"] = round(mean, 4)
+    stats["std"] = round(math.sqrt(max(0.0, total(square(values)) / count - mean * mean)), 4)
+    stats["min"] = round(ordered[0], 4)
+    stats["max"] = round(ordered[-1], 4)
+    for pct in PERCENTILES:
+        stats["p{pct}".format(pct=pct)] = round(ordered[min(count - 1, int(count * pct / 100.0))], 4)
+    stats["histogram"] = bin_counts(values, HISTOGRAM_BIN, int(ordered[-1] // HISTOGRAM_BIN) + 1)
+    return stats
+
+
+def per_minute(times, minutes, weights=None):
+    """
+    Returns a list with the number of entries of times (or the sum of weights) in each minute of the session.
+    """
+    return bin_counts(times, 60, minutes, weights)
+
+
+# Columnar primitives. Each has a numpy implementation and an equivalent pure python one over array.array.
+
+def column(typecode, values):
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64 if typecode == 'd' else numpy.int8)
+    return array(typecode, values)
+
+
+def mask(col, value):
+    if numpy is not None:
+        return col == value
+    return array('b', [1 if v == value else 0 for v in col])
+
+
+def finite(col):
+    if numpy is not None:
+        return numpy.isfinite(col)
+    return array('b', [0 if math.isnan(v) else 1 for v in col])
+
+
+def both(mask1, mask2):
+    if numpy is not None:
+        return mask1 & mask2
+    return array('b', [a & b for a, b in zip(mask1, mask2)])
+
+
+def select(col, selected):
+    if numpy is not None:
+        return col[selected]
+    return array(col.typecode, [v for v, m in zip(col, selected) if m])
+
+
+def total(col):
+    if numpy is not None:
+        return float(numpy.sum(col))
+    return float(sum(col))
+
+
+def square(col):
+    if numpy is not None:
+        return col * col
+    return array('d', [v * v for v in col])
+
+
+def sort(col):
+    if numpy is not None:
+        return numpy.sort(col)
+    return sorted(col)
+
+
+def rolling_mean(col, window):
+    """
+    Returns the means of every run of window consecutive values, computed from a running sum.
+    """
+    if len(col) < window:
+        return []
+    if numpy is not None:
+        sums = numpy.cumsum(numpy.concatenate(([0.0], col)))
+        return ((sums[window:] - sums[:-window]) / window).tolist()
+    sums = [0.0]
+    for v in col:
+        sums.append(sums[-1] + v)
+    return [(sums[i + window] - sums[i]) / window for i in range(len(col) - window + 1)]
+
+
+def bin_counts(col, width, bins, weights=None):
+    """
+    Returns a list of bins entries with the number of values (or the sum of their weights) falling in each width wide
+    bin starting at zero. Values beyond the last bin are counted in it.
+    """
+    if bins <= 0:
+        return []
+    if numpy is not None:
+        idx = numpy.minimum((numpy.asarray(col) // width).astype(numpy.int64), bins - 1)
+        counts = numpy.bincount(idx, weights=weights, minlength=bins)
+        return [round(float(c), 4) if weights is not None else int(c) for c in counts]
+    counts = [0] * bins
+    for i, v in enumerate(col):
+        counts[min(int(v // width), bins - 1)] += weights[i] if weights is not None else 1
+    return [round(c, 4) for c in counts] if weights is not None else counts
+
+
+def slope(x, y):
+    """
+    Returns the least squares slope of y against x (0 if there are fewer than two distinct x values).
+    """
+    count = len(x)
+    if count < 2:
+        return 0.0
+    if numpy is not None:
+        dx = x - numpy.mean(x)
+        denom = float(numpy.sum(dx * dx))
+        return float(numpy.sum(dx * (y - numpy.mean(y)))) / denom if denom else 0.0
+    mean_x = sum(x) / count
+    mean_y = sum(y) / count
+    denom = sum((a - mean_x) ** 2 for a in x)
+    return sum((a - mean_x) * (b - mean_y) for a, b in zip(x, y)) / denom if denom else 0.0
@@ -0,0 +1,67 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import os
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# seconds between checks of the watched file
+POLL_INTERVAL = 1
+
+
+class ConfigWatcher(object):
+    """
+    Polls a file for changes (in modification time or size) and calls on_change with no arguments when it has
+    changed. Polling is used rather than inotify so there are no extra dependencies, and it copes with editors that
+    replace the file rather than writing it in place. Exceptions raised by on_change are logged so a bad edit doesn't
+    stop the watcher; the next save is picked up as usual.
+    """
+
+    def __init__(self, path, on_change, interval=POLL_INTERVAL):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.last_stat = self.__stat()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name="config-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def check(self):
+        """
+        Calls on_change if the file has changed since the last check.
+        :return: True if the file changed
+        """
+        current = self.__stat()
+        if current == self.last_stat:
+            return False
+        self.last_stat = current
+        if current is None:
+            log.warning("Configuration file {path} was removed".format(path=self.path))
+            return False
+        log.info("Configuration file {path} changed; reloading".format(path=self.path))
+        try:
+            self.on_change()
+        except Exception as e:
+            log.error("Could not reload {path}: {msg}".format(path=self.path, msg=e))
+        return True
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def __stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime, stat.st_size
+        except OSError:
+            return None
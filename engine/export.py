@@ -0,0 +1,129 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import csv
+import json
+import time
+import zlib
+import history
+
+FORMATS = ("csv", "ndjson")
+MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+# columns written when exporting events as CSV; events without a value for a column leave it blank
+EVENT_FIELDS = ("time", "type", "workout", "side", "reaction_time", "correct", "force")
+# records are encoded into chunks of roughly this many bytes so each write to the client is a reasonable size
+CHUNK_SIZE = 65536
+GZIP_LEVEL = 6
+
+
+def export(history_dir, kind=history.EVENTS, fmt="csv", start=None, end=None, compress=False):
+    """
+    Returns a generator that yields the history records of kind (events or samples) with start <= time < end encoded
+    as fmt (csv or ndjson) in chunks of about CHUNK_SIZE bytes, gzip compressed if compress is set. Records are read,
+    encoded and compressed one at a time so memory use stays constant regardless of how much history is exported.
+    :param history_dir:
+    :param kind:
+    :param fmt:
+    :param start: epoch seconds, or None for no lower bound
+    :param end: epoch seconds, or None for no upper bound
+    :param compress:
+    :return:
+    """
+    if kind not in history.EXTENSIONS:
+        raise ValueError("Unknown export data {kind}".format(kind=kind))
+    if fmt not in FORMATS:
+        raise ValueError("Unknown export format {fmt}".format(fmt=fmt))
+    records = history.iter_records(history_dir, kind, start, end)
+    fields = EVENT_FIELDS if kind == history.EVENTS else history.SAMPLE_FIELDS
+    lines = to_csv(records, fields) if fmt == "csv" else to_ndjson(records, fields)
+    chunks = batch(lines)
+    return gzip_stream(chunks) if compress else chunks
+
+
+def to_csv(records, fields):
+    """
+    Generator yielding a header line followed by one CSV line per record. Records may be dictionaries or tuples in
+    the order of fields.
+    """
+    out = LineBuffer()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(fields)
+    yield out.line
+    for record in records:
+        if isinstance(record, dict):
+            record = [record.get(f, "") for f in fields]
+        writer.writerow(record)
+        yield out.line
+
+
+def to_ndjson(records, fields):
+    """
+    Generator yielding one JSON object per line for each record. Tuples are converted to objects keyed by fields.
+    """
+    for record in records:
+        if not isinstance(record, dict):
+            record = dict(zip(fields, record))
+        yield json.dumps(record, sort_keys=True) + "\n"
+
+
+def batch(lines, size=CHUNK_SIZE):
+    """
+    Joins lines into chunks of at least size bytes (except for the last) so the response isn't sent a line at a time.
+    """
+    pending = []
+    pending_size = 0
+    for line in lines:
+        pending.append(line)
+        pending_size += len(line)
+        if pending_size >= size:
+            yield "".join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield "".join(pending)
+
+
+def gzip_stream(chunks, level=GZIP_LEVEL):
+    """
+    Generator that gzip compresses a stream of chunks incrementally, yielding compressed data as it becomes available.
+    The output is a complete gzip file.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parse_time(value):
+    """
+    Parses a time range bound given either as epoch seconds or as a local date/time in ISO 8601 format
+    (2017-06-01, 2017-06-01T18:30 or 2017-06-01T18:30:00). Returns epoch seconds or None if value is empty.
+    :param value:
+    :return:
+    """
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for pattern in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, pattern))
+        except ValueError:
+            continue
+    raise ValueError("Could not parse time {value}".format(value=value))
+
+
+class LineBuffer(object):
+    """
+    File-like object that holds the last line written to it so csv.writer can encode one row at a time.
+    """
+
+    def __init__(self):
+        self.line = ""
+
+    def write(self, data):
+        self.line = data
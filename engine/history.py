@@ -0,0 +1,139 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import os
+import json
+import time
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+EVENTS = "events"
+SAMPLES = "samples"
+# file extension used for each kind of history file. Events are stored as one JSON object per line and samples as
+# timestamp,x,y,z lines.
+EXTENSIONS = {EVENTS: "ndjson", SAMPLES: "csv"}
+SAMPLE_FIELDS = ("time", "x", "y", "z")
+
+
+class HistoryLog(object):
+    """
+    Append-only log of workout events (and, optionally, raw sensor samples) stored in one file per kind per day in
+    history_dir. Each write opens the file in append mode so nothing is held open between rounds and a crash loses at
+    most the write in progress. Daily files let readers skip whole days that fall outside a requested time range.
+    """
+
+    def __init__(self, history_dir, record_samples=False):
+        self.history_dir = history_dir
+        self.record_samples = record_samples
+        if not os.path.isdir(history_dir):
+            os.makedirs(history_dir)
+
+    def record(self, event_type, timestamp=None, **fields):
+        """
+        Appends an event to the events file for the day of timestamp.
+        :param event_type: for instance workout_start, hit or sensor_error
+        :param timestamp: epoch seconds. Defaults to now.
+        :param fields: additional values stored with the event
+        :return:
+        """
+        fields["type"] = event_type
+        fields["time"] = round(timestamp if timestamp is not None else time.time(), 4)
+        self.__append(EVENTS, fields["time"], [json.dumps(fields, sort_keys=True) + "\n"])
+
+    def record_sample_block(self, samples):
+        """
+        Appends a list of (timestamp, x, y, z) samples to the samples file. This is a no-op unless record_samples is
+        set. All of the samples are written to the file for the day of the first one.
+        :param samples:
+        :return:
+        """
+        if not self.record_samples or not samples:
+            return
+        self.__append(SAMPLES, samples[0][0],
+                      ["{t:.4f},{x:.4f},{y:.4f},{z:.4f}\n".format(t=s[0], x=s[1], y=s[2], z=s[3]) for s in samples])
+
+    def __append(self, kind, timestamp, lines):
+        try:
+            with open(get_path(self.history_dir, kind, get_day(timestamp)), "a") as out:
+                out.writelines(lines)
+        except IOError as e:
+            # history is a convenience; never let a full or read-only disk end a workout
+            log.error("Could not write {kind} history: {msg}".format(kind=kind, msg=e))
+
+
+def iter_records(history_dir, kind, start=None, end=None):
+    """
+    Generator yielding the records of the given kind with start <= time < end, oldest first, reading one line at a time
+    so memory use does not depend on the size of the history. Events are yielded as dictionaries and samples as
+    (timestamp, x, y, z) tuples.
+    :param history_dir:
+    :param kind: EVENTS or SAMPLES
+    :param start: epoch seconds, or None for no lower bound
+    :param end: epoch seconds, or None for no upper bound
+    :return:
+    """
+    for day, path in list_files(history_dir, kind):
+        if start is not None and get_day_start(day + datetime.timedelta(days=1)) <= start:
+            continue
+        if end is not None and get_day_start(day) >= end:
+            break
+        with open(path, "r") as in_file:
+            for line in in_file:
+                record = parse_line(kind, line)
+                if record is None:
+                    continue
+                timestamp = record["time"] if kind == EVENTS else record[0]
+                if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                    yield record
+
+
+def parse_line(kind, line):
+    """
+    Parses a line of a history file, returning None if it is blank or truncated (i.e. by a power loss mid-write).
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if kind == EVENTS:
+            return json.loads(line)
+        return tuple(float(v) for v in line.split(","))
+    except ValueError:
+        log.warning("Skipping malformed {kind} history line".format(kind=kind))
+        return None
+
+
+def list_files(history_dir, kind):
+    """
+    Returns a sorted list of (date, path) tuples for the history files of the given kind.
+    """
+    files = []
+    if not os.path.isdir(history_dir):
+        return files
+    prefix = kind + "-"
+    suffix = "." + EXTENSIONS[kind]
+    for name in os.listdir(history_dir):
+        if name.startswith(prefix) and name.endswith(suffix):
+            try:
+                day = datetime.datetime.strptime(name[len(prefix):-len(suffix)], "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            files.append((day, os.path.join(history_dir, name)))
+    return sorted(files)
+
+
+def get_path(history_dir, kind, day):
+    return os.path.join(history_dir, "{kind}-{day}.{ext}".format(kind=kind, day=day.isoformat(),
+                                                                 ext=EXTENSIONS[kind]))
+
+
+def get_day(timestamp):
+    """Returns the local date of the epoch timestamp."""
+    return datetime.date.fromtimestamp(timestamp)
+
+
+def get_day_start(day):
+    """Returns the epoch time of local midnight at the start of day."""
+    return time.mktime(day.timetuple())
@@ -5,6 +5,16 @@ import time
 import sys
 import math
 import operator
+import threading
+
+# values returned by HitDetector.get_status
+CALIBRATING = 'calibrating'
+READY = 'ready'
+FAILED = 'failed'
+# attributes that can be changed on a running detector with update_settings
+SETTINGS = ('threshold', 'samples', 'stability_threshold', 'min_calibration_distance', 'detect_direction')
+# seconds the sensor is read after a hit to find the peak of the impact
+PEAK_WINDOW = 0.03
 
 
 class HitDetector(object):
@@ -12,41 +22,97 @@ class HitDetector(object):
     Class that uses the accelerometer to detect when the bag is hit.
     """
 
-    def __init__(self, threshold, timeout, samples, detect_dir=True, sensor=None):
+    def __init__(self, threshold, timeout, samples, detect_dir=True, sensor=None, background=False,
+                 on_ready=None, stability_threshold=5, min_calibration_distance=10, clock=time.time, prepare=None):
+        """
+        Creates the detector and performs the baseline calibration. If background is True, the calibration runs on its
+        own thread and the constructor returns immediately; get_status can be used to check on progress and any
+        method that needs the baseline will block until calibration completes. on_ready, if supplied, is called with
+        the final status once calibration finishes. prepare, if supplied, is called before the baseline is measured
+        (on the calibration thread when running in the background) and any error it raises fails the calibration. All
+        timeouts are measured using clock, which allows recorded data to be replayed in sample time rather than wall
+        time.
+        """
         self.threshold = threshold
         self.reference_angles = {}
         self.baseline = None
         self.samples = samples
-        self.stability_threshold = 5
-        self.min_calibration_distance = 10
+        self.stability_threshold = stability_threshold
+        self.min_calibration_distance = min_calibration_distance
+        self.clock = clock
         self.detect_direction = detect_dir
+        self.status = CALIBRATING
+        self.calibration_error = None
+        self.calibrated = threading.Event()
+        self.on_ready = on_ready
+        self.prepare = prepare
         if sensor is None:
             from engine.io import accel
             self.sensor = accel.Accelerometer()
         else:
             self.sensor = sensor
-        self.__calibrate(timeout)
+        if background:
+            thread = threading.Thread(target=self.__calibrate, args=(timeout,))
+            thread.daemon = True
+            thread.start()
+        else:
+            self.__calibrate(timeout)
+            self.wait_until_ready()
 
     def __calibrate(self, timeout):
         """
         Performs initial calibration by getting the current, at-rest, sensor values and using those as a
         baseline that can be subtracted from later readings to return relative acceleration. If the readings
-        from the sensor don't stabilize within the specified timeout, this method will throw a
-        SensorInitializationError.
+        from the sensor don't stabilize within the specified timeout, the detector is marked as failed and
+        wait_until_ready will throw a SensorInitializationError.
         :param timeout:
         :return:
         """
-        baseline = self.wait_for_stability(timeout)
-        if baseline:
-            self.baseline = baseline
-        else:
-            raise SensorInitializationError("Sensor readings did not stabilize. Cannot calibrate.")
+        try:
+            if self.prepare is not None:
+                self.prepare()
+            baseline = self.__measure_stability(timeout)
+            if baseline:
+                self.baseline = baseline
+                self.status = READY
+            else:
+                raise SensorInitializationError("Sensor readings did not stabilize. Cannot calibrate.")
+        except Exception as e:
+            self.calibration_error = e
+            self.status = FAILED
+        self.calibrated.set()
+        if self.on_ready is not None:
+            self.on_ready(self.status)
+
+    def get_status(self):
+        """
+        Returns one of CALIBRATING, READY or FAILED.
+        :return:
+        """
+        return self.status
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Blocks until the baseline calibration completes (or timeout elapses). Raises the calibration error if it failed.
+        :param timeout:
+        :return: True if the detector is ready
+        """
+        self.calibrated.wait(timeout)
+        if self.calibration_error is not None:
+            raise self.calibration_error
+        return self.status == READY
 
     def wait_for_stability(self, timeout):
+        if not self.calibrated.is_set():
+            self.wait_until_ready()
+        return self.__measure_stability(timeout)
+
+    def __measure_stability(self, timeout):
         stable_count = 0
-        deadline = time.time() + timeout
+        self.__begin_sampling()
+        deadline = self.clock() + timeout
         baseline = self.baseline if self.baseline else self.sensor.get_sample()
-        while time.time() < deadline and stable_count < self.samples:
+        while self.clock() < deadline and stable_count < self.samples:
             new_val = self.sensor.get_sample()
             diff = tuple(map(operator.sub, baseline, new_val))
             if get_magnitude(diff) < self.stability_threshold:
@@ -85,8 +151,11 @@ class HitDetector(object):
         :param timeout:
         :return: either a tuple containing acceleration in each direction or None (if no hit was detected before timeout)
         """
-        deadline = time.time() + timeout
-        while time.time() < deadline:
+        if not self.calibrated.is_set():
+            self.wait_until_ready()
+        self.__begin_sampling()
+        deadline = self.clock() + timeout
+        while self.clock() < deadline:
             new_val = self.sensor.get_sample()
             diff = tuple(map(operator.sub, self.baseline, new_val))
             mag = get_magnitude(diff)
@@ -104,6 +173,48 @@ class HitDetector(object):
                     return diff, False
         return None, False
 
+    def measure_peak(self, hit, window=PEAK_WINDOW):
+        """
+        Keeps reading the sensor for window seconds after wait_for_hit has returned hit and returns the largest
+        magnitude of the change in acceleration seen, including hit itself. wait_for_hit returns the first sample over
+        the threshold, which is on the rising edge of the impact, so its magnitude says little about how hard the bag
+        was hit.
+        :param hit: the change in acceleration returned by wait_for_hit
+        :param window:
+        :return:
+        """
+        peak = get_magnitude(hit)
+        deadline = self.clock() + window
+        while self.clock() < deadline:
+            peak = max(peak, get_magnitude(tuple(map(operator.sub, self.baseline, self.sensor.get_sample()))))
+        return peak
+
+    def __begin_sampling(self):
+        # the sensor isn't read between calls, so tell it that is not a gap in sampling
+        if hasattr(self.sensor, "begin_sampling"):
+            self.sensor.begin_sampling()
+
+    def get_sensor_stats(self):
+        """
+        Returns a dictionary of sample rate and error counters from the sensor or None if the sensor doesn't track them.
+        :return:
+        """
+        if hasattr(self.sensor, "get_stats"):
+            return self.sensor.get_stats()
+        return None
+
+    def update_settings(self, settings):
+        """
+        Replaces the value of each of the SETTINGS present in the settings dictionary. The baseline and the calibrated
+        reference angles are kept so no recalibration is needed. This should only be called between rounds, not while
+        waiting for a hit.
+        :param settings:
+        :return:
+        """
+        for name in SETTINGS:
+            if name in settings:
+                setattr(self, name, settings[name])
+
     def has_valid_calibration(self):
         """
         Returns True if all calibrated sides are at least min_calibration_distance apart.
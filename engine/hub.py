@@ -0,0 +1,99 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import os
+import re
+import json
+import zlib
+import logging
+import threading
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from history import HistoryLog
+
+log = logging.getLogger(__name__)
+
+# device names are used as directory names so only allow a safe subset of characters
+DEVICE_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+# largest decompressed batch accepted
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+
+class HubStore(object):
+    """
+    Stores the events uploaded by each device in its own HistoryLog under data_dir so the history of every bag can be
+    exported with the same tools as a single Pi. Batch ids that have already been stored are ignored so a batch that is
+    re-sent after a lost acknowledgement is only stored once.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.logs = {}
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def add_batch(self, batch):
+        """
+        Stores the events of a batch.
+        :param batch: dictionary with device, batch (the id) and events
+        :return: number of events stored
+        """
+        device = batch.get("device", "")
+        if not DEVICE_PATTERN.match(device):
+            raise ValueError("Invalid device name")
+        with self.lock:
+            key = (device, batch.get("batch"))
+            if key in self.seen:
+                return 0
+            if device not in self.logs:
+                self.logs[device] = HistoryLog(os.path.join(self.data_dir, device))
+            device_log = self.logs[device]
+            for event in batch.get("events", []):
+                event = dict(event)
+                device_log.record(event.pop("type"), event.pop("time"), **event)
+            self.seen.add(key)
+        return len(batch.get("events", []))
+
+
+class HubRequestHandler(BaseHTTPRequestHandler):
+    """
+    Accepts batches POSTed by a HubUploader. Connections are kept alive between requests.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if self.headers.get("Content-Encoding") == "gzip":
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                body = decompressor.decompress(body, MAX_BATCH_BYTES)
+                if decompressor.unconsumed_tail:
+                    raise ValueError("Batch too large")
+            count = self.server.store.add_batch(json.loads(body))
+        except (ValueError, KeyError, zlib.error) as e:
+            self.__respond(400, {"msg": str(e)})
+            return
+        self.__respond(200, {"accepted": count})
+
+    def __respond(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.client_address[0], format % args)
+
+
+class HubServer(ThreadingMixIn, HTTPServer):
+    """
+    Minimal aggregation hub for testing uploads: stores every batch it receives in a HubStore.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, data_dir):
+        HTTPServer.__init__(self, address, HubRequestHandler)
+        self.store = HubStore(data_dir)
@@ -1,6 +1,10 @@
 """
 __author__ = 'Christopher Fagiani'
 """
+import time
+import logging
+
+log = logging.getLogger(__name__)
 
 GRAVITY = 9.80665  # m/s^2
 SCALE = 0.004
@@ -11,33 +15,245 @@ POWER_CTL_REG = 0x2D
 FIRST_DATA_REG = 0x32
 NUM_DATA_REG = 6
 
-BW_RATE = 0x0D  # x0B = 100 Hz,  x0C = 200 Hz, x0D = 400 Hz, x0E = 800 Hz, x0F = 1600 Hz
+# output data rate in Hz to BW_RATE register value (see table 7 of the data sheet)
+DATA_RATES = {100: 0x0A, 200: 0x0B, 400: 0x0C, 800: 0x0D, 1600: 0x0E, 3200: 0x0F}
+DEFAULT_RATE = 800
+BW_RATE = DATA_RATES[DEFAULT_RATE]
 
 MEASURE_MODE = 0x08
-RANGE = 0x03  # 16 g (max)
+# g-force range to DATA_FORMAT range bits
+RANGES = {2: 0x00, 4: 0x01, 8: 0x02, 16: 0x03}
+DEFAULT_RANGE = 16
+RANGE = RANGES[DEFAULT_RANGE]
+
+# SPI command bits that are OR'ed with the register address
+SPI_READ = 0x80
+SPI_MULTI_BYTE = 0x40
+SPI_MODE = 3  # the ADXL345 samples on the rising edge with an idle-high clock (CPOL=1, CPHA=1)
+SPI_MAX_SPEED_HZ = 5000000
+
+# number of times a failed read is retried before giving up. The transport is re-initialized before the last retry.
+MAX_READ_RETRIES = 3
+# an interval between reads longer than this many sample periods means samples were dropped
+GAP_FACTOR = 2
+
+
+class SensorStats(object):
+    """
+    Running counters describing how well sampling is keeping up with the sensor: the achieved sample rate over the
+    last full second spent sampling (the pauses between runs of reads are left out), gaps in sampling (and the estimated number of samples dropped), and read errors, retries and
+    re-initializations of the transport. Sampling is expected to be continuous between calls to begin_sampling, so
+    every long interval between reads in that time is counted as a gap.
+    """
+    FIELDS = ("samples", "achieved_rate", "gaps", "dropped", "errors", "retries", "reinitializations")
+
+    def __init__(self):
+        self.samples = 0
+        self.achieved_rate = 0.0
+        self.gaps = 0
+        self.dropped = 0
+        self.errors = 0
+        self.retries = 0
+        self.reinitializations = 0
+        self.last_time = None
+        # time spent sampling and number of intervals read since the achieved rate was last computed
+        self.window_time = 0.0
+        self.window_count = 0
+
+    def begin_sampling(self):
+        """
+        Marks the start of a run of continuous reads (i.e. waiting for a hit). The pause since the last read is neither
+        a gap nor part of the rate window; the counters and the window are kept.
+        :return:
+        """
+        self.last_time = None
+
+    def record_sample(self, now, rate):
+        """
+        Records a successful read at time now for a sensor configured at rate Hz.
+        :param now:
+        :param rate:
+        :return:
+        """
+        self.samples += 1
+        last_time, self.last_time = self.last_time, now
+        if last_time is None:
+            return
+        interval = now - last_time
+        if interval * rate > GAP_FACTOR:
+            self.gaps += 1
+            self.dropped += int(interval * rate) - 1
+        self.window_time += interval
+        self.window_count += 1
+        if self.window_time >= 1:
+            self.achieved_rate = self.window_count / self.window_time
+            self.window_time = 0.0
+            self.window_count = 0
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in SensorStats.FIELDS)
+
 
-try:
-    import smbus
-except ImportError:
-    raise ImportError("smbus is not installed. Please install (sudo apt-get install python-smbus i2c-tools)")
+class I2CTransport(object):
+    """
+    Reads and writes ADXL345 registers over the I2C bus using python-smbus. The bus is opened by open() rather than at
+    construction time.
+    """
+
+    def __init__(self, bus_num=1, address=0x53, bus_factory=None):
+        """
+        :param bus_num: number of the I2C bus the device is attached to
+        :param address: I2C address of the device
+        :param bus_factory: callable taking the bus number and returning an SMBus-compatible object. Defaults to
+        smbus.SMBus.
+        """
+        self.bus_num = bus_num
+        self.address = address
+        self.bus_factory = bus_factory
+        self.bus = None
+
+    def open(self):
+        if self.bus_factory is None:
+            try:
+                import smbus
+            except ImportError:
+                raise ImportError("smbus is not installed. Please install (sudo apt-get install python-smbus i2c-tools)")
+            self.bus_factory = smbus.SMBus
+        self.bus = self.bus_factory(self.bus_num)
+
+    def close(self):
+        if self.bus is not None:
+            self.bus.close()
+        self.bus = None
+
+    def write_register(self, reg, data):
+        self.bus.write_byte_data(self.address, reg, data)
+
+    def read_register(self, reg):
+        return self.bus.read_byte_data(self.address, reg)
+
+    def read_block(self, reg, length):
+        return self.bus.read_i2c_block_data(self.address, reg, length)
+
+
+class SpiTransport(object):
+    """
+    Reads and writes ADXL345 registers over 4-wire SPI using spidev. Block reads use the multi-byte bit so all the data
+    registers are read in a single burst transfer.
+    """
+
+    def __init__(self, bus_num=0, device=0, speed_hz=SPI_MAX_SPEED_HZ, spi_factory=None):
+        """
+        :param bus_num: SPI bus number
+        :param device: chip select number
+        :param speed_hz: SPI clock speed. The ADXL345 supports up to 5 MHz.
+        :param spi_factory: callable returning an unopened SpiDev-compatible object. Defaults to spidev.SpiDev.
+        """
+        self.bus_num = bus_num
+        self.device = device
+        self.speed_hz = speed_hz
+        self.spi_factory = spi_factory
+        self.spi = None
 
-bus = smbus.SMBus(1)
+    def open(self):
+        if self.spi_factory is None:
+            try:
+                import spidev
+            except ImportError:
+                raise ImportError("spidev is not installed. Please install (sudo apt-get install python-spidev)")
+            self.spi_factory = spidev.SpiDev
+        self.spi = self.spi_factory()
+        self.spi.open(self.bus_num, self.device)
+        self.spi.max_speed_hz = self.speed_hz
+        self.spi.mode = SPI_MODE
+
+    def close(self):
+        if self.spi is not None:
+            self.spi.close()
+        self.spi = None
+
+    def write_register(self, reg, data):
+        self.spi.xfer2([reg & 0x3F, data])
+
+    def read_register(self, reg):
+        return self.spi.xfer2([reg | SPI_READ, 0])[1]
+
+    def read_block(self, reg, length):
+        return self.spi.xfer2([reg | SPI_READ | SPI_MULTI_BYTE] + [0] * length)[1:]
 
 
 class Accelerometer(object):
     """
     This class is for use with an ADXL345 accelerometer (for full set of possible options, see the component data sheet
-    at https://www.sparkfun.com/datasheets/Sensors/Accelerometer/ADXL345.pdf). This abstraction assumes that you have
-    python-smbus installed and that the Raspberry Pi has been configured to use the i2c bus. After initialization,
-    the x,y,z values of the accelerometer can be read via the get_sample() method.
+    at https://www.sparkfun.com/datasheets/Sensors/Accelerometer/ADXL345.pdf). The device registers are accessed via a
+    transport; by default this is the I2C bus (which assumes that you have python-smbus installed and that the
+    Raspberry Pi has been configured to use the i2c bus) but an SpiTransport can be used for higher throughput.
+    After initialization, the x,y,z values of the accelerometer can be read via the get_sample() method.
     """
 
-    def __init__(self, address=0x53):
+    def __init__(self, address=0x53, transport=None, rate=DEFAULT_RATE, g_range=DEFAULT_RANGE,
+                 max_retries=MAX_READ_RETRIES, clock=time.time):
+        """
+        :param address: I2C address (only used when no transport is supplied)
+        :param transport: I2CTransport or SpiTransport. Defaults to I2C on bus 1.
+        :param rate: output data rate in Hz; must be a key of DATA_RATES
+        :param g_range: measurement range in g; must be a key of RANGES
+        :param max_retries: number of times a failed read is retried before a SensorReadError is raised
+        :param clock: time source used for sample rate accounting
+        """
+        if rate not in DATA_RATES:
+            raise ValueError("Unsupported data rate {rate}".format(rate=rate))
+        if g_range not in RANGES:
+            raise ValueError("Unsupported range {range}".format(range=g_range))
         self.address = address
-        self.__write_register(BW_RATE_REG, BW_RATE)
-        self.__set_range()
+        self.transport = transport if transport is not None else I2CTransport(address=address)
+        self.g_range = g_range
+        self.max_retries = max_retries
+        self.clock = clock
+        self.stats = SensorStats()
+        self.transport.open()
+        self.__configure(rate)
+
+    def __configure(self, rate):
+        """
+        Writes the data rate, range and power mode to the device.
+        :param rate:
+        :return:
+        """
+        self.set_rate(rate)
+        self.__set_range(RANGES[self.g_range])
         self.__write_register(POWER_CTL_REG, MEASURE_MODE)
 
+    def reinitialize(self):
+        """
+        Closes and re-opens the transport and re-writes the device configuration. This is used to recover from bus
+        errors (i.e. noise on long cables) without tearing down the rest of the system.
+        :return:
+        """
+        self.stats.reinitializations += 1
+        log.warning("Re-initializing accelerometer after read errors")
+        self.transport.close()
+        self.transport.open()
+        self.__configure(self.rate)
+
+    def set_rate(self, rate):
+        """
+        Sets the output data rate of the device.
+        :param rate: rate in Hz; must be a key of DATA_RATES
+        :return:
+        """
+        if rate not in DATA_RATES:
+            raise ValueError("Unsupported data rate {rate}".format(rate=rate))
+        self.__write_register(BW_RATE_REG, DATA_RATES[rate])
+        self.rate = rate
+
+    def begin_sampling(self):
+        """
+        Called before a run of continuous reads so the time since the previous run isn't counted as a gap.
+        :return:
+        """
+        self.stats.begin_sampling()
+
     def __write_register(self, reg, data):
         """
         Writes the data to the device register at the address passed in.
@@ -45,7 +261,7 @@ class Accelerometer(object):
         :param data:
         :return:
         """
-        bus.write_byte_data(self.address, reg, data)
+        self.transport.write_register(reg, data)
 
     def __read_register(self, reg):
         """
@@ -53,7 +269,7 @@ class Accelerometer(object):
         :param reg:
         :return:
         """
-        return bus.read_byte_data(self.address, reg)
+        return self.transport.read_register(reg)
 
     def __set_range(self, range_val=RANGE):
         """
@@ -79,7 +295,7 @@ class Accelerometer(object):
         Returns a 3-tuple containing acceleration (in meters per second per second) in each axis (x,y,z).
         :return:
         """
-        sensor_data = bus.read_i2c_block_data(self.address, FIRST_DATA_REG, NUM_DATA_REG)
+        sensor_data = self.__read_data()
 
         axes = []
         for i in range(0, len(sensor_data), 2):
@@ -90,6 +306,50 @@ class Accelerometer(object):
 
         return axes[0], axes[1], axes[2]
 
+    def __read_data(self):
+        """
+        Reads the data registers, retrying failed reads up to max_retries times. Before the final retry the transport
+        is re-initialized. If every attempt fails a SensorReadError is raised.
+        :return:
+        """
+        attempt = 0
+        while True:
+            try:
+                sensor_data = self.transport.read_block(FIRST_DATA_REG, NUM_DATA_REG)
+                self.stats.record_sample(self.clock(), self.rate)
+                return sensor_data
+            except IOError as e:
+                self.stats.errors += 1
+                if attempt >= self.max_retries:
+                    raise SensorReadError("Could not read accelerometer after {n} attempts: {msg}".format(
+                        n=attempt + 1, msg=e))
+                attempt += 1
+                self.stats.retries += 1
+                if attempt == self.max_retries:
+                    try:
+                        self.reinitialize()
+                    except IOError as reinit_error:
+                        self.stats.errors += 1
+                        log.error("Could not re-initialize accelerometer: {msg}".format(msg=reinit_error))
+
+    def get_stats(self):
+        return self.stats.to_dict()
+
+    def close(self):
+        self.transport.close()
+
+
+def create_transport(name, address=0x53, i2c_bus=1, spi_bus=0, spi_device=0, spi_speed=SPI_MAX_SPEED_HZ):
+    """
+    Builds the transport named by name ("i2c" or "spi").
+    :return:
+    """
+    if name == "i2c":
+        return I2CTransport(i2c_bus, address)
+    elif name == "spi":
+        return SpiTransport(spi_bus, spi_device, spi_speed)
+    raise ValueError("Unknown sensor transport {name}".format(name=name))
+
 
 def get_value(byte1, byte2):
     """
@@ -102,3 +362,7 @@ def get_value(byte1, byte2):
     if val & (1 << 16 - 1):
         val = val - (1 << 16)
     return val
+
+
+class SensorReadError(IOError):
+    pass
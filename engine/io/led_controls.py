@@ -9,8 +9,6 @@ try:
 except ImportError:
     raise ImportError("GPIO must be installed. Please install and try again")
 
-GPIO.setmode(GPIO.BCM)
-
 
 class LedController(object):
     """
@@ -23,7 +21,7 @@ class LedController(object):
         :param lights: dictionary where key is light identifier and value is pin number for that light.
         """
         self.lights = lights
-
+        GPIO.setmode(GPIO.BCM)
         for pin in self.lights.itervalues():
             GPIO.setup(pin, GPIO.OUT, initial=False)
 
@@ -0,0 +1,105 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import time
+import logging
+from accel import DATA_RATES
+
+log = logging.getLogger(__name__)
+
+
+class RateTestResult(object):
+    """
+    Results of reading the accelerometer as fast as possible at a given output data rate.
+    """
+
+    def __init__(self, rate, latencies, errors, elapsed):
+        self.rate = rate
+        self.reads = len(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.reads_per_sec = self.reads / elapsed if elapsed > 0 else 0
+        attempts = self.reads + errors
+        self.error_rate = errors / float(attempts) if attempts else 0
+        latencies = sorted(latencies)
+        self.p50 = percentile(latencies, 50)
+        self.p90 = percentile(latencies, 90)
+        self.p99 = percentile(latencies, 99)
+        self.max = latencies[-1] if latencies else 0
+
+    def is_sustainable(self, margin=1.0, max_error_rate=0.001):
+        """
+        Returns True if the reads achieved keep up with the data rate (times margin) with an acceptable error rate.
+        """
+        return self.reads_per_sec >= self.rate * margin and self.error_rate <= max_error_rate
+
+
+def measure_rate(sensor, rate, duration=1.0, clock=time.time):
+    """
+    Configures the sensor for rate and then reads samples back-to-back for duration seconds, recording the latency of
+    each read and the number of bus errors (including those the sensor recovered from by retrying).
+    :param sensor: Accelerometer
+    :param rate: data rate in Hz
+    :param duration:
+    :param clock:
+    :return: RateTestResult
+    """
+    sensor.set_rate(rate)
+    sensor.begin_sampling()
+    latencies = []
+    errors = 0
+    errors_before = sensor.stats.errors
+    start = clock()
+    now = start
+    deadline = start + duration
+    while now < deadline:
+        before = clock()
+        try:
+            sensor.get_sample()
+            now = clock()
+            latencies.append(now - before)
+        except IOError:
+            now = clock()
+            errors += 1
+    # the sensor retries failed reads internally so use its error count when it is higher than what we observed
+    errors = max(errors, sensor.stats.errors - errors_before)
+    return RateTestResult(rate, latencies, errors, now - start)
+
+
+def select_rate(sensor, rates=None, duration=1.0, margin=1.0, max_error_rate=0.001, clock=time.time):
+    """
+    Measures each candidate rate (lowest first) and returns the highest one the sensor and bus can sustain. If none
+    of them can be sustained, the lowest rate is returned. The sensor is left configured at the selected rate.
+    :param sensor: Accelerometer
+    :param rates: candidate rates in Hz. Defaults to all rates supported by the device.
+    :param duration: seconds to test each rate
+    :param margin: required ratio of reads per second to the data rate
+    :param max_error_rate: maximum tolerated fraction of failed reads
+    :param clock:
+    :return: tuple of (selected rate, list of RateTestResult)
+    """
+    rates = sorted(rates if rates else DATA_RATES.keys())
+    results = [measure_rate(sensor, rate, duration, clock) for rate in rates]
+    sustainable = [r.rate for r in results if r.is_sustainable(margin, max_error_rate)]
+    best = sustainable[-1] if sustainable else rates[0]
+    sensor.set_rate(best)
+    log.info("Selected sensor data rate of {rate} Hz".format(rate=best))
+    return best, results
+
+
+def format_results(results):
+    """
+    Returns a printable table of RateTestResults.
+    """
+    lines = ["{:>6} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8}".format("rate", "reads/sec", "p50(us)", "p90(us)",
+                                                                  "p99(us)", "max(us)", "errors")]
+    for r in results:
+        lines.append("{:>6} {:>10.0f} {:>9.0f} {:>9.0f} {:>9.0f} {:>9.0f} {:>7.2f}%".format(
+            r.rate, r.reads_per_sec, r.p50 * 1e6, r.p90 * 1e6, r.p99 * 1e6, r.max * 1e6, r.error_rate * 100))
+    return "\n".join(lines)
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * pct / 100.0))]
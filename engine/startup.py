@@ -0,0 +1,51 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupTimer(object):
+    """
+    Records how long each phase of startup takes. Phases may overlap (i.e. sensor calibration runs in the background
+    while the LEDs and UI server are initialized) so each phase is recorded with its own start offset.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self.phases = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that records the time spent in the enclosed block as the named phase.
+        :param name:
+        :return:
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, start, self.clock())
+
+    def record(self, name, start, end):
+        with self.lock:
+            self.phases.append((name, start - self.started, end - start))
+
+    def report(self):
+        """
+        Returns a printable table of the phases sorted by start time along with the total elapsed time.
+        :return:
+        """
+        with self.lock:
+            phases = sorted(self.phases, key=lambda p: p[1])
+        lines = ["Startup Report\n==============",
+                 "{name:<20} {start:>10} {dur:>12}".format(name="phase", start="start(s)", dur="duration(s)")]
+        for name, offset, duration in phases:
+            lines.append("{name:<20} {start:>10.3f} {dur:>12.3f}".format(name=name, start=offset, dur=duration))
+        end = max([offset + duration for _, offset, duration in phases] or [0])
+        lines.append("{name:<20} {start:>10} {dur:>12.3f}".format(name="total", start="", dur=end))
+        return "\n".join(lines)
@@ -0,0 +1,235 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import os
+import re
+import random
+import itertools
+import ConfigParser
+import multiprocessing
+from hit_detector import HitDetector, SensorInitializationError
+
+SIDES = ('r', 'c', 'l')
+TRACE_FILE_PATTERN = re.compile(r'^([rcl])(\d+)\.txt$')
+# parameters that can be swept along with the config section and type used when writing them back out
+PARAMETERS = [("threshold", "sensor", float),
+              ("samples", "sensor", int),
+              ("recoil_wait", "workout", float),
+              ("stability_threshold", "sensor", float),
+              ("min_calibration_distance", "sensor", float)]
+
+# traces and replay options shared with each worker process by init_worker
+worker_traces = None
+worker_options = None
+
+
+class ReplaySensor(object):
+    """
+    Sensor that plays back recorded samples and then repeats a resting value once the recording is exhausted. It also
+    serves as the HitDetector's clock so that timeouts are measured in sample time, making replay deterministic and
+    independent of how fast the host can run the detector.
+    """
+
+    def __init__(self, samples, rate, rest=(0.0, 0.0, 0.0)):
+        self.rate = float(rate)
+        self.rest = rest
+        self.samples = samples
+        self.pos = 0
+        self.elapsed = 0
+
+    def load(self, samples):
+        """
+        Replaces the recording being played back. The clock keeps running.
+        :param samples:
+        :return:
+        """
+        self.samples = samples
+        self.pos = 0
+
+    def get_sample(self):
+        val = self.samples[self.pos] if self.pos < len(self.samples) else self.rest
+        self.pos += 1
+        self.elapsed += 1
+        return val
+
+    def clock(self):
+        return self.elapsed / self.rate
+
+
+class ReplayOptions(object):
+    """
+    Settings that control how traces are replayed. Durations are in seconds of sample time.
+    """
+
+    def __init__(self, rate=400, noise=0.2, pre_roll=0.5, calibration_timeout=5, reaction_timeout=2, seed=1):
+        self.rate = rate
+        self.noise = noise
+        self.pre_roll = pre_roll
+        self.calibration_timeout = calibration_timeout
+        self.reaction_timeout = reaction_timeout
+        self.seed = seed
+
+
+def load_traces(data_dir):
+    """
+    Reads recorded hit traces from data_dir. Files are expected to be named <side><number>.txt (for instance r1.txt)
+    and contain one comma-separated x,y,z sample per line.
+    :param data_dir:
+    :return: dictionary of side to a list of traces (each a list of 3-tuples), ordered by file number
+    """
+    traces = dict((side, []) for side in SIDES)
+    names = []
+    for file_name in os.listdir(data_dir):
+        match = TRACE_FILE_PATTERN.match(file_name)
+        if match:
+            names.append((match.group(1), int(match.group(2)), file_name))
+    for side, _, file_name in sorted(names):
+        with open(os.path.join(data_dir, file_name), "r") as in_file:
+            traces[side].append([tuple(float(x) for x in line.split(",")) for line in in_file if line.strip()])
+    return traces
+
+
+def rest_samples(count, noise, rng):
+    """
+    Returns count samples of Gaussian sensor noise around zero to simulate the bag at rest.
+    """
+    return [(rng.gauss(0, noise), rng.gauss(0, noise), rng.gauss(0, noise)) for _ in range(count)]
+
+
+def build_grid(values):
+    """
+    Expands a dictionary of parameter name to list of values into a list of parameter dictionaries covering every
+    combination.
+    :param values:
+    :return:
+    """
+    names = [name for name, _, _ in PARAMETERS if name in values]
+    return [dict(zip(names, combo)) for combo in itertools.product(*[values[name] for name in names])]
+
+
+def evaluate(params, traces, options):
+    """
+    Replays every trace through a HitDetector configured with params and returns a dictionary of metrics. Each trace
+    is used in turn as the calibration hit for its side (when there are enough traces) while the remaining traces are
+    replayed as hits preceded by a resting pre-roll. A detection during the pre-roll is a false positive.
+    :param params: dictionary of parameter values (see PARAMETERS)
+    :param traces: dictionary as returned by load_traces
+    :param options: ReplayOptions
+    :return:
+    """
+    rng = random.Random(options.seed)
+    pre_roll = int(options.pre_roll * options.rate)
+    folds = min(len(traces[side]) for side in SIDES)
+    totals = {"hits": 0, "detected": 0, "false_positives": 0, "correct_direction": 0, "settled": 0,
+              "latency": 0.0, "failed_calibrations": 0}
+    for fold in range(folds):
+        sensor = ReplaySensor(rest_samples(int(options.calibration_timeout * options.rate), options.noise, rng),
+                              options.rate)
+        try:
+            detector = HitDetector(params.get("threshold", 40), options.calibration_timeout,
+                                   int(params.get("samples", 200)), True, sensor,
+                                   stability_threshold=params.get("stability_threshold", 5),
+                                   min_calibration_distance=params.get("min_calibration_distance", 10),
+                                   clock=sensor.clock)
+            for side in SIDES:
+                sensor.load(rest_samples(pre_roll, options.noise, rng) + traces[side][fold])
+                detector.calibrate_hit(side, options.calibration_timeout)
+        except SensorInitializationError:
+            totals["failed_calibrations"] += 1
+            continue
+        if not detector.has_valid_calibration():
+            totals["failed_calibrations"] += 1
+            continue
+        for side in SIDES:
+            for idx, trace in enumerate(traces[side]):
+                if idx == fold:
+                    continue
+                totals["hits"] += 1
+                sensor.load(rest_samples(pre_roll, options.noise, rng) + trace)
+                val, is_correct = detector.wait_for_hit(side, options.reaction_timeout)
+                hit_pos = sensor.pos - 1
+                if val is None:
+                    continue
+                if hit_pos < pre_roll:
+                    totals["false_positives"] += 1
+                    continue
+                totals["detected"] += 1
+                totals["latency"] += (hit_pos - pre_roll) / float(options.rate)
+                if is_correct:
+                    totals["correct_direction"] += 1
+                # see if the bag settles before the next round would start
+                if detector.wait_for_stability(params.get("recoil_wait", 1)) is not None:
+                    totals["settled"] += 1
+    return summarize(params, totals, folds)
+
+
+def summarize(params, totals, folds):
+    hits = float(max(totals["hits"], 1))
+    detected = float(max(totals["detected"], 1))
+    result = {"params": params,
+              "calibration_rate": (folds - totals["failed_calibrations"]) / float(max(folds, 1)),
+              "detection_rate": totals["detected"] / hits,
+              "false_positive_rate": totals["false_positives"] / hits,
+              "direction_accuracy": totals["correct_direction"] / detected,
+              "settle_rate": totals["settled"] / detected,
+              "latency_ms": 1000 * totals["latency"] / detected}
+    result["score"] = score(result)
+    return result
+
+
+def score(result):
+    """
+    Single figure of merit used to rank configurations: the fraction of hits detected from the correct side, less the
+    false positive rate, scaled by the fraction of folds that could be calibrated.
+    """
+    return result["calibration_rate"] * (result["detection_rate"] * result["direction_accuracy"]
+                                         - result["false_positive_rate"])
+
+
+def init_worker(traces, options):
+    global worker_traces, worker_options
+    worker_traces = traces
+    worker_options = options
+
+
+def evaluate_in_worker(params):
+    return evaluate(params, worker_traces, worker_options)
+
+
+def sweep(grid, traces, options, workers=None):
+    """
+    Evaluates every parameter set in grid on a pool of worker processes and returns the results sorted from best to
+    worst (highest score, then lowest latency).
+    :param grid: list of parameter dictionaries
+    :param traces: dictionary as returned by load_traces
+    :param options: ReplayOptions
+    :param workers: number of worker processes. Defaults to the number of cores.
+    :return:
+    """
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(traces, options))
+    try:
+        chunk_size = max(1, len(grid) // (4 * (workers or multiprocessing.cpu_count())))
+        results = pool.map(evaluate_in_worker, grid, chunksize=chunk_size)
+    finally:
+        pool.close()
+        pool.join()
+    return sorted(results, key=lambda r: (-r["score"], r["latency_ms"]))
+
+
+def write_config(base_file, out_file, params):
+    """
+    Copies the configuration in base_file to out_file, replacing the values of any swept parameters.
+    :param base_file:
+    :param out_file:
+    :param params:
+    :return:
+    """
+    config = ConfigParser.RawConfigParser()
+    config.read(base_file)
+    for name, section, conv in PARAMETERS:
+        if name in params:
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, name, str(conv(params[name])))
+    with open(out_file, "w") as out:
+        config.write(out)
@@ -0,0 +1,244 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import os
+import json
+import time
+import zlib
+import socket
+import httplib
+import logging
+import threading
+import Queue
+import urlparse
+
+log = logging.getLogger(__name__)
+
+# maximum number of events waiting to be batched. Beyond this, new events are dropped rather than blocking the caller.
+MAX_PENDING_EVENTS = 1000
+# maximum number of batches kept on disk while the hub is unreachable. Beyond this, the oldest batch is dropped.
+MAX_QUEUED_BATCHES = 5000
+# delay before retrying after a failed upload; doubled after every consecutive failure up to MAX_RETRY_DELAY
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 300
+# how often the upload thread wakes up to check the batch deadline and retry timer when no events arrive
+POLL_INTERVAL = 1
+BATCH_SUFFIX = ".json.gz"
+
+
+class DiskQueue(object):
+    """
+    FIFO of upload batches stored as one file per batch in directory so batches survive network outages and reboots.
+    Files are written under a temporary name and then renamed so a power loss never leaves a partial batch behind.
+    Batches are stored exactly as they will be sent (gzip compressed JSON) so they are only compressed once.
+    """
+
+    def __init__(self, directory, max_batches=MAX_QUEUED_BATCHES):
+        self.directory = directory
+        self.max_batches = max_batches
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.names = sorted(n for n in os.listdir(directory) if n.endswith(BATCH_SUFFIX))
+        self.dropped = 0
+
+    def put(self, batch_id, body):
+        """
+        Stores a batch, dropping the oldest batch if the queue is full.
+        :param batch_id: unique, sortable id of the batch
+        :param body: compressed batch
+        :return:
+        """
+        name = batch_id + BATCH_SUFFIX
+        tmp_path = os.path.join(self.directory, name + ".tmp")
+        with open(tmp_path, "wb") as out:
+            out.write(body)
+        os.rename(tmp_path, os.path.join(self.directory, name))
+        self.names.append(name)
+        while len(self.names) > self.max_batches:
+            log.warning("Upload queue is full; dropping batch {name}".format(name=self.names[0]))
+            self.remove(self.names[0])
+            self.dropped += 1
+
+    def peek(self):
+        """
+        Returns a tuple of (name, body) for the oldest batch or None if the queue is empty.
+        """
+        if not self.names:
+            return None
+        with open(os.path.join(self.directory, self.names[0]), "rb") as in_file:
+            return self.names[0], in_file.read()
+
+    def remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError as e:
+            log.error("Could not remove queued batch {name}: {msg}".format(name=name, msg=e))
+        self.names.remove(name)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class HubUploader(object):
+    """
+    Uploads workout events to a central hub. Events are handed to record() (the same interface as HistoryLog), which
+    never blocks: they are put on a bounded in-memory queue and, if that is full, dropped and counted. A background
+    thread groups events into batches of up to batch_size events or batch_interval seconds (whichever comes first, and
+    always at the end of a workout), compresses each batch into a DiskQueue and then POSTs the queued batches, oldest
+    first, over a single keep-alive connection. Failed uploads are retried with exponential backoff; batches stay on
+    disk until the hub acknowledges them.
+    """
+
+    def __init__(self, url, queue_dir, device=None, batch_size=100, batch_interval=30, timeout=10,
+                 max_pending=MAX_PENDING_EVENTS, max_batches=MAX_QUEUED_BATCHES, clock=time.time):
+        """
+        :param url: http or https URL the batches are POSTed to
+        :param queue_dir: directory used to store batches until they are uploaded
+        :param device: name identifying this bag to the hub. Defaults to the host name.
+        :param batch_size: maximum number of events in a batch
+        :param batch_interval: maximum seconds an event waits before its batch is queued for upload
+        :param timeout: socket timeout in seconds for uploads
+        :param max_pending: maximum number of events waiting to be batched
+        :param max_batches: maximum number of batches kept on disk
+        :param clock:
+        """
+        parsed = urlparse.urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ValueError("Invalid hub URL {url}".format(url=url))
+        self.url = parsed
+        self.device = device if device else socket.gethostname()
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.pending = Queue.Queue(max_pending)
+        self.queue = DiskQueue(queue_dir, max_batches)
+        self.conn = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.batch_seq = 0
+        self.uploaded = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name="hub-uploader")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def record(self, event_type, timestamp=None, **fields):
+        """
+        Queues an event for upload without blocking. If the uploader has fallen too far behind the event is dropped.
+        :param event_type:
+        :param timestamp: epoch seconds. Defaults to now.
+        :param fields:
+        :return:
+        """
+        fields["type"] = event_type
+        fields["time"] = round(timestamp if timestamp is not None else time.time(), 4)
+        try:
+            self.pending.put_nowait(fields)
+        except Queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                log.warning("Hub uploader is behind; {n} events dropped".format(n=self.dropped))
+
+    def get_stats(self):
+        return {"pending": self.pending.qsize(), "queued_batches": len(self.queue), "uploaded": self.uploaded,
+                "dropped": self.dropped + self.queue.dropped, "last_error": self.last_error}
+
+    def close(self, timeout=None):
+        """
+        Stops the upload thread after queuing any pending events to disk (so they are uploaded after the next start)
+        and making a final upload attempt.
+        :param timeout: maximum seconds to wait for the thread to stop
+        :return:
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.__disconnect()
+
+    def __run(self):
+        events = []
+        batch_deadline = None
+        retry_at = 0
+        retry_delay = RETRY_DELAY
+        while True:
+            stopping = self.stopping.is_set()
+            try:
+                event = self.pending.get(timeout=POLL_INTERVAL) if not stopping else self.pending.get_nowait()
+                events.append(event)
+                if batch_deadline is None:
+                    batch_deadline = self.clock() + self.batch_interval
+                # keep draining without uploading until the batch is complete
+                if len(events) < self.batch_size and event["type"] != "workout_end" and \
+                        self.clock() < batch_deadline:
+                    continue
+            except Queue.Empty:
+                pass
+            if events and (len(events) >= self.batch_size or events[-1]["type"] == "workout_end" or stopping or
+                           self.clock() >= batch_deadline):
+                self.__queue_batch(events)
+                events = []
+                batch_deadline = None
+            if len(self.queue) and (self.clock() >= retry_at or stopping):
+                if self.__upload_queued():
+                    retry_delay = RETRY_DELAY
+                else:
+                    retry_at = self.clock() + retry_delay
+                    retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+            if stopping and not events and self.pending.empty():
+                break
+
+    def __queue_batch(self, events):
+        self.batch_seq += 1
+        # ids sort in creation order and stay unique across restarts so the hub can discard re-sent batches
+        batch_id = "{ms:013d}-{seq:06d}".format(ms=int(time.time() * 1000), seq=self.batch_seq % 1000000)
+        payload = json.dumps({"device": self.device, "batch": batch_id, "events": events}, separators=(',', ':'))
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        try:
+            self.queue.put(batch_id, compressor.compress(payload) + compressor.flush())
+        except (IOError, OSError) as e:
+            self.dropped += len(events)
+            log.error("Could not queue batch of {n} events: {msg}".format(n=len(events), msg=e))
+
+    def __upload_queued(self):
+        """
+        Uploads queued batches until the queue is empty, an upload fails or new events are waiting.
+        :return: False if an upload failed
+        """
+        while len(self.queue):
+            name, body = self.queue.peek()
+            try:
+                self.__post(body)
+            except (IOError, httplib.HTTPException) as e:
+                self.last_error = str(e)
+                log.warning("Could not upload batch {name}: {msg}".format(name=name, msg=e))
+                self.__disconnect()
+                return False
+            self.queue.remove(name)
+            self.uploaded += 1
+            if not self.pending.empty() and not self.stopping.is_set():
+                break
+        return True
+
+    def __post(self, body):
+        if self.conn is None:
+            conn_class = httplib.HTTPSConnection if self.url.scheme == "https" else httplib.HTTPConnection
+            self.conn = conn_class(self.url.netloc, timeout=self.timeout)
+        self.conn.request("POST", self.url.path or "/", body, {"Content-Type": "application/json",
+                                                               "Content-Encoding": "gzip",
+                                                               "Connection": "keep-alive"})
+        resp = self.conn.getresponse()
+        resp.read()
+        if resp.status >= 300:
+            raise IOError("Hub responded with {status} {reason}".format(status=resp.status, reason=resp.reason))
+        if resp.will_close:
+            self.__disconnect()
+
+    def __disconnect(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
@@ -0,0 +1,127 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import math
+import threading
+from collections import OrderedDict
+
+# samples are decimated in fixed, aligned chunks so the work for a chunk is shared by every viewer
+CHUNK_SAMPLES = 128
+# requested points-per-second budgets are rounded down to one of these levels to bound the number of cached variants
+PPS_LEVELS = (25, 50, 100, 200, 400, 800)
+# number of samples either side of a detected hit that are always sent at full resolution
+HIT_WINDOW_BEFORE = 32
+HIT_WINDOW_AFTER = 160
+# maximum number of chunks returned by a single call (older data is skipped)
+MAX_CHUNKS_PER_RESPONSE = 32
+# number of chunks sent to a new viewer that doesn't have a cursor yet
+INITIAL_CHUNKS = 8
+
+
+class WaveformStreamer(object):
+    """
+    Serves the live acceleration waveform recorded in a SampleRingBuffer downsampled to a points-per-second budget.
+    Each aligned chunk of samples is decimated once per budget level and cached, so the CPU cost depends on the sample
+    rate and not on the number of viewers. Samples around detected hits are kept at full resolution.
+    """
+
+    def __init__(self, ring, cache_size=512):
+        self.ring = ring
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_points(self, since=None, points_per_second=100):
+        """
+        Returns the waveform since the sequence number since as a dictionary with the keys:
+        next - value to pass as since on the next call
+        points - list of [timestamp, x, y, z, magnitude] lists
+        hits - timestamps of detected hits included in points
+        Only complete chunks are returned so the newest data may lag by up to CHUNK_SAMPLES samples.
+        :param since: sequence number returned as next by the previous call, or None for a new viewer
+        :param points_per_second: target number of points per second of data
+        :return:
+        """
+        pps = get_level(points_per_second)
+        end_chunk = self.ring.written.value // CHUNK_SAMPLES
+        oldest_chunk = -(-(self.ring.written.value - self.ring.capacity) // CHUNK_SAMPLES)
+        if since is None:
+            start_chunk = end_chunk - INITIAL_CHUNKS
+        else:
+            start_chunk = -(-since // CHUNK_SAMPLES)
+        start_chunk = max(start_chunk, oldest_chunk, end_chunk - MAX_CHUNKS_PER_RESPONSE, 0)
+        marks = self.ring.get_hit_marks()
+        points = []
+        hits = []
+        for chunk in range(start_chunk, end_chunk):
+            chunk_points, chunk_hits = self.__get_chunk(chunk, pps, marks)
+            points.extend(chunk_points)
+            hits.extend(chunk_hits)
+        return {"next": end_chunk * CHUNK_SAMPLES, "points": points, "hits": hits}
+
+    def __get_chunk(self, chunk, pps, marks):
+        start = chunk * CHUNK_SAMPLES
+        end = start + CHUNK_SAMPLES
+        # hits affect the result so they are part of the key; a hit marked after a chunk was cached invalidates it
+        nearby = tuple(m for m in marks if start - HIT_WINDOW_AFTER <= m < end + HIT_WINDOW_BEFORE)
+        key = (chunk, pps, nearby)
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        samples = self.ring.read_range(start, end)
+        if len(samples) < CHUNK_SAMPLES:
+            # part of the chunk was overwritten; it is too old to be worth sending
+            return [], []
+        result = downsample(samples, start, pps, nearby)
+        with self.lock:
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+
+def get_level(points_per_second):
+    """
+    Returns the largest PPS_LEVELS entry that doesn't exceed points_per_second (or the smallest level).
+    """
+    eligible = [level for level in PPS_LEVELS if level <= points_per_second]
+    return eligible[-1] if eligible else PPS_LEVELS[0]
+
+
+def downsample(samples, first_seq, points_per_second, hit_marks=()):
+    """
+    Reduces a list of (timestamp, x, y, z) samples to roughly points_per_second points per second using min/max
+    buckets on the magnitude: each bucket contributes its lowest and highest magnitude samples in time order, which
+    preserves peaks that simple decimation would drop. Samples within the hit window of any of hit_marks are kept.
+    :param samples:
+    :param first_seq: sequence number of samples[0]
+    :param points_per_second:
+    :param hit_marks: sequence numbers of detected hits
+    :return: tuple of (points, hit timestamps)
+    """
+    points = [[round(s[0], 4), round(s[1], 3), round(s[2], 3), round(s[3], 3),
+               round(math.sqrt(s[1] * s[1] + s[2] * s[2] + s[3] * s[3]), 3)] for s in samples]
+    keep = [False] * len(points)
+    hits = []
+    for mark in hit_marks:
+        lo = max(0, mark - HIT_WINDOW_BEFORE - first_seq)
+        hi = min(len(points), mark + HIT_WINDOW_AFTER - first_seq)
+        for i in range(lo, hi):
+            keep[i] = True
+        if 0 <= mark - first_seq < len(points):
+            hits.append(points[mark - first_seq][0])
+    duration = samples[-1][0] - samples[0][0]
+    bucket_count = max(1, int(round(duration * points_per_second / 2.0)))
+    bucket_size = max(1, -(-len(points) // bucket_count))
+    result = []
+    for b in range(0, len(points), bucket_size):
+        bucket = range(b, min(b + bucket_size, len(points)))
+        if any(keep[i] for i in bucket):
+            result.extend(points[i] for i in bucket)
+            continue
+        lo = min(bucket, key=lambda i: points[i][4])
+        hi = max(bucket, key=lambda i: points[i][4])
+        for i in sorted(set((lo, hi))):
+            result.append(points[i])
+    return result, hits
@@ -3,14 +3,34 @@ __author__ = 'Christopher Fagiani'
 """
 
 import ConfigParser
+import os
+import json
+import math
 import time
 import logging
+import threading
 from random import randrange
 from random import randint
-from hit_detector import SensorInitializationError
+from hit_detector import SensorInitializationError, READY, SETTINGS as DETECTOR_SETTINGS
+from startup import StartupTimer
 
 log = logging.getLogger(__name__)
 
+# seconds spent testing each candidate rate when the sensor rate is set to auto
+AUTO_RATE_TEST_DURATION = 0.25
+# number of rounds in a row that can fail with sensor errors before the workout is ended
+MAX_CONSECUTIVE_SENSOR_ERRORS = 5
+# seconds to wait at shutdown for queued events to be written to disk and a last upload attempt
+UPLOADER_CLOSE_TIMEOUT = 15
+# settings that can be reloaded while running, mapped to the WorkoutController attribute holding them. The detector
+# settings (see hit_detector.SETTINGS) can also be reloaded. Anything else requires a restart.
+CONTROLLER_SETTINGS = {"calibration_timeout": "calibration_timeout",
+                       "reaction_timeout": "hit_timeout",
+                       "recoil_wait": "recoil_wait",
+                       "random_delay": "random_delay",
+                       "calibration_hits": "calibration_hits",
+                       "detect_direction": "detect_dir"}
+
 
 class WorkoutController(object):
     """
@@ -18,37 +38,97 @@ class WorkoutController(object):
     the led_controls to signal the user to hit the bag and the hit_detector to wait for the hit.
     """
 
-    def __init__(self, conf_file, controller=None, detector=None):
+    def __init__(self, conf_file, controller=None, detector=None, timer=None, watch_config=False):
+        """
+        Reads the configuration and initializes the hardware. Sensor calibration is started first and runs in the
+        background while the LEDs are initialized so the constructor returns without waiting for the bag to settle;
+        use get_readiness to check on the calibration. Phase timings are recorded in timer (a StartupTimer), if supplied.
+        If watch_config is set, changes to conf_file are reloaded automatically (see reload_config).
+        """
+        self.startup_timer = timer if timer is not None else StartupTimer()
         try:
-            # read the configuration file
-            config = ConfigParser.RawConfigParser()
-            config.read(conf_file)
-            self.cur_workout = None
-            self.is_running = False
-            self.detect_dir = config.getboolean("workout", "detect_direction")
-            self.calibration_timeout = config.getint("sensor", "calibration_timeout")
-            self.random_delay = config.getboolean("workout", "random_delay")
-            if controller:
-                self.led_controller = controller
-            else:
-                from engine.io import led_controls
-                # initialize the led_controller by building a dictionary of light_id to pins
-                self.led_controller = led_controls.LedController({"r": config.getint("lights", "right"),
-                                                                  "l": config.getint("lights", "left"),
-                                                                  "c": config.getint("lights", "center")})
-
-            self.hit_timeout = config.getfloat("workout", "reaction_timeout")
-            self.recoil_wait = config.getfloat("workout", "recoil_wait")
-            self.calibration_hits = config.getint("workout", "calibration_hits")
+            with self.startup_timer.phase("config"):
+                # read the configuration file
+                config = ConfigParser.RawConfigParser()
+                config.read(conf_file)
+                self.conf_file = conf_file
+                # the configuration the process started with. Options that can't be reloaded keep these values until
+                # a restart, so changes are compared against it rather than the last reload.
+                self.config = config
+                # the last successfully read configuration file and the overrides made over HTTP on top of it
+                self.file_config = config
+                self.overrides = {}
+                self.restart_required = []
+                self.cur_workout = None
+                self.is_running = False
+                self.settings = read_settings(config)
+                for name, attr in CONTROLLER_SETTINGS.iteritems():
+                    setattr(self, attr, self.settings[name])
+                self.pending_settings = None
+                self.settings_lock = threading.Lock()
+                # serializes reloads from the config watcher and over HTTP, which both read and replace the overrides
+                self.reload_lock = threading.Lock()
+                self.config_watcher = None
+                self.history = get_history(config, conf_file)
+                self.uploader = get_uploader(config, conf_file)
+                self.samples_saved = 0
+
+            # a list so that selecting the sensor rate first can move the start of the calibration phase
+            calibration_start = [self.startup_timer.clock()]
+
+            def calibration_done(status):
+                self.startup_timer.record("sensor calibration", calibration_start[0], self.startup_timer.clock())
+                log.info("Sensor calibration finished with status {status}".format(status=status))
+
+            self.waveform = None
+            self.analytics = None
             if detector:
                 self.hit_detector = detector
+                self.sample_ring = getattr(detector, "ring", None)
+            elif get_acquisition_mode(config) == "process":
+                from acquisition import RemoteHitDetector
+                # run the sensor and hit_detector in their own process so they do not compete with the UI for the GIL
+                self.hit_detector = RemoteHitDetector(config.getfloat("sensor", "threshold"),
+                                                      config.getfloat("sensor", "calibration_timeout"),
+                                                      config.getint("sensor", "samples"),
+                                                      sensor_factory=lambda: build_sensor(config),
+                                                      background=True, on_ready=calibration_done,
+                                                      **get_detector_options(config))
+                self.sample_ring = self.hit_detector.ring
             else:
                 import hit_detector
-                # initialize the hit_detector
+                from acquisition import SampleRingBuffer, RecordingSensor
+                # record the samples read by the detector so the UI can display the waveform
+                self.sample_ring = SampleRingBuffer()
+                sensor = build_sensor(config, select_rate=False)
+                select_rate = None
+                if uses_auto_rate(config):
+                    def select_rate():
+                        # testing each rate takes over a second so it runs on the calibration thread, as it does
+                        # in the acquisition process, rather than holding up the LEDs and UI
+                        with self.startup_timer.phase("sensor rate"):
+                            select_sensor_rate(sensor)
+                        calibration_start[0] = self.startup_timer.clock()
+                # initialize the hit_detector. Calibration continues on a background thread.
                 self.hit_detector = hit_detector.HitDetector(config.getfloat("sensor", "threshold"),
                                                              config.getfloat("sensor", "calibration_timeout"),
                                                              config.getint("sensor", "samples"),
-                                                             detect_dir=self.detect_dir)
+                                                             sensor=RecordingSensor(sensor, self.sample_ring),
+                                                             background=True, on_ready=calibration_done,
+                                                             prepare=select_rate, **get_detector_options(config))
+
+            with self.startup_timer.phase("leds"):
+                if controller:
+                    self.led_controller = controller
+                else:
+                    from engine.io import led_controls
+                    # initialize the led_controller by building a dictionary of light_id to pins
+                    self.led_controller = led_controls.LedController({"r": config.getint("lights", "right"),
+                                                                      "l": config.getint("lights", "left"),
+                                                                      "c": config.getint("lights", "center")})
+            if watch_config:
+                from config_watcher import ConfigWatcher
+                self.config_watcher = ConfigWatcher(conf_file, self.reload_config).start()
         except BaseException as e:
             # if we had an error during initialization call clean-up so we can release any resources
             try:
@@ -61,6 +141,20 @@ class WorkoutController(object):
     def has_valid_calibration(self):
         return self.hit_detector.has_valid_calibration()
 
+    def get_readiness(self):
+        """
+        Returns the status of the sensor calibration: calibrating, ready or failed.
+        :return:
+        """
+        if hasattr(self.hit_detector, "get_status"):
+            return self.hit_detector.get_status()
+        return READY
+
+    def wait_until_ready(self, timeout=None):
+        if hasattr(self.hit_detector, "wait_until_ready"):
+            return self.hit_detector.wait_until_ready(timeout)
+        return True
+
     def calibrate_orientation(self):
         """
         Since we do not know how the hardware was mounted on the bag, we need to ask the user to hit the bag on each side
@@ -70,6 +164,7 @@ class WorkoutController(object):
         :param timeout:
         :return:
         """
+        self.apply_pending_settings()
         for i in range(self.calibration_hits):
             self.led_controller.flash()
             self.led_controller.activate_lights('r')
@@ -101,30 +196,61 @@ class WorkoutController(object):
         """
         self.is_running = True
         deadline = time.time() + workout_time * 60
-        self.cur_workout = WorkoutState(deadline)
+        self.cur_workout = WorkoutState(deadline, self.history, mode=mode, uploader=self.uploader)
+        if self.sample_ring is not None:
+            self.samples_saved = self.sample_ring.written.value
         round_num = 0
         hit_count = 0
         miss_count = 0
         sides = ['r', 'c', 'l']
+        sensor_errors = 0
         validate_frequencies(frequencies)
         while time.time() < deadline and self.is_running:
-            self.led_controller.activate_lights('')
-            self.hit_detector.wait_for_stability(self.recoil_wait)
-            if self.random_delay:
-                time.sleep(randint(0, 4))
-            if mode == 'random':
-                side = get_next_side(frequencies)
-            else:
-                side = sides[round_num % 3]
-            if self.await_hit(side):
-                hit_count += 1
-            else:
-                miss_count += 1
+            try:
+                self.apply_pending_settings()
+                self.led_controller.activate_lights('')
+                self.hit_detector.wait_for_stability(self.recoil_wait)
+                if self.random_delay:
+                    time.sleep(randint(0, 4))
+                if mode == 'random':
+                    side = get_next_side(frequencies)
+                else:
+                    side = sides[round_num % 3]
+                if self.await_hit(side):
+                    hit_count += 1
+                else:
+                    miss_count += 1
+                sensor_errors = 0
+            except IOError as e:
+                # the sensor has already retried and re-initialized the bus so give up on this round but keep going
+                sensor_errors += 1
+                self.cur_workout.record_sensor_error()
+                log.error("Sensor error during round {num}: {msg}".format(num=round_num, msg=e))
+                if sensor_errors >= MAX_CONSECUTIVE_SENSOR_ERRORS:
+                    log.error("Ending workout after {n} consecutive sensor errors".format(n=sensor_errors))
+                    break
+                time.sleep(self.recoil_wait)
+            self.save_samples()
             round_num += 1
         self.led_controller.activate_lights('')
         self.is_running = False
+        self.cur_workout.finish()
         return self.cur_workout
 
+    def save_samples(self):
+        """
+        Appends the samples read since the last call to the history, if sample recording is enabled.
+        :return:
+        """
+        if self.history is None or not self.history.record_samples or self.sample_ring is None:
+            return
+        end = self.sample_ring.written.value
+        if end - self.samples_saved > self.sample_ring.capacity:
+            log.warning("Sample history is missing {n} samples".format(
+                n=end - self.samples_saved - self.sample_ring.capacity))
+        self.history.record_sample_block(self.sample_ring.read_range(self.samples_saved, end))
+        self.samples_saved = end
+
     def await_hit(self, side):
         """
         Turns on a light and waits for the hit_detector to register a hit.
@@ -136,23 +262,387 @@ class WorkoutController(object):
         hit_val, is_correct = self.hit_detector.wait_for_hit(side, self.hit_timeout)
         reaction_time = time.time() - start_time
         if hit_val:
-            self.cur_workout.record_hit(side, reaction_time, is_correct)
+            if self.sample_ring is not None:
+                # the detector stops reading when the threshold is crossed so the last sample in the ring is the hit.
+                # Its timestamp leaves out the time taken to return the result (an RPC in process mode).
+                hit_time = self.sample_ring.mark_hit()
+                if hit_time is not None and start_time <= hit_time:
+                    reaction_time = hit_time - start_time
+            self.cur_workout.record_hit(side, reaction_time, is_correct, self.measure_force(hit_val))
         if is_correct:
             return hit_val
         else:
             return None
 
+    def measure_force(self, hit_val):
+        """
+        Returns the peak change in acceleration of the impact that started with hit_val. Detectors that can't follow
+        the impact report the magnitude of hit_val itself.
+        :param hit_val:
+        :return:
+        """
+        if hasattr(self.hit_detector, "measure_peak"):
+            try:
+                return self.hit_detector.measure_peak(hit_val)
+            except IOError as e:
+                log.warning("Could not measure the peak of a hit: {msg}".format(msg=e))
+        return get_force(hit_val)
+
+    def reload_config(self, updates=None):
+        """
+        Reloads the configuration and stages the new settings to be applied at the start of the next round (or
+        calibration). Without updates the configuration file is re-read; otherwise updates, a dictionary of section
+        name to a dictionary of option values, is added to the overrides. The overrides are applied on top of the file
+        every time it is reloaded, until a restart. Invalid values raise a ConfigurationError and leave the current
+        settings in place. The sensor baseline and orientation calibration are kept.
+        :param updates:
+        :return: dictionary with the staged settings and the options that differ from those the process started with
+        but only take effect after a restart
+        """
+        with self.reload_lock:
+            if updates is None:
+                file_config = ConfigParser.RawConfigParser()
+                if not file_config.read(self.conf_file):
+                    raise ConfigurationError("Could not read {conf}".format(conf=self.conf_file))
+                overrides = self.overrides
+            else:
+                file_config = self.file_config
+                overrides = merge_updates(self.overrides, updates)
+            config = copy_config(file_config, overrides)
+            settings = read_settings(config)
+            restart_required = get_restart_options(self.config, config, settings)
+            if restart_required:
+                log.warning("Changes to {opts} require a restart".format(opts=", ".join(restart_required)))
+            with self.settings_lock:
+                self.file_config = file_config
+                self.overrides = overrides
+                self.restart_required = restart_required
+                self.pending_settings = settings
+        log.info("Staged configuration reload")
+        return {"settings": settings, "restart_required": restart_required}
+
+    def apply_pending_settings(self):
+        """
+        Swaps in any settings staged by reload_config. This is called by the workout thread between rounds so the
+        detector is never reconfigured while waiting for a hit.
+        :return:
+        """
+        with self.settings_lock:
+            settings = self.pending_settings
+            self.pending_settings = None
+        if settings is None:
+            return
+        if hasattr(self.hit_detector, "update_settings"):
+            self.hit_detector.update_settings(dict((name, settings[name]) for name in DETECTOR_SETTINGS
+                                                   if name in settings))
+        for name, attr in CONTROLLER_SETTINGS.iteritems():
+            setattr(self, attr, settings[name])
+        self.settings = settings
+        log.info("Applied reloaded configuration")
+
+    def get_settings(self):
+        """
+        Returns the settings in use along with any staged by reload_config that have not been applied yet and the
+        changed options that are waiting for a restart.
+        :return:
+        """
+        return {"settings": self.settings, "pending": self.pending_settings, "restart_required": self.restart_required}
+
     def cleanup(self):
-        self.led_controller.cleanup()
+        if getattr(self, "config_watcher", None) is not None:
+            self.config_watcher.stop()
+        if hasattr(self, "led_controller"):
+            self.led_controller.cleanup()
+        detector = getattr(self, "hit_detector", None)
+        if hasattr(detector, "close"):
+            detector.close()
+        if getattr(self, "uploader", None) is not None:
+            self.uploader.close(UPLOADER_CLOSE_TIMEOUT)
 
     def get_state(self):
-        self.cur_workout.server_time = time.time()
-        return self.cur_workout
+        """
+        Returns the latest published StateSnapshot of the current workout. This never touches the lists being
+        appended to by the workout thread so it is safe to call from any thread.
+        :return:
+        """
+        return self.cur_workout.snapshot
+
+    def get_sensor_stats(self):
+        """
+        Returns the sensor's sample rate and error counters, or None if the sensor does not track them.
+        :return:
+        """
+        if hasattr(self.hit_detector, "get_sensor_stats"):
+            return self.hit_detector.get_sensor_stats()
+        return None
+
+    def get_waveform(self, since=None, points_per_second=100):
+        """
+        Returns the live acceleration waveform downsampled to points_per_second. See WaveformStreamer.get_points.
+        :param since:
+        :param points_per_second:
+        :return:
+        """
+        if self.sample_ring is None:
+            return {"next": 0, "points": [], "hits": []}
+        if self.waveform is None:
+            from waveform import WaveformStreamer
+            self.waveform = WaveformStreamer(self.sample_ring)
+        return self.waveform.get_points(since, points_per_second)
+
+    def get_analytics(self, workout=None):
+        """
+        Returns the analytics of a workout as JSON (see analytics.analyze), or None if the workout can't be found.
+        :param workout: start time of a workout in the history. Defaults to the current (or last) workout.
+        :return:
+        """
+        if self.analytics is None:
+            from analytics import SessionAnalytics
+            self.analytics = SessionAnalytics(self.history.history_dir if self.history is not None else None)
+        current = self.cur_workout
+        if current is not None and (workout is None or workout == current.server_time):
+            return self.analytics.for_state(current)
+        if workout is None:
+            return None
+        return self.analytics.for_workout(workout)
+
+    def export(self, kind="events", fmt="csv", start=None, end=None, compress=False):
+        """
+        Returns a generator streaming the recorded history. See export.export.
+        :return:
+        """
+        if self.history is None:
+            raise ConfigurationError("Workout history is not enabled")
+        import export
+        return export.export(self.history.history_dir, kind, fmt, start, end, compress)
 
     def stop_workout(self):
         self.is_running = False
 
 
+def read_settings(config):
+    """
+    Reads and validates the settings that can be changed while running (see CONTROLLER_SETTINGS and
+    hit_detector.SETTINGS). The optional detector settings are only included if present.
+    :param config:
+    :return: dictionary of setting name to value
+    """
+    try:
+        settings = {"threshold": config.getfloat("sensor", "threshold"),
+                    "samples": config.getint("sensor", "samples"),
+                    "calibration_timeout": config.getfloat("sensor", "calibration_timeout"),
+                    "reaction_timeout": config.getfloat("workout", "reaction_timeout"),
+                    "recoil_wait": config.getfloat("workout", "recoil_wait"),
+                    "calibration_hits": config.getint("workout", "calibration_hits"),
+                    "detect_direction": config.getboolean("workout", "detect_direction"),
+                    "random_delay": config.getboolean("workout", "random_delay")}
+        for name in ("stability_threshold", "min_calibration_distance"):
+            if config.has_option("sensor", name):
+                settings[name] = config.getfloat("sensor", name)
+    except (ValueError, ConfigParser.Error) as e:
+        raise ConfigurationError("Invalid configuration: {msg}".format(msg=e))
+    for name in ("threshold", "samples", "calibration_timeout", "reaction_timeout", "calibration_hits",
+                 "stability_threshold"):
+        if name in settings and settings[name] <= 0:
+            raise ConfigurationError("{name} must be greater than 0".format(name=name))
+    for name in ("recoil_wait", "min_calibration_distance"):
+        if name in settings and settings[name] < 0:
+            raise ConfigurationError("{name} must not be negative".format(name=name))
+    return settings
+
+
+def copy_config(config, updates):
+    """
+    Returns a copy of config with the values in updates (a dictionary of section name to a dictionary of option
+    values) applied.
+    :param config:
+    :param updates:
+    :return:
+    """
+    copy = ConfigParser.RawConfigParser()
+    for section in config.sections():
+        copy.add_section(section)
+        for name, value in config.items(section):
+            copy.set(section, name, value)
+    try:
+        for section, values in updates.iteritems():
+            if not copy.has_section(section):
+                copy.add_section(section)
+            for name, value in values.iteritems():
+                copy.set(section, name, str(value))
+    except AttributeError:
+        raise ConfigurationError("Updates must map section names to dictionaries of options")
+    return copy
+
+
+def merge_updates(overrides, updates):
+    """
+    Returns a new dictionary of section name to option values with updates (in the same form) applied on top of
+    overrides.
+    :param overrides:
+    :param updates:
+    :return:
+    """
+    merged = dict((section, dict(values)) for section, values in overrides.iteritems())
+    try:
+        for section, values in updates.iteritems():
+            merged.setdefault(section, {}).update((name.lower(), str(value)) for name, value in values.iteritems())
+    except AttributeError:
+        raise ConfigurationError("Updates must map section names to dictionaries of options")
+    return merged
+
+
+def get_restart_options(old, new, settings):
+    """
+    Returns a sorted list of section.option names whose value differs between the old and new configurations but
+    that can't be changed without a restart.
+    """
+    reloadable = set(settings.keys())
+    changed = []
+    for section in set(old.sections()) | set(new.sections()):
+        old_values = dict(old.items(section)) if old.has_section(section) else {}
+        new_values = dict(new.items(section)) if new.has_section(section) else {}
+        for name in set(old_values) | set(new_values):
+            if old_values.get(name) != new_values.get(name) and name not in reloadable:
+                changed.append("{section}.{name}".format(section=section, name=name))
+    return sorted(changed)
+
+
+def get_history(config, conf_file=None):
+    """
+    Returns a HistoryLog for the directory specified in the history section of the configuration, or None if history
+    is not configured.
+    :param config:
+    :param conf_file: path of the configuration file; a relative history directory is resolved against its directory
+    :return:
+    """
+    history_dir = get_history_dir(config, conf_file)
+    if history_dir is None:
+        return None
+    from history import HistoryLog
+    record_samples = config.has_option("history", "record_samples") and config.getboolean("history", "record_samples")
+    return HistoryLog(history_dir, record_samples)
+
+
+def get_history_dir(config, conf_file=None):
+    """
+    Returns the history directory from the configuration without creating it, or None if history is not configured.
+    :param config:
+    :param conf_file:
+    :return:
+    """
+    if not config.has_option("history", "dir"):
+        return None
+    return resolve_path(config.get("history", "dir"), conf_file)
+
+
+def resolve_path(path, conf_file):
+    """
+    Returns path relative to the directory containing conf_file (unless it is absolute or there is no conf_file) so
+    that files end up in the same place whichever directory sparpi is started from.
+    :param path:
+    :param conf_file:
+    :return:
+    """
+    path = os.path.expanduser(path)
+    if conf_file is None or os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(conf_file)), path)
+
+
+def get_acquisition_mode(config):
+    """
+    Returns the configured sensor acquisition mode: "thread" (the default) reads the sensor on the workout thread
+    while "process" reads it in a dedicated acquisition process.
+    :param config:
+    :return:
+    """
+    mode = "thread"
+    if config.has_option("sensor", "acquisition"):
+        mode = config.get("sensor", "acquisition")
+    if mode not in ("thread", "process"):
+        raise ConfigurationError("Unknown acquisition mode {mode}".format(mode=mode))
+    return mode
+
+
+def build_sensor(config, select_rate=True):
+    """
+    Creates the accelerometer using the transport (i2c or spi) specified in the sensor section of the configuration.
+    If the rate is auto and select_rate is False, the sensor is left at the default rate and the caller is expected to
+    call select_sensor_rate.
+    :param config:
+    :param select_rate:
+    :return:
+    """
+    from engine.io import accel
+    name = "i2c"
+    if config.has_option("sensor", "transport"):
+        name = config.get("sensor", "transport")
+    if name not in ("i2c", "spi"):
+        raise ConfigurationError("Unknown sensor transport {name}".format(name=name))
+    options = {}
+    for option in ("i2c_bus", "spi_bus", "spi_device", "spi_speed"):
+        if config.has_option("sensor", option):
+            options[option] = config.getint("sensor", option)
+    rate = str(accel.DEFAULT_RATE)
+    if config.has_option("sensor", "rate"):
+        rate = config.get("sensor", "rate")
+    if rate != "auto" and (not rate.isdigit() or int(rate) not in accel.DATA_RATES):
+        raise ConfigurationError("Sensor rate must be auto or one of {rates}".format(rates=sorted(accel.DATA_RATES)))
+    g_range = accel.DEFAULT_RANGE
+    if config.has_option("sensor", "range"):
+        g_range = config.getint("sensor", "range")
+    if g_range not in accel.RANGES:
+        raise ConfigurationError("Sensor range must be one of {ranges}".format(ranges=sorted(accel.RANGES)))
+    sensor = accel.Accelerometer(transport=accel.create_transport(name, **options),
+                                 rate=accel.DEFAULT_RATE if rate == "auto" else int(rate), g_range=g_range)
+    if rate == "auto" and select_rate:
+        select_sensor_rate(sensor)
+    return sensor
+
+
+def uses_auto_rate(config):
+    """
+    Returns True if the configuration asks for the sensor rate to be selected at startup.
+    :param config:
+    :return:
+    """
+    return config.has_option("sensor", "rate") and config.get("sensor", "rate") == "auto"
+
+
+def select_sensor_rate(sensor):
+    """
+    Configures the sensor with the highest rate this bus and cable can actually keep up with.
+    :param sensor:
+    :return:
+    """
+    from engine.io import rate_test
+    rate_test.select_rate(sensor, duration=AUTO_RATE_TEST_DURATION)
+
+
+def get_detector_options(config):
+    """
+    Returns the optional HitDetector keyword arguments specified in the configuration.
+    :param config:
+    :return:
+    """
+    options = {"detect_dir": config.getboolean("workout", "detect_direction")}
+    for name in ("stability_threshold", "min_calibration_distance"):
+        if config.has_option("sensor", name):
+            options[name] = config.getfloat("sensor", name)
+    return options
+
+
+def get_force(hit_val):
+    """
+    Returns the magnitude of the change in acceleration reported for a hit, or None if the detector doesn't report it.
+    """
+    try:
+        return math.sqrt(sum(v * v for v in hit_val))
+    except TypeError:
+        return None
+
+
 def validate_frequencies(frequencies):
     """
     Validates that the frequencies passed in add up to 100 and do not contain negatives.
@@ -177,28 +667,146 @@ def get_next_side(frequencies):
             last_weight += weight
 
 
+def get_uploader(config, conf_file=None):
+    """
+    Returns a started HubUploader if a hub url is specified in the hub section of the configuration, otherwise None.
+    :param config:
+    :param conf_file: path of the configuration file; a relative queue directory is resolved against its directory
+    :return:
+    """
+    if not config.has_option("hub", "url"):
+        return None
+    from uploader import HubUploader
+    options = {}
+    if config.has_option("hub", "device"):
+        options["device"] = config.get("hub", "device")
+    if config.has_option("hub", "batch_size"):
+        options["batch_size"] = config.getint("hub", "batch_size")
+    if config.has_option("hub", "batch_interval"):
+        options["batch_interval"] = config.getfloat("hub", "batch_interval")
+    queue_dir = config.get("hub", "queue_dir") if config.has_option("hub", "queue_dir") else "upload-queue"
+    try:
+        return HubUploader(config.get("hub", "url"), resolve_path(queue_dir, conf_file), **options).start()
+    except ValueError as e:
+        raise ConfigurationError(str(e))
+
+
 class WorkoutState(object):
+    """
+    Mutable record of a workout. This is only ever modified by the workout thread; after every change a new immutable
+    StateSnapshot is published via the snapshot attribute for readers on other threads. If a HistoryLog or HubUploader
+    is supplied, every change is also recorded in it as an event.
+    """
 
-    def __init__(self, deadline):
+    def __init__(self, deadline, history=None, mode=None, uploader=None):
         self.correct_hits = []
         self.incorrect_hits = []
         self.timeouts = 0
+        self.sensor_errors = 0
         self.deadline = deadline
         self.server_time = time.time()
+        self.version = 0
+        self.snapshot = None
+        self.history = history
+        self.uploader = uploader
+        self.finished = False
+        self.log_event("workout_start", mode=mode, deadline=deadline)
+        self.publish()
 
-    def record_hit(self, direction, reaction_time, is_correct):
+    def record_hit(self, direction, reaction_time, is_correct, force=None):
         dest = self.correct_hits if is_correct else self.incorrect_hits
-        dest.append(HitStats(direction, reaction_time))
+        hit = HitStats(direction, reaction_time, force)
+        dest.append(hit)
+        fields = {"force": round(force, 3)} if force is not None else {}
+        self.log_event("hit", hit.timestamp, side=direction, reaction_time=round(reaction_time, 4), correct=is_correct,
+                       **fields)
+        self.publish()
 
     def record_timeout(self):
         self.timeouts += 1
+        self.log_event("timeout")
+        self.publish()
+
+    def record_sensor_error(self):
+        self.sensor_errors += 1
+        self.log_event("sensor_error")
+        self.publish()
+
+    def finish(self):
+        self.finished = True
+        self.log_event("workout_end", hits=len(self.correct_hits), misses=len(self.incorrect_hits) + self.timeouts,
+                       sensor_errors=self.sensor_errors)
+
+    def log_event(self, event_type, now=None, **fields):
+        """
+        Records an event for this workout (identified by its start time) in the history and uploader, if there are any.
+        """
+        if now is None:
+            now = time.time()
+        if self.history is not None:
+            self.history.record(event_type, now, workout=self.server_time, **fields)
+        if self.uploader is not None:
+            self.uploader.record(event_type, now, workout=self.server_time, **fields)
+
+    def publish(self):
+        """
+        Publishes a new snapshot of the current state. Replacing the snapshot reference is atomic so readers always see
+        either the previous or the new version, never a partially updated one.
+        :return:
+        """
+        self.version += 1
+        self.snapshot = StateSnapshot(self.version, self.deadline, tuple(self.correct_hits),
+                                      tuple(self.incorrect_hits), self.timeouts, self.sensor_errors)
+
+
+class StateSnapshot(object):
+    """
+    Immutable, versioned copy of a WorkoutState. The JSON encoding is computed at most once per version and then
+    reused by every reader.
+    """
+
+    def __init__(self, version, deadline, correct_hits, incorrect_hits, timeouts, sensor_errors=0):
+        self.version = version
+        self.deadline = deadline
+        self.correct_hits = correct_hits
+        self.incorrect_hits = incorrect_hits
+        self.timeouts = timeouts
+        self.sensor_errors = sensor_errors
+        self.__json = None
+
+    def to_dict(self):
+        return {"version": self.version,
+                "deadline": self.deadline,
+                "correct_hits": [h.to_dict() for h in self.correct_hits],
+                "incorrect_hits": [h.to_dict() for h in self.incorrect_hits],
+                "timeouts": self.timeouts,
+                "sensor_errors": self.sensor_errors}
+
+    def to_json(self, **extra):
+        """
+        Returns the JSON encoding of this snapshot. Any keyword arguments (such as server_time) are appended to the
+        cached encoding without re-encoding the rest of the state.
+        :param extra:
+        :return:
+        """
+        if self.__json is None:
+            self.__json = json.dumps(self.to_dict())
+        if not extra:
+            return self.__json
+        return self.__json[:-1] + ", " + json.dumps(extra)[1:]
 
 
 class HitStats(object):
 
-    def __init__(self, direction, reaction_time):
+    def __init__(self, direction, reaction_time, force=None, timestamp=None):
         self.direction = direction
         self.time = reaction_time
+        # peak acceleration (m/s^2) of the hit, if known
+        self.force = force
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    def to_dict(self):
+        return {"direction": self.direction, "time": self.time}
 
 
 class ConfigurationError(Exception):
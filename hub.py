@@ -0,0 +1,28 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import argparse
+import logging
+from engine.hub import HubServer
+
+
+def main(args):
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    server = HubServer(("0.0.0.0", args.port), args.data)
+    print("Hub listening on port {port}; storing events in {data}".format(port=args.port, data=args.data))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("shutting down")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Minimal hub that receives the workout events uploaded by each "
+                                                    "bag. Events are stored per device in the same format as the "
+                                                    "local history.")
+    argparser.add_argument("-p", "--port", type=int, default=8080, help="Port on which to receive uploads")
+    argparser.add_argument("--data", default="hub-data", help="Directory in which uploaded events are stored")
+    argparser.add_argument("-d", "--debug", action="store_true", default=False)
+    main(argparser.parse_args())
@@ -4,15 +4,26 @@ __author__ = 'Christopher Fagiani'
 import logging
 import argparse
 import sys
+import ConfigParser
 from engine import workout_controller
+from engine.startup import StartupTimer
 
 
 def main(args):
     controller = None
     configure_logger(args.debug)
+    timer = StartupTimer()
+    if args.sensor_test:
+        run_sensor_test(args.config)
+        return
+    if args.export:
+        run_export(args)
+        return
     try:
-        controller = workout_controller.WorkoutController(args.config)
+        controller = workout_controller.WorkoutController(args.config, timer=timer, watch_config=True)
         if args.headless:
+            if args.startup_report:
+                print_startup_report(controller, timer)
             controller.calibrate_orientation()
             workout_stats = controller.start_workout(args.mode, args.time)
             print("Workout Complete\n=================")
@@ -22,8 +33,13 @@ def main(args):
                                                           ))
         else:
             from ui.ui_server import SparpiServer
-            server = SparpiServer(args.port, controller)
-            server.start()
+            with timer.phase("ui server"):
+                server = SparpiServer(args.port, controller, args.server)
+                server.start()
+            if args.startup_report:
+                print_startup_report(controller, timer)
+            # the controller (acquisition process, config watcher and uploader) is in use until the server exits
+            server.wait()
 
     except KeyboardInterrupt:
         print("shutting down")
@@ -32,6 +48,55 @@ def main(args):
             controller.cleanup()
 
 
+def run_sensor_test(conf_file):
+    """
+    Measures how fast the sensor can be read at each data rate and prints the results along with the highest rate
+    that can be sustained.
+    """
+    from engine.io import rate_test
+    config = ConfigParser.RawConfigParser()
+    config.read(conf_file)
+    sensor = workout_controller.build_sensor(config)
+    try:
+        best, results = rate_test.select_rate(sensor)
+        print(rate_test.format_results(results))
+        print("\nHighest sustainable rate: {rate} Hz".format(rate=best))
+    finally:
+        sensor.close()
+
+
+def run_export(args):
+    """
+    Streams the recorded history to the output file (or stdout) without starting the hardware.
+    """
+    from engine import export
+    config = ConfigParser.RawConfigParser()
+    config.read(args.config)
+    # only read the history; a HistoryLog would create the directory
+    history_dir = workout_controller.get_history_dir(config, args.config)
+    if history_dir is None:
+        raise workout_controller.ConfigurationError("Workout history is not enabled (see the history section)")
+    chunks = export.export(history_dir, args.export, args.format, export.parse_time(args.start),
+                           export.parse_time(args.end), args.gzip)
+    out = open(args.output, "wb") if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+def print_startup_report(controller, timer):
+    """
+    Waits for the sensor calibration to finish and prints the time taken by each startup phase.
+    """
+    try:
+        controller.wait_until_ready()
+    finally:
+        print(timer.report())
+
+
 def configure_logger(is_debug):
     root = logging.getLogger()
     if is_debug:
@@ -56,6 +121,19 @@ if __name__ == "__main__":
     argparser.add_argument("-d", "--debug", action="store_true", default=False)
     argparser.add_argument("-p", "--port", type=int, default=80,
                            help="Port on which to run the UI. Ignored if headless.")
+    argparser.add_argument("-s", "--server", default="dev", choices=['dev', 'threaded', 'waitress'],
+                           help="HTTP server used for the UI. Ignored if headless.")
+    argparser.add_argument("--startup-report", action="store_true", default=False, dest="startup_report",
+                           help="Print the time taken by each phase of startup once the sensor is ready")
+    argparser.add_argument("--sensor-test", action="store_true", default=False, dest="sensor_test",
+                           help="Measure the achievable sensor read rate at each data rate and exit")
+    argparser.add_argument("--export", choices=['events', 'samples'],
+                           help="Write the recorded workout history to stdout (or --output) and exit")
+    argparser.add_argument("--format", default="csv", choices=['csv', 'ndjson'], help="Export format")
+    argparser.add_argument("--start", help="Only export history from this time (epoch seconds or 2017-06-01T18:00)")
+    argparser.add_argument("--end", help="Only export history before this time (epoch seconds or 2017-06-01T18:00)")
+    argparser.add_argument("--gzip", action="store_true", default=False, help="Gzip compress the export")
+    argparser.add_argument("--output", help="File the export is written to")
     argparser.add_argument("-hl", "--headless", default=False, action="store_true",
                            help="If true, no ui server will be started")
     main(argparser.parse_args())
@@ -0,0 +1,70 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import argparse
+import time
+from engine import tuning
+
+
+def main(args):
+    traces = tuning.load_traces(args.data)
+    options = tuning.ReplayOptions(rate=args.rate, noise=args.noise, seed=args.seed)
+    grid = tuning.build_grid({"threshold": parse_values(args.threshold, float),
+                              "samples": parse_values(args.samples, int),
+                              "recoil_wait": parse_values(args.recoil_wait, float),
+                              "stability_threshold": parse_values(args.stability_threshold, float),
+                              "min_calibration_distance": parse_values(args.min_calibration_distance, float)})
+    print("Evaluating {n} configurations against {t} traces".format(n=len(grid),
+                                                                    t=sum(len(v) for v in traces.values())))
+    start = time.time()
+    results = tuning.sweep(grid, traces, options, args.workers)
+    print("Sweep completed in {secs:.1f} seconds\n".format(secs=time.time() - start))
+    print("{:>9} {:>7} {:>7} {:>9} {:>6} {:>6} {:>6} {:>6} {:>6} {:>8} {:>6}".format(
+        "threshold", "samples", "recoil", "stability", "mindst", "detect", "fp", "dir", "settle", "lat(ms)",
+        "score"))
+    for result in results[:args.top]:
+        params = result["params"]
+        print("{:>9.1f} {:>7d} {:>7.2f} {:>9.1f} {:>6.1f} {:>6.2f} {:>6.2f} {:>6.2f} {:>6.2f} {:>8.1f} {:>6.3f}".format(
+            params["threshold"], params["samples"], params["recoil_wait"], params["stability_threshold"],
+            params["min_calibration_distance"], result["detection_rate"], result["false_positive_rate"],
+            result["direction_accuracy"], result["settle_rate"], result["latency_ms"], result["score"]))
+    if args.output and results:
+        tuning.write_config(args.config, args.output, results[0]["params"])
+        print("\nWrote best configuration to {out}".format(out=args.output))
+
+
+def parse_values(spec, conv):
+    """
+    Parses either a comma-separated list of values (1,2,3) or an inclusive range given as start:stop:step (10:50:5).
+    """
+    if ":" in spec:
+        start, stop, step = [conv(p) for p in spec.split(":")]
+        values = []
+        val = start
+        while val <= stop:
+            values.append(val)
+            val += step
+        return values
+    return [conv(p) for p in spec.split(",")]
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Replays recorded hits through the hit detector across a grid of "
+                                                    "parameters to find the best settings")
+    argparser.add_argument("-c", "--config", metavar='config', default="sparpi.ini",
+                           help='Configuration file used as the base for the output', dest='config')
+    argparser.add_argument("-o", "--output", help="If set, the best configuration is written to this file")
+    argparser.add_argument("--data", default="test/data", help="Directory containing recorded traces")
+    argparser.add_argument("--rate", type=float, default=400, help="Sample rate (Hz) the traces were recorded at")
+    argparser.add_argument("--noise", type=float, default=0.2,
+                           help="Standard deviation (m/s^2) of the simulated resting sensor noise")
+    argparser.add_argument("--seed", type=int, default=1, help="Random seed for the simulated noise")
+    argparser.add_argument("-w", "--workers", type=int, default=None,
+                           help="Number of worker processes. Defaults to the number of cores.")
+    argparser.add_argument("--top", type=int, default=10, help="Number of configurations to display")
+    argparser.add_argument("--threshold", default="10:60:5")
+    argparser.add_argument("--samples", default="50,100,200")
+    argparser.add_argument("--recoil-wait", default="0.5,1", dest="recoil_wait")
+    argparser.add_argument("--stability-threshold", default="3,5,8", dest="stability_threshold")
+    argparser.add_argument("--min-calibration-distance", default="5,10,15", dest="min_calibration_distance")
+    main(argparser.parse_args())
@@ -0,0 +1,306 @@
+"""
+Micro-benchmarks for the per-sample hot path: decoding sensor readings and detecting hits. Each benchmark is run against
+recorded hit traces (test/data) and reports the time per sample. The results are compared to a stored baseline and the
+script exits with a non-zero status if any benchmark has regressed by more than the tolerance, so it can be used as a
+CI gate. Because hosts (especially shared CI runners) speed up and slow down as a whole, each benchmark is timed
+alternately with a fixed reference loop and the regression check compares the ratio between the two rather than the
+raw times. Run from the project root:
+python -m test.benchmark
+The baseline is only compared on the kind of machine it was recorded on (see get_environment). After an intentional
+change, or to gate a different machine (such as the Pi itself), record a new baseline there with --save.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+from collections import OrderedDict
+from engine import tuning
+from engine import hit_detector
+from engine.io import accel
+
+DATA_DIR_PATH = os.path.join(os.path.dirname(__file__), 'data')
+BASELINE_PATH = os.path.join(DATA_DIR_PATH, 'benchmark_baseline.json')
+# file the Raspberry Pi (and other device tree based boards) report their model in
+DEVICE_MODEL_PATH = '/proc/device-tree/model'
+RATE = 800.0
+
+
+class RecordedTransport(object):
+    """
+    Transport that returns raw data register blocks encoded from recorded samples, cycling through them forever, so
+    the accelerometer driver can be measured without hardware or mock bookkeeping.
+    """
+
+    def __init__(self, samples):
+        self.blocks = [encode_block(s) for s in samples]
+        self.pos = 0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write_register(self, reg, data):
+        pass
+
+    def read_register(self, reg):
+        return 0
+
+    def read_block(self, reg, length):
+        block = self.blocks[self.pos]
+        self.pos = (self.pos + 1) % len(self.blocks)
+        return block
+
+
+def encode_block(sample):
+    """Converts an x,y,z sample in m/s^2 to the 6 little-endian data register bytes the device would return."""
+    block = []
+    for val in sample:
+        counts = int(round(val / (accel.SCALE * accel.GRAVITY)))
+        counts = max(-32768, min(32767, counts)) & 0xFFFF
+        block.extend((counts & 0xFF, counts >> 8))
+    return block
+
+
+def load_samples(count):
+    """Returns count samples taken from the recorded traces, repeating them as needed."""
+    traces = tuning.load_traces(DATA_DIR_PATH)
+    recorded = [s for side in tuning.SIDES for trace in traces[side] for s in trace]
+    return [recorded[i % len(recorded)] for i in range(count)]
+
+
+def bench_reference(samples):
+    """
+    Fixed pure python workload used to normalize the other results for the speed of the host. Like the benchmarks it
+    makes a function call per sample, since some slow spells on shared hosts hurt calls far more than arithmetic.
+    Changing it invalidates every stored baseline.
+    """
+    def square(sample):
+        return sample[0] * sample[0] + sample[1] * sample[1] + sample[2] * sample[2]
+
+    def run():
+        total = 0.0
+        for sample in samples:
+            total += square(sample)
+        return total
+    return run
+
+
+def bench_get_value(samples):
+    pairs = []
+    for block in (encode_block(s) for s in samples):
+        pairs.append((block[0], block[1]))
+    get_value = accel.get_value
+
+    def run():
+        for byte1, byte2 in pairs:
+            get_value(byte1, byte2)
+    return run
+
+
+def bench_get_sample(samples):
+    sensor = accel.Accelerometer(transport=RecordedTransport(samples))
+    count = len(samples)
+
+    def run():
+        for _ in xrange(count):
+            sensor.get_sample()
+    return run
+
+
+def bench_get_magnitude(samples):
+    get_magnitude = hit_detector.get_magnitude
+
+    def run():
+        for sample in samples:
+            get_magnitude(sample)
+    return run
+
+
+def bench_get_angle(samples):
+    # the angle of a zero vector is a special case; skip those so every call does the full computation
+    vectors = [s if any(s) else (1.0, 0.0, 0.0) for s in samples]
+    get_angle = hit_detector.get_angle
+
+    def run():
+        for vector in vectors:
+            get_angle(vector)
+    return run
+
+
+def bench_get_hit_side(samples):
+    angles = [hit_detector.get_angle(s) for s in samples if any(s)]
+    angles = [angles[i % len(angles)] for i in range(len(samples))]
+    references = {'r': 120.0, 'c': 200.0, 'l': 280.0}
+    get_hit_side = hit_detector.get_hit_side
+
+    def run():
+        for angle in angles:
+            get_hit_side(references, angle)
+    return run
+
+
+def bench_wait_for_hit(samples):
+    # calibrate on a quiet sensor and then replay the recorded samples with a threshold that is never reached, so
+    # wait_for_hit reads exactly one sample per iteration until its timeout (measured in sample time) expires
+    sensor = tuning.ReplaySensor([(0.0, 0.0, 0.0)] * 10, RATE)
+    detector = hit_detector.HitDetector(float('inf'), 1, 5, True, sensor, clock=sensor.clock)
+    detector.reference_angles = {'r': 120.0, 'c': 200.0, 'l': 280.0}
+    timeout = len(samples) / RATE
+
+    def run():
+        sensor.load(samples)
+        detector.wait_for_hit('r', timeout)
+    return run
+
+
+BENCHMARKS = OrderedDict([("accel.get_value", bench_get_value),
+                          ("Accelerometer.get_sample", bench_get_sample),
+                          ("hit_detector.get_magnitude", bench_get_magnitude),
+                          ("hit_detector.get_angle", bench_get_angle),
+                          ("hit_detector.get_hit_side", bench_get_hit_side),
+                          ("HitDetector.wait_for_hit", bench_wait_for_hit)])
+
+
+def measure(runs, reference, count, repeat):
+    """
+    Times callables that each process count samples, alternating with the reference callable. Returns an OrderedDict
+    mapping each name in runs to a tuple of (nanoseconds per sample, time relative to the reference). The time per
+    sample is the best of repeat runs with the garbage collector disabled (like timeit) since slower runs are caused by
+    other activity on the host. The relative time is the median ratio of each run to the reference run just before it,
+    so a slow spell on the host affects both sides of the ratio even when it only covers part of the measurement. The
+    benchmarks take turns rather than each running repeat times in a row, which keeps that spell from falling on a
+    single benchmark.
+    """
+    times = OrderedDict((name, []) for name in runs)
+    ratios = OrderedDict((name, []) for name in runs)
+    gc_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for name, run in runs.items():
+                reference_time = time_call(reference)
+                times[name].append(time_call(run))
+                ratios[name].append(times[name][-1] / reference_time)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return OrderedDict((name, (min(times[name]) * 1e9 / count, median(ratios[name]))) for name in runs)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def time_call(func):
+    start = timeit.default_timer()
+    func()
+    return timeit.default_timer() - start
+
+
+def run_benchmarks(count, repeat, names=None):
+    samples = load_samples(count)
+    runs = OrderedDict((name, setup(samples)) for name, setup in BENCHMARKS.items() if not names or name in names)
+    results = OrderedDict()
+    for name, (ns, relative) in measure(runs, bench_reference(samples), count, repeat).items():
+        results[name] = {"ns_per_sample": round(ns, 1), "relative": round(relative, 3)}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results to the baseline results and returns a list of messages describing each regression: a benchmark
+    whose time relative to the reference loop is more than tolerance (a fraction) above the baseline. Benchmarks
+    missing from the baseline are not compared.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if get_change(result, base) > tolerance:
+            regressions.append("{name}: {ns:.1f} ns/sample is {change:.0f}% slower than the baseline ({base:.1f} "
+                               "ns/sample), more than the {tol:.0f}% allowed".format(
+                                   name=name, ns=result["ns_per_sample"], change=get_change(result, base) * 100,
+                                   base=base["ns_per_sample"], tol=tolerance * 100))
+    return regressions
+
+
+def get_change(result, base):
+    """Returns the fractional change in the time of a benchmark relative to the reference loop."""
+    return result["relative"] / base["relative"] - 1
+
+
+def get_environment():
+    """
+    Describes the machine the benchmarks run on. Timings are only comparable between matching environments.
+    """
+    environment = {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                   "system": platform.system(), "machine": platform.machine(), "model": None}
+    if os.path.exists(DEVICE_MODEL_PATH):
+        with open(DEVICE_MODEL_PATH) as in_file:
+            environment["model"] = in_file.read().strip("\0\n ")
+    return environment
+
+
+def describe(environment):
+    return ", ".join("{key}={value}".format(key=key, value=environment[key]) for key in sorted(environment))
+
+
+def main(args):
+    results = run_benchmarks(args.samples, args.repeat, args.only)
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as in_file:
+            stored = json.load(in_file)
+        if stored.get("environment") == get_environment() or args.any_environment:
+            baseline = stored["results"]
+        else:
+            print("Not comparing: the baseline was recorded on {recorded}, this is {env}. Record a baseline on this "
+                  "machine with --save.\n".format(recorded=describe(stored.get("environment", {})),
+                                                   env=describe(get_environment())))
+    print("{:<28} {:>10} {:>10} {:>8}".format("benchmark", "ns/sample", "baseline", "change"))
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = ""
+        if base:
+            change = "{:+.1f}%".format(get_change(result, base) * 100)
+        print("{:<28} {:>10.1f} {:>10} {:>8}".format(name, result["ns_per_sample"],
+                                                     "{:.1f}".format(base["ns_per_sample"]) if base else "-", change))
+    if args.save:
+        with open(args.baseline, "w") as out:
+            json.dump({"environment": get_environment(), "results": results}, out, indent=2, sort_keys=True,
+                      separators=(",", ": "))
+            out.write("\n")
+        print("\nSaved baseline to {path}".format(path=args.baseline))
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+        print("REGRESSION " + message)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmarks the per-sample cost of sensor decoding and hit "
+                                                    "detection and compares it to a stored baseline")
+    argparser.add_argument("-n", "--samples", type=int, default=5000, help="Samples processed per run")
+    argparser.add_argument("-r", "--repeat", type=int, default=20, help="Runs of each benchmark; the fastest is used")
+    argparser.add_argument("-t", "--tolerance", type=float, default=0.25,
+                           help="Allowed slowdown relative to the baseline (0.25 = 25%%)")
+    argparser.add_argument("-b", "--baseline", default=BASELINE_PATH, help="Baseline file")
+    argparser.add_argument("--save", action="store_true", default=False,
+                           help="Store the results as the new baseline instead of comparing")
+    argparser.add_argument("--any-environment", action="store_true", default=False, dest="any_environment",
+                           help="Compare with the baseline even if it was recorded on a different machine")
+    argparser.add_argument("--only", action="append", choices=list(BENCHMARKS.keys()),
+                           help="Only run the named benchmark (may be repeated)")
+    sys.exit(main(argparser.parse_args()))
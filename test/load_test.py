@@ -0,0 +1,102 @@
+import argparse
+import httplib
+import json
+import threading
+import time
+
+"""
+Simple load generator for the UI/API server. Each simulated client loads the UI assets once and then polls the workout
+endpoint the same way sparpi.js does. Run a server (for instance python -m test.mock_ui_driver threaded) and then, from
+the project root:
+python -m test.load_test --port 8888 --clients 5,10,25,50
+"""
+
+ASSET_PATHS = ['/', '/js/sparpi.js', '/css/sparpi.css', '/favicon.ico']
+
+
+class ClientStats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+
+def run_client(host, port, duration, interval, stats):
+    """
+    Simulates one tablet: loads the page assets and then polls GET /workout every interval seconds over a keep-alive
+    connection until duration elapses.
+    """
+    conn = httplib.HTTPConnection(host, port, timeout=10)
+    deadline = time.time() + duration
+    paths = list(ASSET_PATHS)
+    while time.time() < deadline:
+        path = paths.pop(0) if paths else '/workout'
+        start = time.time()
+        try:
+            conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 400:
+                stats.errors += 1
+            else:
+                stats.latencies.append(time.time() - start)
+        except (httplib.HTTPException, IOError):
+            stats.errors += 1
+            conn.close()
+            conn = httplib.HTTPConnection(host, port, timeout=10)
+        if not paths:
+            time.sleep(max(0, interval - (time.time() - start)))
+    conn.close()
+
+
+def run_level(host, port, clients, duration, interval):
+    stats = [ClientStats() for _ in range(clients)]
+    threads = [threading.Thread(target=run_client, args=(host, port, duration, interval, s)) for s in stats]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    latencies = sorted(l for s in stats for l in s.latencies)
+    errors = sum(s.errors for s in stats)
+    return latencies, errors
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * pct / 100.0))]
+
+
+def start_workout(host, port, minutes):
+    conn = httplib.HTTPConnection(host, port, timeout=30)
+    conn.request('PUT', '/workout', json.dumps({'time': minutes, 'mode': 'random',
+                                                'frequencies': {'r': 34, 'c': 33, 'l': 33}}),
+                 {'Content-Type': 'application/json'})
+    conn.getresponse().read()
+    conn.close()
+
+
+def main(args):
+    if args.start:
+        start_workout(args.host, args.port, args.duration * len(args.clients.split(",")))
+    print("clients  req/s    p50(ms)  p95(ms)  p99(ms)  errors")
+    for clients in [int(c) for c in args.clients.split(",")]:
+        latencies, errors = run_level(args.host, args.port, clients, args.duration, args.interval)
+        print("{c:<8} {rps:<8.1f} {p50:<8.1f} {p95:<8.1f} {p99:<8.1f} {e}".format(
+            c=clients, rps=len(latencies) / float(args.duration), p50=percentile(latencies, 50) * 1000,
+            p95=percentile(latencies, 95) * 1000, p99=percentile(latencies, 99) * 1000, e=errors))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Load tests the SparPI UI server")
+    argparser.add_argument("--host", default="localhost")
+    argparser.add_argument("-p", "--port", type=int, default=8888)
+    argparser.add_argument("-c", "--clients", default="1,5,10,25,50",
+                           help="Comma-separated list of concurrent client counts to run")
+    argparser.add_argument("-d", "--duration", type=float, default=10, help="Seconds to run each client count")
+    argparser.add_argument("-i", "--interval", type=float, default=0.5,
+                           help="Seconds between polls for each client (the UI polls every 0.5 seconds)")
+    argparser.add_argument("--no-start", action="store_false", default=True, dest="start",
+                           help="Don't start a workout before polling (use if one is already running)")
+    main(argparser.parse_args())
@@ -1,17 +1,20 @@
+import sys
 from mocks import MockWorkoutController
 from ui import ui_server
 
 """
 Simple utility to run the UI/API server with a mocked controller. You can run from the project root with:
 python -m test.mock_ui_driver
+An optional argument selects the server mode (dev, threaded or waitress).
 """
 
 
-def run():
+def run(server_mode='dev'):
     controller = MockWorkoutController()
-    api = ui_server.SparpiServer(8888, controller)
+    api = ui_server.SparpiServer(8888, controller, server_mode)
     api.start()
+    api.wait()
 
 
 if __name__ == "__main__":
-    run()
+    run(*sys.argv[1:2])
@@ -1,6 +1,10 @@
 import time
-from random import randrange
-from engine.workout_controller import WorkoutState
+import math
+from random import randrange, gauss
+from engine.workout_controller import WorkoutState, ConfigurationError
+from engine.acquisition import SampleRingBuffer
+from engine.waveform import WaveformStreamer
+from engine.analytics import SessionAnalytics
 
 
 class Mock(object):
@@ -40,6 +44,9 @@ class MockSensor(Mock):
         self.pos += 1
         return val
 
+    def begin_sampling(self):
+        self.handle_invocation("begin_sampling")
+
 
 class MockLedController(Mock):
     """
@@ -76,11 +83,18 @@ class MockHitDetector(Mock):
         return self.handle_invocation("calibrate_hit", side, timeout)
 
     def wait_for_stability(self, timeout):
+        self.handle_invocation("wait_for_stability", timeout)
         return 0, 0, 0
 
+    def update_settings(self, settings):
+        self.handle_invocation("update_settings", settings)
+
     def has_valid_calibration(self):
         return True
 
+    def close(self):
+        self.handle_invocation("close")
+
 
 class MockWorkoutController(Mock):
 
@@ -88,6 +102,10 @@ class MockWorkoutController(Mock):
         super(MockWorkoutController, self).__init__()
         self.cur_workout = None
         self.is_running = False
+        self.ring = SampleRingBuffer()
+        self.waveform = WaveformStreamer(self.ring)
+        self.analytics = SessionAnalytics()
+        self.last_sample_time = time.time()
 
     def start_workout(self, mode, workout_time, frequencies={'l': 33, 'c': 33, 'r': 34}):
         self.is_running = True
@@ -99,11 +117,123 @@ class MockWorkoutController(Mock):
     def get_state(self):
         sides = ['r', 'c', 'l']
         self.cur_workout.record_hit(sides[randrange(0, 3)], randrange(1, 8), True if randrange(0, 2) < 1 else False)
-        self.cur_workout.server_time = time.time()
-        return self.cur_workout
+        return self.cur_workout.snapshot
 
     def stop_workout(self):
         self.is_running = False
 
     def has_valid_calibration(self):
         return True
+
+    def get_readiness(self):
+        return "ready"
+
+    def get_sensor_stats(self):
+        return None
+
+    def get_settings(self):
+        return {"settings": {}, "pending": None, "restart_required": []}
+
+    def reload_config(self, updates=None):
+        return {"settings": {}, "restart_required": []}
+
+    def get_analytics(self, workout=None):
+        if self.cur_workout is None:
+            return None
+        return self.analytics.for_state(self.cur_workout)
+
+    def export(self, kind="events", fmt="csv", start=None, end=None, compress=False):
+        raise ConfigurationError("Workout history is not enabled")
+
+    def get_waveform(self, since=None, points_per_second=100):
+        """Generates 800 Hz of noise since the last call with a decaying impact every 2 seconds."""
+        now = time.time()
+        t = self.last_sample_time
+        while t < now:
+            phase = t % 2
+            amp = 40 * math.exp(-phase * 8) * math.sin(phase * 60) if phase < 0.5 else 0
+            self.ring.append(t, (amp + gauss(0, 0.3), amp / 2 + gauss(0, 0.3), gauss(0, 0.3)))
+            if 0 <= phase < 1.0 / 800:
+                self.ring.mark_hit()
+            t += 1.0 / 800
+        self.last_sample_time = t
+        return self.waveform.get_points(since, points_per_second)
+
+
+class MockAdxl345(Mock):
+    """
+    Emulates the register file of an ADXL345 so the accelerometer driver can be tested without hardware.
+    """
+
+    def __init__(self):
+        super(MockAdxl345, self).__init__()
+        self.registers = [0] * 64
+        self.failures = 0
+
+    def set_sample(self, x, y, z):
+        """Stores raw axis counts in the data registers (little-endian two's complement)."""
+        for i, val in enumerate((x, y, z)):
+            val &= 0xFFFF
+            self.registers[0x32 + i * 2] = val & 0xFF
+            self.registers[0x33 + i * 2] = val >> 8
+
+    def fail_reads(self, count):
+        """Makes the next count reads raise an IOError."""
+        self.failures = count
+
+    def read(self, reg, length):
+        self.handle_invocation("read")
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("Simulated bus error")
+        return self.registers[reg:reg + length]
+
+    def write(self, reg, data):
+        self.handle_invocation("write")
+        self.registers[reg] = data
+
+
+class MockSpiDevice(object):
+    """
+    Fake spidev.SpiDev that decodes ADXL345 SPI commands against a MockAdxl345.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.max_speed_hz = 0
+        self.mode = 0
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def xfer2(self, data):
+        reg = data[0] & 0x3F
+        if data[0] & 0x80:
+            length = len(data) - 1 if data[0] & 0x40 else 1
+            return [0] + self.device.read(reg, length)
+        self.device.write(reg, data[1])
+        return [0] * len(data)
+
+
+class MockSmbus(object):
+    """
+    Fake smbus.SMBus backed by a MockAdxl345.
+    """
+
+    def __init__(self, device):
+        self.device = device
+
+    def close(self):
+        pass
+
+    def write_byte_data(self, address, reg, data):
+        self.device.write(reg, data)
+
+    def read_byte_data(self, address, reg):
+        return self.device.read(reg, 1)[0]
+
+    def read_i2c_block_data(self, address, reg, length):
+        return self.device.read(reg, length)
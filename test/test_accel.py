@@ -0,0 +1,139 @@
+import unittest
+from mocks import MockAdxl345, MockSpiDevice, MockSmbus
+from engine.io import accel
+from engine.io import rate_test
+
+
+class TestAccelerometer(unittest.TestCase):
+
+    def test_spi_initialization(self):
+        device = MockAdxl345()
+        accel.Accelerometer(transport=accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device)))
+        self.assertEqual(accel.BW_RATE, device.registers[accel.BW_RATE_REG])
+        self.assertEqual(accel.MEASURE_MODE, device.registers[accel.POWER_CTL_REG])
+        self.assertEqual(accel.RANGE | 0x08, device.registers[accel.DATA_FORMAT_REG])
+
+    def test_spi_burst_read(self):
+        device = MockAdxl345()
+        sensor = accel.Accelerometer(transport=accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device)))
+        device.set_sample(250, -250, 0)
+        reads = device.get_invocation_count("read")
+        x, y, z = sensor.get_sample()
+        # all six data registers should be read in a single transfer
+        self.assertEqual(reads + 1, device.get_invocation_count("read"))
+        self.assertAlmostEqual(accel.GRAVITY, x, 3)
+        self.assertAlmostEqual(-accel.GRAVITY, y, 3)
+        self.assertEqual(0, z)
+
+    def test_i2c_read(self):
+        device = MockAdxl345()
+        sensor = accel.Accelerometer(transport=accel.I2CTransport(bus_factory=lambda n: MockSmbus(device)))
+        device.set_sample(0, 0, 500)
+        self.assertAlmostEqual(2 * accel.GRAVITY, sensor.get_sample()[2], 3)
+
+    def test_negative_value(self):
+        self.assertEqual(-1, accel.get_value(0xFF, 0xFF))
+        self.assertEqual(256, accel.get_value(0x00, 0x01))
+
+    def test_unknown_transport(self):
+        self.assertRaises(ValueError, accel.create_transport, "can")
+
+    def test_rate_and_range(self):
+        device = MockAdxl345()
+        transport = accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device))
+        accel.Accelerometer(transport=transport, rate=100, g_range=2)
+        self.assertEqual(0x0A, device.registers[accel.BW_RATE_REG])
+        self.assertEqual(0x08, device.registers[accel.DATA_FORMAT_REG])
+        self.assertRaises(ValueError, accel.Accelerometer, transport=transport, rate=123)
+
+    def test_select_rate(self):
+        device = MockAdxl345()
+        sensor = accel.Accelerometer(transport=accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device)))
+        # each read takes 2 ticks of 1ms so only 500 reads per second are possible
+        ticks = [0]
+
+        def clock():
+            ticks[0] += 1
+            return ticks[0] / 1000.0
+
+        best, results = rate_test.select_rate(sensor, duration=0.5, clock=clock)
+        self.assertEqual(400, best)
+        self.assertEqual(400, sensor.rate)
+        self.assertEqual(0x0C, device.registers[accel.BW_RATE_REG])
+        self.assertEqual(len(accel.DATA_RATES), len(results))
+        self.assertEqual(0, results[0].error_rate)
+
+    def test_read_retry(self):
+        device = MockAdxl345()
+        sensor = accel.Accelerometer(transport=accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device)))
+        device.set_sample(250, 0, 0)
+        device.fail_reads(2)
+        self.assertAlmostEqual(accel.GRAVITY, sensor.get_sample()[0], 3)
+        stats = sensor.get_stats()
+        self.assertEqual(2, stats["errors"])
+        self.assertEqual(2, stats["retries"])
+        self.assertEqual(0, stats["reinitializations"])
+
+    def test_read_reinitialize(self):
+        device = MockAdxl345()
+        sensor = accel.Accelerometer(transport=accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device)),
+                                     max_retries=2)
+        # the device loses its configuration (i.e. after a brown-out)
+        device.registers[accel.POWER_CTL_REG] = 0
+        device.fail_reads(2)
+        sensor.get_sample()
+        self.assertEqual(1, sensor.get_stats()["reinitializations"])
+        self.assertEqual(accel.MEASURE_MODE, device.registers[accel.POWER_CTL_REG])
+
+    def test_read_failure(self):
+        device = MockAdxl345()
+        sensor = accel.Accelerometer(transport=accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device)),
+                                     max_retries=2)
+        # enough failures to also break the register read done while re-initializing
+        device.fail_reads(10)
+        self.assertRaises(accel.SensorReadError, sensor.get_sample)
+
+    def test_gap_detection(self):
+        stats = accel.SensorStats()
+        for t in (0, 0.001, 0.002, 0.0125, 0.013):
+            stats.record_sample(t, 800)
+        self.assertEqual(1, stats.gaps)
+        self.assertEqual(7, stats.dropped)
+        # the pause before the next run of reads (i.e. between rounds) is not a gap
+        stats.begin_sampling()
+        stats.record_sample(5, 800)
+        self.assertEqual(1, stats.gaps)
+
+    def test_achieved_rate_short_runs(self):
+        stats = accel.SensorStats()
+        now = 0.0
+        # stability waits and hits are each much shorter than a second, with pauses between them
+        for run in range(6):
+            stats.begin_sampling()
+            for i in range(200):
+                stats.record_sample(now + i / 800.0, 800)
+            now += 2
+        self.assertAlmostEqual(800, stats.achieved_rate, 0)
+        self.assertEqual(0, stats.gaps)
+
+    def test_stall_during_round(self):
+        device = MockAdxl345()
+        now = [10.0]
+        sensor = accel.Accelerometer(transport=accel.SpiTransport(spi_factory=lambda: MockSpiDevice(device)),
+                                     clock=lambda: now[0])
+        sensor.begin_sampling()
+        for i in range(10):
+            now[0] += 0.00125
+            sensor.get_sample()
+        # reading stops for half a second in the middle of the round
+        now[0] += 0.5
+        sensor.get_sample()
+        stats = sensor.get_stats()
+        self.assertEqual(1, stats["gaps"])
+        self.assertEqual(399, stats["dropped"])
+
+    def test_achieved_rate(self):
+        stats = accel.SensorStats()
+        for i in range(401):
+            stats.record_sample(i * 0.0025, 800)
+        self.assertAlmostEqual(400, stats.achieved_rate, 0)
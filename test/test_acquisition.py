@@ -0,0 +1,86 @@
+import unittest
+from mocks import MockSensor
+from engine import acquisition
+from engine.hit_detector import SensorInitializationError
+
+
+class InterleavedArray(object):
+    """
+    Wraps a ring buffer's shared array and calls on_read before the first slice is copied, to simulate the writer
+    running while a reader is copying samples.
+    """
+
+    def __init__(self, data, on_read):
+        self.data = data
+        self.on_read = on_read
+
+    def __getslice__(self, i, j):
+        if self.on_read is not None:
+            on_read, self.on_read = self.on_read, None
+            on_read()
+        return self.data[i:j]
+
+    def __setitem__(self, idx, value):
+        self.data[idx] = value
+
+
+class TestAcquisition(unittest.TestCase):
+
+    def test_ring_buffer_read(self):
+        ring = acquisition.SampleRingBuffer(4)
+        ring.append(1.0, (1, 2, 3))
+        ring.append(2.0, (4, 5, 6))
+        next_seq, samples = ring.read()
+        self.assertEqual(2, next_seq)
+        self.assertEqual([(1.0, 1, 2, 3), (2.0, 4, 5, 6)], samples)
+        # nothing new since the last read
+        self.assertEqual((2, []), ring.read(next_seq))
+
+    def test_mark_hit(self):
+        ring = acquisition.SampleRingBuffer(4)
+        self.assertEqual(None, ring.mark_hit())
+        for i in range(6):
+            ring.append(10.0 + i, (i, i, i))
+        self.assertEqual(15.0, ring.mark_hit())
+        self.assertEqual([0, 5], ring.get_hit_marks())
+
+    def test_ring_buffer_wrap(self):
+        ring = acquisition.SampleRingBuffer(3)
+        for i in range(5):
+            ring.append(i, (i, i, i))
+        next_seq, samples = ring.read()
+        self.assertEqual(5, next_seq)
+        # seq 2 shares its slot with the next sample to be written so it isn't returned
+        self.assertEqual([3, 4], [s[0] for s in samples])
+
+    def test_ring_buffer_write_during_read(self):
+        ring = acquisition.SampleRingBuffer(4)
+        for i in range(4):
+            ring.append(i, (i, i, i))
+        # the writer is part way through seq 4, which goes in the slot of seq 0, while the samples are copied
+        ring.data = InterleavedArray(ring.data, lambda: ring.data.__setitem__(0, 99))
+        self.assertEqual([1, 2, 3], [s[0] for s in ring.read_range(0, 4)])
+        # the writer finishes seq 4 while seq 1 is copied, so seq 1's slot is the next to be written
+        ring.data = InterleavedArray(ring.data.data, lambda: ring.append(4, (4, 4, 4)))
+        self.assertEqual([2, 3], [s[0] for s in ring.read_range(1, 4)])
+
+    def test_remote_hit(self):
+        detector = acquisition.RemoteHitDetector(3, 10, 1, True,
+                                                 sensor_factory=lambda: MockSensor(
+                                                     lambda x: [0, 0, 0] if x <= 4 else [5, 5, 5]))
+        try:
+            val, is_correct = detector.wait_for_hit(None, 5)
+            self.assertEqual((-5, -5, -5), val)
+            self.assertTrue(is_correct)
+            next_seq, samples = detector.ring.read()
+            self.assertTrue(next_seq > 5)
+        finally:
+            detector.close()
+        self.assertFalse(detector.process.is_alive())
+
+    def test_remote_calibration_error(self):
+        try:
+            acquisition.RemoteHitDetector(1, 1, 1, True, sensor_factory=lambda: MockSensor(lambda x: [x * 12] * 3))
+            self.assertTrue(False, "Expected a timeout")
+        except Exception as e:
+            self.assertEquals(type(e), SensorInitializationError)
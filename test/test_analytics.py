@@ -0,0 +1,72 @@
+import unittest
+import json
+import shutil
+import tempfile
+from engine import analytics
+from engine.history import HistoryLog
+from engine.workout_controller import WorkoutState
+
+
+def build_hits(count, side='r', start=1000.0, interval=10, force=None):
+    """Returns hits every interval seconds whose reaction time grows by 10ms per hit."""
+    return [(start + i * interval, side, 0.3 + 0.01 * i, True, force(i) if force else None) for i in range(count)]
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def test_analyze(self):
+        hits = build_hits(20) + [(1005.0, 'l', 0.5, True, None), (1006.0, 'l', 0.9, False, None)]
+        result = analytics.analyze(analytics.SessionColumns(1000.0, hits), window=5)
+        self.assertEqual(22, result["hits"])
+        self.assertEqual(21, result["correct"])
+        self.assertEqual(20, result["sides"]['r']["count"])
+        self.assertAlmostEqual(0.395, result["sides"]['r']["mean"])
+        self.assertEqual(0.3, result["sides"]['r']["min"])
+        self.assertEqual(0.49, result["sides"]['r']["max"])
+        self.assertEqual(20, sum(result["sides"]['r']["histogram"]))
+        self.assertEqual(1, result["sides"]['l']["misses"])
+        self.assertEqual(0, result["sides"]['c']["count"])
+        self.assertEqual(None, result["sides"]['c']["mean"])
+        # 20 hits 10 seconds apart span 4 minutes
+        self.assertEqual([7, 6, 6, 2], result["hits_per_minute"]["correct"])
+        self.assertEqual([8, 6, 6, 2], result["hits_per_minute"]["all"])
+        self.assertEqual(17, len(result["fatigue"]["curve"]))
+        self.assertTrue(result["fatigue"]["change"] > 0)
+        self.assertEqual(None, result["force"])
+
+    def test_force_trend(self):
+        hits = build_hits(12, interval=30, force=lambda i: 100 - 2 * i)
+        force = analytics.analyze(analytics.SessionColumns(1000.0, hits))["force"]
+        # force drops 2 m/s^2 per hit and there are 2 hits per minute
+        self.assertAlmostEqual(-4, force["trend_per_minute"])
+        self.assertEqual([99, 95, 91, 87, 83, 79], force["per_minute"])
+
+    def test_empty(self):
+        result = analytics.analyze(analytics.SessionColumns(1000.0, []))
+        self.assertEqual(0, result["hits"])
+        self.assertEqual([], result["hits_per_minute"]["all"])
+        self.assertEqual([], result["fatigue"]["curve"])
+
+    def test_rolling_mean(self):
+        self.assertEqual([2, 3, 4], analytics.rolling_mean(analytics.column('d', [1, 2, 3, 4, 5]), 3))
+        self.assertEqual([], analytics.rolling_mean(analytics.column('d', [1]), 3))
+
+    def test_cached_sessions(self):
+        history_dir = tempfile.mkdtemp()
+        try:
+            state = WorkoutState(100, HistoryLog(history_dir))
+            state.record_hit('c', 0.4, True, 50)
+            cache = analytics.SessionAnalytics(history_dir)
+            live = cache.for_state(state)
+            self.assertTrue(live is cache.for_state(state))
+            state.record_hit('c', 0.6, True, 60)
+            self.assertEqual(0.5, json.loads(cache.for_state(state))["sides"]['c']["mean"])
+            state.finish()
+            done = cache.for_state(state)
+            self.assertTrue(done is cache.for_state(state))
+            # the same session loaded from the history gives the same results
+            self.assertEqual(json.loads(done), json.loads(analytics.SessionAnalytics(history_dir).for_workout(
+                state.server_time)))
+            self.assertEqual(None, cache.for_workout(state.server_time + 1))
+        finally:
+            shutil.rmtree(history_dir)
@@ -0,0 +1,53 @@
+import unittest
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+from test import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.baseline = {"accel.get_value": {"ns_per_sample": 100.0, "relative": 1.0}}
+
+    def result(self, relative):
+        return {"accel.get_value": {"ns_per_sample": 100.0 * relative, "relative": relative}}
+
+    def test_compare(self):
+        self.assertEqual([], benchmark.compare(self.result(1.2), self.baseline, 0.25))
+        self.assertEqual(1, len(benchmark.compare(self.result(1.3), self.baseline, 0.25)))
+        # benchmarks that are not in the baseline are not compared
+        self.assertEqual([], benchmark.compare(self.result(2.0), {}, 0.25))
+
+    def test_run(self):
+        results = benchmark.run_benchmarks(200, 1, ["hit_detector.get_angle", "HitDetector.wait_for_hit"])
+        self.assertEqual(["hit_detector.get_angle", "HitDetector.wait_for_hit"], list(results.keys()))
+        for result in results.values():
+            self.assertTrue(result["ns_per_sample"] > 0)
+            self.assertTrue(result["relative"] > 0)
+
+    def test_other_environment(self):
+        baseline_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(baseline_dir, "baseline.json")
+            environment = dict(benchmark.get_environment(), machine="armv7l")
+            # a baseline from another kind of machine that every result would regress against
+            with open(path, "w") as out:
+                json.dump({"environment": environment, "results": {"accel.get_value": {"ns_per_sample": 0.1,
+                                                                                        "relative": 0.001}}}, out)
+            args = argparse.Namespace(samples=100, repeat=1, tolerance=0.25, baseline=path, save=False,
+                                      any_environment=False, only=["accel.get_value"])
+            stdout, sys.stdout = sys.stdout, StringIO()
+            try:
+                self.assertEqual(0, benchmark.main(args))
+                self.assertTrue(sys.stdout.getvalue().startswith("Not comparing"))
+                args.any_environment = True
+                self.assertEqual(1, benchmark.main(args))
+            finally:
+                sys.stdout = stdout
+        finally:
+            shutil.rmtree(baseline_dir)
@@ -0,0 +1,71 @@
+import unittest
+import os
+import json
+import zlib
+import shutil
+import tempfile
+import datetime
+from engine import export
+from engine import history
+from engine.history import HistoryLog
+from engine.workout_controller import WorkoutState
+
+DAY = 86400
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = HistoryLog(self.dir, record_samples=True)
+        # noon on three consecutive days so each event lands in its own file regardless of the local timezone
+        self.base = history.get_day_start(datetime.date(2017, 6, 1)) + DAY / 2
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_events_csv(self):
+        state = WorkoutState(100, self.log, mode='random')
+        state.record_hit('r', 0.5, True, 123.4)
+        state.finish()
+        lines = "".join(export.export(self.dir)).splitlines()
+        self.assertEqual(",".join(export.EVENT_FIELDS), lines[0])
+        self.assertTrue(lines[0].endswith(",force"))
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[2].endswith(",hit,{w},r,0.5,True,123.4".format(w=repr(state.server_time))))
+
+    def test_time_range(self):
+        for day in range(3):
+            self.log.record("hit", self.base + day * DAY, side='c')
+        self.assertEqual(3, len(list(history.iter_records(self.dir, history.EVENTS))))
+        self.assertEqual(3, len(history.list_files(self.dir, history.EVENTS)))
+        records = list(history.iter_records(self.dir, history.EVENTS, self.base + 1, self.base + 2 * DAY + 1))
+        self.assertEqual([self.base + DAY, self.base + 2 * DAY], [r["time"] for r in records])
+
+    def test_samples_ndjson_gzip(self):
+        self.log.record_sample_block([(self.base + i / 800.0, i, -i, 9.8) for i in range(2000)])
+        chunks = export.export(self.dir, history.SAMPLES, "ndjson", compress=True)
+        lines = zlib.decompress("".join(chunks), 16 + zlib.MAX_WBITS).splitlines()
+        self.assertEqual(2000, len(lines))
+        self.assertEqual({"time": round(self.base + 1 / 800.0, 4), "x": 1, "y": -1, "z": 9.8}, json.loads(lines[1]))
+
+    def test_streams_in_chunks(self):
+        self.log.record_sample_block([(self.base + i / 800.0, 0, 0, 0) for i in range(10000)])
+        chunks = export.export(self.dir, history.SAMPLES)
+        first = next(chunks)
+        self.assertTrue(export.CHUNK_SIZE <= len(first) < 2 * export.CHUNK_SIZE)
+        self.assertEqual(10001, (first + "".join(chunks)).count("\n"))
+
+    def test_skips_truncated_lines(self):
+        self.log.record("hit", self.base, side='l')
+        with open(history.get_path(self.dir, history.EVENTS, history.get_day(self.base)), "a") as out:
+            out.write('{"side": "r", "ti')
+        self.assertEqual(1, len(list(history.iter_records(self.dir, history.EVENTS))))
+
+    def test_parse_time(self):
+        self.assertEqual(None, export.parse_time(""))
+        self.assertEqual(1496300000.5, export.parse_time("1496300000.5"))
+        self.assertEqual(history.get_day_start(datetime.date(2017, 6, 1)) + 3600,
+                         export.parse_time("2017-06-01T01:00"))
+        self.assertRaises(ValueError, export.parse_time, "yesterday")
+        self.assertRaises(ValueError, export.export, self.dir, history.EVENTS, "xml")
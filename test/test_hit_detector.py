@@ -38,6 +38,54 @@ class TestHitDetector(unittest.TestCase):
         detector = hit_detector.HitDetector(3, timeout, 1, True, sensor)
         detector.calibrate_hit('r', timeout)
 
+    def test_begin_sampling(self):
+        sensor = MockSensor(lambda x: [0, 0, 0] if x <= 4 else [5, 5, 5])
+        detector = hit_detector.HitDetector(3, 10, 1, True, sensor)
+        self.assertEqual(1, sensor.get_invocation_count("begin_sampling"))
+        # each wait for a hit is a new run of reads, so the time between them isn't counted as a gap
+        detector.wait_for_hit(None, 1)
+        detector.wait_for_hit(None, 1)
+        self.assertEqual(3, sensor.get_invocation_count("begin_sampling"))
+
+    def test_measure_peak(self):
+        sensor = MockSensor(ramp_trace)
+        detector = hit_detector.HitDetector(5, 10, 1, True, sensor)
+        hit, _ = detector.wait_for_hit(None, 1)
+        # the hit is reported as soon as it crosses the threshold, well before its peak
+        self.assertEqual(6, hit_detector.get_magnitude(hit))
+        self.assertEqual(14, detector.measure_peak(hit, 0.01))
+
+    def test_background_calibration(self):
+        sensor = MockSensor(lambda x: [0, 0, 0] if x <= 4 else [5, 5, 5])
+        statuses = []
+        detector = hit_detector.HitDetector(3, 10, 1, True, sensor, background=True, on_ready=statuses.append)
+        self.assertTrue(detector.wait_until_ready(10))
+        self.assertEqual(hit_detector.READY, detector.get_status())
+        self.assertEqual([hit_detector.READY], statuses)
+        detector.calibrate_hit('r', 10)
+
+    def test_background_calibration_failure(self):
+        sensor = MockSensor(lambda x: [x * 12, x * 12, x * 12])
+        detector = hit_detector.HitDetector(1, 1, 1, True, sensor, background=True)
+        try:
+            detector.wait_for_hit('r', 1)
+            self.assertTrue(False, "Expected a timeout")
+        except Exception as e:
+            self.assertEquals(type(e), hit_detector.SensorInitializationError)
+        self.assertEqual(hit_detector.FAILED, detector.get_status())
+
+    def test_update_settings(self):
+        sensor = MockSensor(lambda x: [0, 0, 0] if x <= 4 else [5, 5, 5])
+        detector = hit_detector.HitDetector(3, 10, 1, True, sensor)
+        detector.calibrate_hit('r', 10)
+        baseline = detector.baseline
+        detector.update_settings({'threshold': 20, 'detect_direction': False, 'recoil_wait': 3})
+        self.assertEqual(20, detector.threshold)
+        self.assertFalse(detector.detect_direction)
+        # the calibration is kept
+        self.assertEqual(baseline, detector.baseline)
+        self.assertEqual(['r'], list(detector.reference_angles.keys()))
+
     def test_zero_magnitude(self):
         mag = hit_detector.get_magnitude((0, 0, 0))
         self.assertEqual(0.0, mag)
@@ -64,3 +112,13 @@ def read_sample_file(filename):
             data.append(tuple([float(x) for x in line.split(",")]))
             sample_len += 1
     return data
+
+
+# an impact that rises past a threshold of 5 to a peak of 14 before decaying
+RAMP = [6, 9, 14, 11, 7, 3]
+
+
+def ramp_trace(pos):
+    if 5 <= pos < 5 + len(RAMP):
+        return [0, 0, RAMP[pos - 5]]
+    return [0, 0, 0]
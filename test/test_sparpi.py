@@ -0,0 +1,68 @@
+import unittest
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import sparpi
+from engine import workout_controller
+from ui import ui_server
+from mocks import MockHitDetector
+from mocks import MockLedController
+from mocks import MockSensor
+
+DATA_DIR_PATH = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class TestSparpi(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conf_file = os.path.join(self.dir, "sparpi.ini")
+        with open(os.path.join(DATA_DIR_PATH, "test.ini")) as in_file:
+            conf = in_file.read()
+        with open(self.conf_file, "w") as out:
+            out.write(conf + "\n[hub]\nurl: http://127.0.0.1:1/events\nqueue_dir: {dir}\n".format(
+                dir=os.path.join(self.dir, "queue")))
+        self.detector = MockHitDetector(1, 1, 1, True, MockSensor(lambda x: (x, x, x)))
+        self.controllers = []
+        self.original = (workout_controller.WorkoutController, sparpi.configure_logger)
+        workout_controller.WorkoutController = self.build_controller
+        sparpi.configure_logger = lambda is_debug: None
+        ui_server.apiInstance = None
+
+    def tearDown(self):
+        workout_controller.WorkoutController, sparpi.configure_logger = self.original
+        for controller in self.controllers:
+            controller.cleanup()
+        shutil.rmtree(self.dir)
+
+    def build_controller(self, conf_file, timer=None, watch_config=False):
+        controller = self.original[0](conf_file, controller=MockLedController({'r': 1, 'c': 2, 'l': 3}),
+                                      detector=self.detector, timer=timer, watch_config=watch_config)
+        self.controllers.append(controller)
+        return controller
+
+    def test_ui_keeps_controller_running(self):
+        args = argparse.Namespace(debug=False, sensor_test=False, export=None, config=self.conf_file, headless=False,
+                                  port=0, server='threaded', startup_report=False)
+        thread = threading.Thread(target=sparpi.main, args=(args,))
+        thread.daemon = True
+        thread.start()
+        while ui_server.apiInstance is None:
+            thread.join(0.01)
+        server = ui_server.apiInstance
+        self.assertTrue(server.listening.wait(5))
+        thread.join(0.5)
+        # main is still serving and nothing the controller uses has been shut down
+        controller = self.controllers[0]
+        self.assertTrue(thread.isAlive())
+        self.assertEqual(0, self.detector.get_invocation_count("close"))
+        self.assertTrue(controller.config_watcher.thread.isAlive())
+        self.assertFalse(controller.config_watcher.stopped.is_set())
+        self.assertTrue(controller.uploader.thread.isAlive())
+        server.stop()
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(1, self.detector.get_invocation_count("close"))
+        self.assertTrue(controller.config_watcher.stopped.is_set())
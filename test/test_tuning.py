@@ -0,0 +1,51 @@
+import unittest
+import os
+import tempfile
+import ConfigParser
+from engine import tuning
+
+DATA_DIR_PATH = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class TestTuning(unittest.TestCase):
+
+    def test_load_traces(self):
+        traces = tuning.load_traces(DATA_DIR_PATH)
+        for side in tuning.SIDES:
+            self.assertEqual(6, len(traces[side]))
+            self.assertEqual(3, len(traces[side][0][0]))
+
+    def test_replay_clock(self):
+        sensor = tuning.ReplaySensor([(1, 1, 1)], 100)
+        self.assertEqual((1, 1, 1), sensor.get_sample())
+        self.assertEqual((0.0, 0.0, 0.0), sensor.get_sample())
+        self.assertEqual(0.02, sensor.clock())
+
+    def test_evaluate(self):
+        traces = tuning.load_traces(DATA_DIR_PATH)
+        result = tuning.evaluate({"threshold": 15, "samples": 50, "recoil_wait": 1, "stability_threshold": 5,
+                                  "min_calibration_distance": 5}, traces, tuning.ReplayOptions())
+        self.assertTrue(result["calibration_rate"] > 0.5)
+        self.assertTrue(result["detection_rate"] > 0.9)
+        # an impossibly high threshold never detects anything
+        result = tuning.evaluate({"threshold": 1000, "samples": 50}, traces, tuning.ReplayOptions())
+        self.assertEqual(0, result["detection_rate"])
+
+    def test_build_grid(self):
+        grid = tuning.build_grid({"threshold": [1, 2], "samples": [10, 20, 30]})
+        self.assertEqual(6, len(grid))
+        self.assertTrue({"threshold": 2, "samples": 30} in grid)
+
+    def test_write_config(self):
+        handle, out_file = tempfile.mkstemp(suffix=".ini")
+        os.close(handle)
+        try:
+            tuning.write_config(os.path.join(DATA_DIR_PATH, "test.ini"), out_file,
+                                {"threshold": 12.5, "recoil_wait": 0.75})
+            config = ConfigParser.RawConfigParser()
+            config.read(out_file)
+            self.assertEqual(12.5, config.getfloat("sensor", "threshold"))
+            self.assertEqual(0.75, config.getfloat("workout", "recoil_wait"))
+            self.assertEqual(2, config.getint("sensor", "samples"))
+        finally:
+            os.remove(out_file)
@@ -0,0 +1,83 @@
+import unittest
+import gzip
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from ui import ui_server
+from ui import static_assets
+from ui.static_assets import StaticAssetCache
+
+
+class TestStaticAssets(unittest.TestCase):
+
+    def setUp(self):
+        self.client = ui_server.app.test_client()
+        self.script = ui_server.assets.get('js/sparpi.js')
+
+    def test_fingerprint(self):
+        resource_dir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(resource_dir, 'js'))
+            with open(os.path.join(resource_dir, 'js', 'app.js'), 'w') as out:
+                out.write('var x = 1;')
+            with open(os.path.join(resource_dir, 'index.html'), 'w') as out:
+                out.write('<script src="js/app.js"></script><script src="js/other.js"></script>')
+            cache = StaticAssetCache(resource_dir)
+            etag = cache.get('js/app.js').etag
+            # only references to assets that exist are rewritten
+            self.assertEqual('<script src="js/app.js?v={v}"></script><script src="js/other.js"></script>'.format(
+                v=etag), cache.get('index.html').body)
+        finally:
+            shutil.rmtree(resource_dir)
+
+    def test_index_references_versioned_assets(self):
+        response = self.client.get('/')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue('js/sparpi.js?v={v}'.format(v=self.script.etag) in response.data)
+        self.assertEqual(static_assets.REVALIDATE_CACHE_CONTROL, response.headers['Cache-Control'])
+
+    def test_cache_control(self):
+        versioned = self.client.get('/js/sparpi.js?v={v}'.format(v=self.script.etag))
+        self.assertEqual(static_assets.IMMUTABLE_CACHE_CONTROL, versioned.headers['Cache-Control'])
+        # an old version must not be cached forever under the new content
+        stale = self.client.get('/js/sparpi.js?v=0123456789abcdef')
+        self.assertEqual(static_assets.REVALIDATE_CACHE_CONTROL, stale.headers['Cache-Control'])
+        self.assertEqual(static_assets.REVALIDATE_CACHE_CONTROL,
+                         self.client.get('/js/sparpi.js').headers['Cache-Control'])
+
+    def test_etag(self):
+        response = self.client.get('/js/sparpi.js')
+        self.assertEqual('"{etag}"'.format(etag=self.script.etag), response.headers['ETag'])
+        not_modified = self.client.get('/js/sparpi.js', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(304, not_modified.status_code)
+        self.assertEqual('', not_modified.data)
+        self.assertEqual(response.headers['ETag'], not_modified.headers['ETag'])
+        changed = self.client.get('/js/sparpi.js', headers={'If-None-Match': '"0123456789abcdef"'})
+        self.assertEqual(200, changed.status_code)
+        self.assertEqual(self.script.body, changed.data)
+
+    def test_gzip_negotiation(self):
+        plain = self.client.get('/js/sparpi.js')
+        self.assertEqual(None, plain.headers.get('Content-Encoding'))
+        self.assertEqual('Accept-Encoding', plain.headers['Vary'])
+        self.assertEqual(self.script.body, plain.data)
+        compressed = self.client.get('/js/sparpi.js', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual('gzip', compressed.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(self.script.body, gzip.GzipFile(fileobj=StringIO(compressed.data)).read())
+
+    def test_incompressible_asset(self):
+        # assets that don't shrink when compressed are always sent as is
+        asset = static_assets.StaticAsset('img/noise.png', os.urandom(512))
+        self.assertEqual(None, asset.gzip_body)
+        ui_server.assets.assets[asset.path] = asset
+        try:
+            response = self.client.get('/img/noise.png', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(None, response.headers.get('Content-Encoding'))
+            self.assertEqual(asset.body, response.data)
+        finally:
+            del ui_server.assets.assets[asset.path]
+
+    def test_missing_asset(self):
+        self.assertEqual(404, self.client.get('/js/missing.js').status_code)
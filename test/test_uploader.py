@@ -0,0 +1,91 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from engine import history
+from engine.hub import HubServer
+from engine.uploader import DiskQueue, HubUploader
+from engine.workout_controller import WorkoutState
+
+
+class TestUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue_dir = os.path.join(self.dir, "queue")
+        self.hub_dir = os.path.join(self.dir, "hub")
+        self.hub = None
+
+    def tearDown(self):
+        if self.hub is not None:
+            self.hub.shutdown()
+            self.hub.server_close()
+        shutil.rmtree(self.dir)
+
+    def start_hub(self, port=0):
+        self.hub = HubServer(("127.0.0.1", port), self.hub_dir)
+        thread = threading.Thread(target=self.hub.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return "http://127.0.0.1:{port}/events".format(port=self.hub.server_address[1])
+
+    def hub_events(self, device="bag1"):
+        return list(history.iter_records(os.path.join(self.hub_dir, device), history.EVENTS))
+
+    def test_disk_queue(self):
+        queue = DiskQueue(self.queue_dir, max_batches=2)
+        for i in range(3):
+            queue.put("batch{i}".format(i=i), "data{i}".format(i=i))
+        self.assertEqual(1, queue.dropped)
+        # batches are read back in order after a restart
+        queue = DiskQueue(self.queue_dir)
+        self.assertEqual(2, len(queue))
+        self.assertEqual(("batch1.json.gz", "data1"), queue.peek())
+
+    def test_upload_workout(self):
+        uploader = HubUploader(self.start_hub(), self.queue_dir, device="bag1", batch_size=2).start()
+        state = WorkoutState(100, mode='random', uploader=uploader)
+        for i in range(4):
+            state.record_hit('r', 0.1 * i, True)
+        state.finish()
+        uploader.close(5)
+        events = self.hub_events()
+        self.assertEqual(["workout_start", "hit", "hit", "hit", "hit", "workout_end"], [e["type"] for e in events])
+        self.assertEqual(3, uploader.uploaded)
+        self.assertEqual(0, len(uploader.queue))
+
+    def test_offline(self):
+        # nothing is listening, so the batch stays on disk
+        url = self.start_hub()
+        port = self.hub.server_address[1]
+        self.hub.shutdown()
+        self.hub.server_close()
+        self.hub = None
+        uploader = HubUploader(url, self.queue_dir, device="bag1", timeout=1).start()
+        uploader.record("hit", side='c')
+        uploader.close(5)
+        self.assertEqual(1, len(uploader.queue))
+        self.assertTrue(uploader.get_stats()["last_error"])
+        # the queued batch is delivered once the hub is back
+        self.start_hub(port)
+        HubUploader(url, self.queue_dir, device="bag1").start().close(5)
+        self.assertEqual(['c'], [e["side"] for e in self.hub_events()])
+
+    def test_backpressure(self):
+        uploader = HubUploader("http://127.0.0.1:1/events", self.queue_dir, max_pending=2)
+        for i in range(5):
+            uploader.record("hit")
+        self.assertEqual(3, uploader.get_stats()["dropped"])
+        self.assertEqual(2, uploader.get_stats()["pending"])
+
+    def test_duplicate_batch(self):
+        batch = {"device": "bag1", "batch": "1", "events": [{"type": "hit", "time": 1000.0}]}
+        store = HubServer(("127.0.0.1", 0), self.hub_dir)
+        try:
+            self.assertEqual(1, store.store.add_batch(batch))
+            self.assertEqual(0, store.store.add_batch(batch))
+            self.assertRaises(ValueError, store.store.add_batch, dict(batch, device="../etc"))
+        finally:
+            store.server_close()
+        self.assertEqual(1, len(self.hub_events()))
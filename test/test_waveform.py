@@ -0,0 +1,60 @@
+import unittest
+from engine import waveform
+from engine.acquisition import SampleRingBuffer
+
+
+def fill(ring, count, rate=800.0, peak_at=None):
+    for i in range(count):
+        val = 50 if i == peak_at else 1
+        ring.append(i / rate, (val, 0, 0))
+
+
+class TestWaveform(unittest.TestCase):
+
+    def test_downsample_keeps_peak(self):
+        samples = [(i / 800.0, 100 if i == 77 else 1, 0, 0) for i in range(800)]
+        points, hits = waveform.downsample(samples, 0, 50)
+        self.assertTrue(len(points) <= 52)
+        self.assertTrue(max(p[4] for p in points) == 100)
+        self.assertEqual([], hits)
+
+    def test_downsample_hit_full_resolution(self):
+        samples = [(i / 800.0, 1, 0, 0) for i in range(800)]
+        points, hits = waveform.downsample(samples, 1000, 25, [1400])
+        self.assertEqual([0.5], hits)
+        self.assertTrue(len(points) >= waveform.HIT_WINDOW_BEFORE + waveform.HIT_WINDOW_AFTER)
+
+    def test_get_level(self):
+        self.assertEqual(25, waveform.get_level(1))
+        self.assertEqual(100, waveform.get_level(150))
+        self.assertEqual(800, waveform.get_level(10000))
+
+    def test_streamer_cursor(self):
+        ring = SampleRingBuffer(4096)
+        streamer = waveform.WaveformStreamer(ring)
+        fill(ring, 1000)
+        first = streamer.get_points(None, 100)
+        self.assertEqual(7 * waveform.CHUNK_SAMPLES, first["next"])
+        self.assertTrue(len(first["points"]) > 0)
+        # nothing new until another chunk is complete
+        self.assertEqual([], streamer.get_points(first["next"], 100)["points"])
+
+    def test_streamer_shares_work(self):
+        ring = SampleRingBuffer(4096)
+        streamer = waveform.WaveformStreamer(ring)
+        fill(ring, 1024)
+        self.assertEqual(streamer.get_points(0, 100), streamer.get_points(0, 120))
+        cached = len(streamer.cache)
+        for i in range(10):
+            streamer.get_points(0, 100)
+        self.assertEqual(cached, len(streamer.cache))
+
+    def test_hit_invalidates_cache(self):
+        ring = SampleRingBuffer(4096)
+        streamer = waveform.WaveformStreamer(ring)
+        fill(ring, 1024)
+        before = streamer.get_points(0, 25)
+        ring.mark_hit()
+        after = streamer.get_points(0, 25)
+        self.assertEqual([round(1023 / 800.0, 4)], after["hits"])
+        self.assertTrue(len(after["points"]) > len(before["points"]))
@@ -1,11 +1,22 @@
 import unittest
+import ConfigParser
 import os
+import json
+import shutil
+import tempfile
+import time
+import threading
 from engine import workout_controller
 from engine.workout_controller import ConfigurationError
+from engine import hit_detector
 from engine.hit_detector import SensorInitializationError
 from mocks import MockHitDetector
 from mocks import MockLedController
 from mocks import MockSensor
+from engine.config_watcher import ConfigWatcher
+from engine.acquisition import SampleRingBuffer
+from engine.startup import StartupTimer
+from test_hit_detector import ramp_trace
 
 DATA_DIR_PATH = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -74,6 +85,210 @@ class TestWorkoutController(unittest.TestCase):
         except Exception as e:
             self.assertEquals(type(e), ConfigurationError)
 
+    def test_sensor_errors(self):
+        """
+        Ensures sensor errors end the round rather than the workout thread
+        :return:
+        """
+        self.detector.register_override("wait_for_stability", throw_io_error)
+        controller = workout_controller.WorkoutController(os.path.join(DATA_DIR_PATH, "test.ini"),
+                                                          controller=self.led,
+                                                          detector=self.detector)
+        controller.recoil_wait = 0
+        state = controller.start_workout('random', 1)
+        self.assertEqual(workout_controller.MAX_CONSECUTIVE_SENSOR_ERRORS, state.sensor_errors)
+        self.assertFalse(controller.is_running)
+
+    def test_state_snapshots(self):
+        state = workout_controller.WorkoutState(100)
+        first = state.snapshot
+        state.record_hit('r', 0.5, True)
+        second = state.snapshot
+        self.assertEqual(first.version + 1, second.version)
+        # earlier snapshots must not see later hits
+        self.assertEqual(0, len(first.correct_hits))
+        self.assertEqual(1, len(second.correct_hits))
+        # the encoding is cached per version
+        self.assertTrue(second.to_json() is second.to_json())
+
+    def test_snapshot_json(self):
+        state = workout_controller.WorkoutState(100)
+        state.record_hit('l', 0.25, False)
+        data = json.loads(state.snapshot.to_json(server_time=42))
+        self.assertEqual(42, data['server_time'])
+        self.assertEqual(100, data['deadline'])
+        self.assertEqual([{'direction': 'l', 'time': 0.25}], data['incorrect_hits'])
+
+    def test_reload_config(self):
+        controller = workout_controller.WorkoutController(os.path.join(DATA_DIR_PATH, "test.ini"),
+                                                          controller=self.led,
+                                                          detector=self.detector)
+        result = controller.reload_config({'sensor': {'threshold': 12}, 'workout': {'recoil_wait': '0.25'}})
+        self.assertEqual([], result['restart_required'])
+        # nothing changes until the start of the next round
+        self.assertEqual(0.5, controller.recoil_wait)
+        self.assertEqual(12, controller.get_settings()['pending']['threshold'])
+        controller.apply_pending_settings()
+        self.assertEqual(0.25, controller.recoil_wait)
+        self.assertEqual(1, self.detector.get_invocation_count("update_settings"))
+        self.assertEqual(None, controller.get_settings()['pending'])
+        self.assertEqual(12, controller.get_settings()['settings']['threshold'])
+
+    def test_reload_invalid_config(self):
+        controller = workout_controller.WorkoutController(os.path.join(DATA_DIR_PATH, "test.ini"),
+                                                          controller=self.led,
+                                                          detector=self.detector)
+        self.assertRaises(ConfigurationError, controller.reload_config, {'workout': {'reaction_timeout': '-1'}})
+        self.assertRaises(ConfigurationError, controller.reload_config, {'sensor': {'samples': 'many'}})
+        self.assertEqual(None, controller.get_settings()['pending'])
+        result = controller.reload_config({'sensor': {'rate': '400'}})
+        self.assertEqual(['sensor.rate'], result['restart_required'])
+        # still waiting for a restart after later, unrelated changes
+        result = controller.reload_config({'workout': {'recoil_wait': '1'}})
+        self.assertEqual(['sensor.rate'], result['restart_required'])
+        self.assertEqual(['sensor.rate'], controller.get_settings()['restart_required'])
+
+    def test_config_file_watch(self):
+        conf_dir = tempfile.mkdtemp()
+        try:
+            conf_file = os.path.join(conf_dir, "sparpi.ini")
+            shutil.copy(os.path.join(DATA_DIR_PATH, "test.ini"), conf_file)
+            controller = workout_controller.WorkoutController(conf_file, controller=self.led, detector=self.detector)
+            watcher = ConfigWatcher(conf_file, controller.reload_config)
+            self.assertFalse(watcher.check())
+            with open(conf_file) as in_file:
+                text = in_file.read()
+            with open(conf_file, "w") as out:
+                out.write(text.replace("reaction_timeout: 2", "reaction_timeout: 3.5"))
+            self.assertTrue(watcher.check())
+            self.assertEqual(3.5, controller.get_settings()['pending']['reaction_timeout'])
+        finally:
+            shutil.rmtree(conf_dir)
+
+    def test_overrides_survive_file_reload(self):
+        conf_dir = tempfile.mkdtemp()
+        try:
+            conf_file = os.path.join(conf_dir, "sparpi.ini")
+            shutil.copy(os.path.join(DATA_DIR_PATH, "test.ini"), conf_file)
+            controller = workout_controller.WorkoutController(conf_file, controller=self.led, detector=self.detector)
+            controller.reload_config({'workout': {'recoil_wait': '0.25'}, 'sensor': {'rate': '400'}})
+            # the file changes after the settings were changed over HTTP
+            with open(conf_file) as in_file:
+                text = in_file.read()
+            with open(conf_file, "w") as out:
+                out.write(text.replace("reaction_timeout: 2", "reaction_timeout: 3.5"))
+            result = controller.reload_config()
+            self.assertEqual(0.25, result['settings']['recoil_wait'])
+            self.assertEqual(3.5, result['settings']['reaction_timeout'])
+            self.assertEqual(['sensor.rate'], result['restart_required'])
+        finally:
+            shutil.rmtree(conf_dir)
+
+    def test_hit_force(self):
+        detector = hit_detector.HitDetector(5, 10, 1, True, MockSensor(ramp_trace))
+        controller = workout_controller.WorkoutController(os.path.join(DATA_DIR_PATH, "test.ini"),
+                                                          controller=self.led, detector=detector)
+        controller.cur_workout = workout_controller.WorkoutState(100)
+        self.assertTrue(controller.await_hit(None))
+        # the force is the peak of the impact rather than the sample that crossed the threshold
+        self.assertEqual(14, controller.get_state().correct_hits[0].force)
+
+    def test_concurrent_reloads(self):
+        controller = workout_controller.WorkoutController(os.path.join(DATA_DIR_PATH, "test.ini"),
+                                                          controller=self.led, detector=self.detector)
+        read_settings = workout_controller.read_settings
+        put = threading.Thread(target=controller.reload_config, args=({'workout': {'recoil_wait': '0.25'}},))
+
+        def slow_read_settings(config):
+            # a change is made over HTTP while the watcher is part way through reloading the file
+            if put.ident is None:
+                put.start()
+                put.join(0.2)
+            return read_settings(config)
+
+        workout_controller.read_settings = slow_read_settings
+        try:
+            controller.reload_config()
+            put.join(5)
+        finally:
+            workout_controller.read_settings = read_settings
+        self.assertEqual(0.25, controller.get_settings()['pending']['recoil_wait'])
+
+    def test_auto_rate_selected_in_background(self):
+        conf_dir = tempfile.mkdtemp()
+        build_sensor = workout_controller.build_sensor
+        select_sensor_rate = workout_controller.select_sensor_rate
+        selected = []
+
+        def slow_select_rate(sensor):
+            time.sleep(0.5)
+            selected.append(sensor)
+
+        workout_controller.build_sensor = lambda config, select_rate=True: MockSensor(lambda x: (0, 0, 0))
+        workout_controller.select_sensor_rate = slow_select_rate
+        try:
+            conf_file = os.path.join(conf_dir, "sparpi.ini")
+            with open(os.path.join(DATA_DIR_PATH, "test.ini")) as in_file:
+                text = in_file.read()
+            with open(conf_file, "w") as out:
+                out.write(text.replace("[sensor]", "[sensor]\nrate: auto"))
+            timer = StartupTimer()
+            start = time.time()
+            controller = workout_controller.WorkoutController(conf_file, controller=self.led, timer=timer)
+            # the constructor does not wait for the rate to be selected
+            self.assertTrue(time.time() - start < 0.4)
+            self.assertTrue(controller.hit_detector.wait_until_ready(5))
+            self.assertEqual(1, len(selected))
+            phases = dict((name, (offset, duration)) for name, offset, duration in timer.phases)
+            self.assertTrue(phases["sensor rate"][1] >= 0.5)
+            # calibration is reported separately, starting once the rate has been selected
+            self.assertTrue(phases["sensor calibration"][0] >= sum(phases["sensor rate"]))
+            controller.cleanup()
+        finally:
+            workout_controller.build_sensor = build_sensor
+            workout_controller.select_sensor_rate = select_sensor_rate
+            shutil.rmtree(conf_dir)
+
+    def test_reaction_time_from_sample(self):
+        detector = SlowResultDetector(MockSensor(lambda x: (x, x, x)))
+        controller = workout_controller.WorkoutController(os.path.join(DATA_DIR_PATH, "test.ini"),
+                                                          controller=self.led, detector=detector)
+        controller.cur_workout = workout_controller.WorkoutState(100)
+        self.assertTrue(controller.await_hit('r'))
+        # the time the result took to come back is not part of the reaction time
+        self.assertTrue(controller.get_state().correct_hits[0].time < 0.25)
+
+    def test_history_dir(self):
+        config = ConfigParser.RawConfigParser()
+        self.assertEqual(None, workout_controller.get_history(config, "/etc/sparpi/sparpi.ini"))
+        config.add_section("history")
+        config.set("history", "dir", "history")
+        # relative to the configuration file rather than the working directory, and never created just by reading it
+        self.assertEqual("/etc/sparpi/history", workout_controller.get_history_dir(config, "/etc/sparpi/sparpi.ini"))
+        self.assertFalse(os.path.exists("/etc/sparpi/history"))
+        config.set("history", "dir", "/var/sparpi")
+        self.assertEqual("/var/sparpi", workout_controller.get_history_dir(config, "/etc/sparpi/sparpi.ini"))
+
+
+class SlowResultDetector(MockHitDetector):
+    """
+    Detector that records the hit sample in its ring buffer straight away but takes half a second to return it, like a
+    RemoteHitDetector whose caller is stalled.
+    """
+
+    def __init__(self, sensor):
+        super(SlowResultDetector, self).__init__(1, 1, 1, True, sensor)
+        self.ring = SampleRingBuffer()
+
+    def wait_for_hit(self, side, timeout):
+        self.ring.append(time.time(), (5, 5, 5))
+        time.sleep(0.5)
+        return (5, 5, 5), True
+
 
 def throw_error(val):
     raise SensorInitializationError
+
+
+def throw_io_error(val):
+    raise IOError("Simulated bus error")
@@ -1,6 +1,17 @@
 (function () { //scoping function
 
     var pollerInterval = null;
+    var waveformInterval = null;
+    var sensorReady = false;
+    // version of the workout state for which analytics were last loaded
+    var analyticsVersion = null;
+    // seconds of waveform history to display
+    var WAVEFORM_SECONDS = 5;
+    var waveform = {
+        cursor: null,
+        points: [],
+        hits: []
+    };
 
     /**
      * Cancels the pollerInterval if it is initialized.
@@ -9,6 +20,9 @@
         if (pollerInterval != null) {
             clearInterval(pollerInterval);
         }
+        if (waveformInterval != null) {
+            clearInterval(waveformInterval);
+        }
     }
 
     /**
@@ -31,9 +45,36 @@
         $('#recalibrate').click(function () {
             recalibrate();
         });
+
+        pollForReadiness();
     });
 
 
+    /**
+     * Polls the readiness endpoint until the sensor has either finished or failed calibration, updating the status
+     * badge as it goes. The start button remains disabled until the sensor is ready.
+     */
+    function pollForReadiness() {
+        $.getJSON("/readiness",
+            function (json) {
+                var badge = $("#sensorStatus");
+                badge.removeClass("badge-warning badge-success badge-danger");
+                if (json['sensor'] === 'ready') {
+                    sensorReady = true;
+                    badge.addClass("badge-success").text("Sensor ready");
+                    validateInput();
+                } else if (json['sensor'] === 'failed') {
+                    badge.addClass("badge-danger").text("Sensor failed");
+                } else {
+                    badge.addClass("badge-warning").text("Sensor calibrating");
+                    setTimeout(pollForReadiness, 1000);
+                }
+            }).fail(function () {
+                setTimeout(pollForReadiness, 1000);
+            });
+    }
+
+
     /**
      * Makes GET calls to the workout endpoint in order to load the current workout state. This will automatically
      * cancel the interval (if non-null) once the deadline has passed since no more updates should occur.
@@ -50,6 +91,85 @@
             });
     }
 
+    /**
+     * Fetches new waveform points since the last poll. The points-per-second budget is based on the width of the
+     * canvas so the server never sends more detail than can be drawn.
+     */
+    function pollForWaveform() {
+        var canvas = document.getElementById("waveform");
+        var params = {pps: Math.ceil(canvas.clientWidth / WAVEFORM_SECONDS)};
+        if (waveform.cursor !== null) {
+            params.since = waveform.cursor;
+        }
+        $.getJSON("/waveform", params,
+            function (json) {
+                waveform.cursor = json['next'];
+                waveform.points = waveform.points.concat(json['points']);
+                waveform.hits = waveform.hits.concat(json['hits']);
+                if (waveform.points.length > 0) {
+                    var oldest = waveform.points[waveform.points.length - 1][0] - WAVEFORM_SECONDS;
+                    waveform.points = waveform.points.filter(function (p) {
+                        return p[0] >= oldest;
+                    });
+                    waveform.hits = waveform.hits.filter(function (t) {
+                        return t >= oldest;
+                    });
+                }
+                drawWaveform(canvas);
+            });
+    }
+
+    /**
+     * Draws the buffered waveform: the magnitude in black over the x, y and z axes in lighter colors, with a red
+     * marker at each detected hit.
+     * @param canvas
+     */
+    function drawWaveform(canvas) {
+        canvas.width = canvas.clientWidth;
+        canvas.height = canvas.clientHeight;
+        var ctx = canvas.getContext("2d");
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        var points = waveform.points;
+        if (points.length < 2) {
+            return;
+        }
+        var end = points[points.length - 1][0];
+        var start = end - WAVEFORM_SECONDS;
+        var maxVal = 10;
+        for (var i = 0; i < points.length; i++) {
+            maxVal = Math.max(maxVal, points[i][4]);
+        }
+        var mid = canvas.height / 2;
+        var toX = function (t) {
+            return (t - start) / WAVEFORM_SECONDS * canvas.width;
+        };
+        var toY = function (v) {
+            return mid - v / maxVal * (mid - 2);
+        };
+        ctx.strokeStyle = "#dc3545";
+        for (var h = 0; h < waveform.hits.length; h++) {
+            ctx.beginPath();
+            ctx.moveTo(toX(waveform.hits[h]), 0);
+            ctx.lineTo(toX(waveform.hits[h]), canvas.height);
+            ctx.stroke();
+        }
+        var series = [[1, "#9ecae1"], [2, "#a1d99b"], [3, "#fdd0a2"], [4, "#212529"]];
+        for (var s = 0; s < series.length; s++) {
+            ctx.strokeStyle = series[s][1];
+            ctx.beginPath();
+            for (var j = 0; j < points.length; j++) {
+                var x = toX(points[j][0]);
+                var y = toY(points[j][series[s][0]]);
+                if (j === 0) {
+                    ctx.moveTo(x, y);
+                } else {
+                    ctx.lineTo(x, y);
+                }
+            }
+            ctx.stroke();
+        }
+    }
+
     /**
      * Iterates the hitList array and returns a dictionary keyed on the hit direction.
      * @param hitList
@@ -78,29 +198,47 @@
         $("#rhit").text(hits['r'].length);
         $("#chit").text(hits['c'].length);
         $("#lhit").text(hits['l'].length);
-        $("#rtime").text(getAverage(hits['r']));
-        $("#ctime").text(getAverage(hits['c']));
-        $("#ltime").text(getAverage(hits['l']));
+        if (workoutState['version'] !== analyticsVersion) {
+            analyticsVersion = workoutState['version'];
+            loadAnalytics();
+        }
         $("#rmiss").text(misses['r'].length);
         $("#cmiss").text(misses['c'].length);
         $("#lmiss").text(misses['l'].length);
+        updateSensorHealth(workoutState['sensor'], workoutState['sensor_errors']);
     }
 
     /**
-     * Calculates the average reaction time from an array of hit information objects.
-     * @param hits
-     * @returns {*}
+     * Shows the achieved sample rate along with any dropped samples and sensor errors so it is obvious when sampling
+     * is falling behind.
+     * @param stats sensor stats from the workout state (may be null)
+     * @param failedRounds number of rounds lost to sensor errors
      */
-    function getAverage(hits) {
-        var total = 0;
-        for (var i = 0; i < hits.length; i++) {
-            total += hits[i]['time']
+    function updateSensorHealth(stats, failedRounds) {
+        if (!stats) {
+            $("#sensorHealth").text("");
+            return;
         }
-        if (hits.length === 0) {
-            return 0;
-        } else {
-            return (total / hits.length).toFixed(3);
+        var text = "Sample rate: " + Math.round(stats['achieved_rate']) + " Hz, dropped samples: " + stats['dropped'] +
+            ", read errors: " + stats['errors'] + ", bus resets: " + stats['reinitializations'];
+        if (failedRounds > 0) {
+            text += ", rounds lost: " + failedRounds;
         }
+        $("#sensorHealth").toggleClass("text-danger", stats['dropped'] > 0 || failedRounds > 0).text(text);
+    }
+
+    /**
+     * Loads the analytics of the current workout (computed on the server) and shows the mean reaction time per side.
+     */
+    function loadAnalytics() {
+        $.getJSON("/workout/analytics",
+            function (json) {
+                var sides = ['r', 'c', 'l'];
+                for (var i = 0; i < sides.length; i++) {
+                    var mean = json['sides'][sides[i]]['mean'];
+                    $("#" + sides[i] + "time").text(mean === null ? 0 : mean.toFixed(3));
+                }
+            });
     }
 
     /**
@@ -175,7 +313,7 @@
      */
     function validateInput() {
         var isValid = validateTime() && validateFrequencies();
-        if (isValid) {
+        if (isValid && sensorReady) {
             $("#startbutton").removeClass("disabled");
         } else {
             $("#startbutton").addClass("disabled");
@@ -222,7 +360,7 @@
      */
     function startWorkout() {
         cancelPoll(); // just in case we were still polling for some reason
-        if (validateInput()) {
+        if (validateInput() && sensorReady) {
             $.ajax({
                 url: '/workout',
                 type: "PUT",
@@ -241,6 +379,7 @@
                     //turn off input fields
                     toggleAllowInput(false);
                     pollerInterval = setInterval(pollForData, 500);
+                    waveformInterval = setInterval(pollForWaveform, 250);
                 }
             });
         }
@@ -0,0 +1,84 @@
+"""
+__author__ = 'Christopher Fagiani'
+"""
+import os
+import gzip
+import hashlib
+import mimetypes
+from StringIO import StringIO
+
+INDEX_PAGE = 'index.html'
+# fingerprinted assets never change for a given URL so clients may cache them forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# unversioned requests must be revalidated with the ETag on every use
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+class StaticAsset(object):
+    """
+    A static file held in memory along with its gzip-compressed form and an ETag derived from its contents.
+    """
+
+    def __init__(self, path, body):
+        self.path = path
+        self.body = body
+        self.etag = hashlib.md5(body).hexdigest()[:16]
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.gzip_body = compress(body)
+        # don't bother sending a compressed body if compression doesn't save anything (i.e. the favicon)
+        if len(self.gzip_body) >= len(body):
+            self.gzip_body = None
+
+
+class StaticAssetCache(object):
+    """
+    Loads every file under the resource directory at startup and precompresses it. References to the other assets
+    within index.html are rewritten to include a version query parameter so that browsers can cache those assets
+    indefinitely and still pick up changes after an upgrade.
+    """
+
+    def __init__(self, resource_dir):
+        self.assets = {}
+        for dir_path, _, file_names in os.walk(resource_dir):
+            for file_name in file_names:
+                full_path = os.path.join(dir_path, file_name)
+                rel_path = os.path.relpath(full_path, resource_dir).replace(os.sep, '/')
+                with open(full_path, 'rb') as in_file:
+                    self.assets[rel_path] = StaticAsset(rel_path, in_file.read())
+        if INDEX_PAGE in self.assets:
+            self.assets[INDEX_PAGE] = StaticAsset(INDEX_PAGE, self.fingerprint(self.assets[INDEX_PAGE].body))
+
+    def fingerprint(self, page):
+        """
+        Rewrites quoted references to known assets within page to include a ?v=etag query parameter.
+        :param page:
+        :return:
+        """
+        for path, asset in self.assets.iteritems():
+            if path != INDEX_PAGE:
+                page = page.replace('"{p}"'.format(p=path), '"{p}?v={v}"'.format(p=path, v=asset.etag))
+        return page
+
+    def get(self, path):
+        return self.assets.get(path)
+
+
+def compress(body):
+    buf = StringIO()
+    # use a fixed mtime so the compressed output (and thus what we send) is stable across restarts
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as gz:
+        gz.write(body)
+    return buf.getvalue()
+
+
+def get_cache_control(asset, version):
+    """
+    Returns the Cache-Control header value for a request for asset. Only requests that carry the current version are
+    marked immutable.
+    :param asset:
+    :param version: value of the v query parameter on the request, if any.
+    :return:
+    """
+    if version is not None and version == asset.etag:
+        return IMMUTABLE_CACHE_CONTROL
+    return REVALIDATE_CACHE_CONTROL
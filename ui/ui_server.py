@@ -6,39 +6,71 @@ import threading
 import logging
 import time
 import os
-from engine.workout_controller import HitStats
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
 from engine.hit_detector import SensorInitializationError
+from engine.workout_controller import ConfigurationError
+from engine import export
+from static_assets import StaticAssetCache, get_cache_control
 
 RESOURCE_DIR_PATH = os.path.join(os.path.dirname(__file__), 'resources')
+SERVER_MODES = ['dev', 'threaded', 'waitress']
 
 try:
-    from flask import Flask, request, send_from_directory
+    from flask import Flask, Response, abort, request
 except ImportError:
     raise ImportError("flask is not installed. Please install (sudo apt-get install flask)")
 
 logger = logging.getLogger(__name__)
 app = Flask(__name__)
 apiInstance = None
+assets = StaticAssetCache(RESOURCE_DIR_PATH)
 
 
 @app.route('/')
 def root():
-    return send_from_directory(RESOURCE_DIR_PATH, 'index.html')
+    return serve_asset('index.html')
 
 
 @app.route('/js/<path:path>')
 def js(path):
-    return send_from_directory(RESOURCE_DIR_PATH + '/js', path)
+    return serve_asset('js/' + path)
 
 
 @app.route('/css/<path:path>')
 def css(path):
-    return send_from_directory(RESOURCE_DIR_PATH + '/css', path)
+    return serve_asset('css/' + path)
+
+
+@app.route('/img/<path:path>')
+def img(path):
+    return serve_asset('img/' + path)
 
 
 @app.route('/favicon.ico')
 def favicon():
-    return send_from_directory(RESOURCE_DIR_PATH + '/img', "favicon.ico")
+    return serve_asset('img/favicon.ico')
+
+
+def serve_asset(path):
+    """
+    Serves a precompressed static asset from memory, honoring If-None-Match and Accept-Encoding.
+    :param path:
+    :return:
+    """
+    asset = assets.get(path)
+    if asset is None:
+        abort(404)
+    headers = {"Cache-Control": get_cache_control(asset, request.args.get('v')),
+               "ETag": '"{etag}"'.format(etag=asset.etag),
+               "Vary": "Accept-Encoding"}
+    if asset.etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    body = asset.body
+    if asset.gzip_body is not None and 'gzip' in request.accept_encodings:
+        body = asset.gzip_body
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype=asset.mimetype, headers=headers)
 
 
 @app.route("/workout", methods=["PUT"])
@@ -64,6 +96,88 @@ def get_status():
     return apiInstance.get_status()
 
 
+@app.route("/workout/analytics", methods=["GET"])
+def get_analytics():
+    """Returns reaction time distributions, fatigue curves, hit rates and force trends for the workout that started at
+    the time in the workout parameter (defaults to the current or most recent workout)
+    """
+    global apiInstance
+    result = apiInstance.get_analytics(request.args.get("workout", None, type=float))
+    if result is None:
+        return '{"msg": "Workout not found"}', 404, {"Content-Type": "application/json"}
+    return result, 200, {"Content-Type": "application/json"}
+
+
+@app.route("/workout/export", methods=["GET"])
+def export_history():
+    """Streams the recorded workout history. The data parameter selects events (default) or samples, format selects csv
+    (default) or ndjson and start/end limit the time range (epoch seconds or ISO 8601 local time). Pass gzip=1 to
+    download a .gz file; otherwise the response is gzip encoded for clients that accept it.
+    """
+    global apiInstance
+    kind = request.args.get("data", "events")
+    fmt = request.args.get("format", "csv")
+    as_file = request.args.get("gzip") == "1"
+    encode = not as_file and 'gzip' in request.accept_encodings
+    try:
+        start = export.parse_time(request.args.get("start"))
+        end = export.parse_time(request.args.get("end"))
+        chunks = apiInstance.export(kind, fmt, start, end, as_file or encode)
+    except ValueError as e:
+        return json.dumps({"msg": str(e)}), 400, {"Content-Type": "application/json"}
+    except ConfigurationError as e:
+        return json.dumps({"msg": str(e)}), 404, {"Content-Type": "application/json"}
+    headers = {"Content-Disposition": 'attachment; filename="sparpi-{kind}.{fmt}{ext}"'.format(
+        kind=kind, fmt=fmt, ext=".gz" if as_file else ""), "Vary": "Accept-Encoding"}
+    if encode:
+        headers["Content-Encoding"] = "gzip"
+    return Response(chunks, mimetype=export.MIMETYPES[fmt], headers=headers)
+
+
+@app.route("/config", methods=["GET"])
+def get_config():
+    """Returns the reloadable settings in use along with any waiting to be applied at the start of the next round
+    """
+    global apiInstance
+    return json.dumps(apiInstance.get_settings()), 200, {"Content-Type": "application/json"}
+
+
+@app.route("/config", methods=["PUT"])
+def reload_config():
+    """Reloads the configuration. With no body the configuration file is re-read; otherwise the body is a JSON object
+    of section names to option values that are applied on top of the current configuration. The new settings are
+    validated and then applied at the start of the next round without recalibrating.
+    """
+    global apiInstance
+    updates = request.get_json(force=True, silent=True) if request.data else None
+    if request.data and updates is None:
+        return '{"msg": "Invalid JSON"}', 400, {"Content-Type": "application/json"}
+    try:
+        result = apiInstance.reload_config(updates)
+    except ConfigurationError as e:
+        return json.dumps({"msg": str(e)}), 400, {"Content-Type": "application/json"}
+    return json.dumps(result), 200, {"Content-Type": "application/json"}
+
+
+@app.route("/waveform", methods=["GET"])
+def get_waveform():
+    """Returns the live acceleration waveform since the sequence number in the since parameter, downsampled to the
+    number of points per second in the pps parameter
+    """
+    global apiInstance
+    since = request.args.get("since", None, type=int)
+    pps = request.args.get("pps", 100, type=int)
+    return apiInstance.get_waveform(since, pps), 200, {"Content-Type": "application/json"}
+
+
+@app.route("/readiness", methods=["GET"])
+def get_readiness():
+    """Returns the status of the sensor calibration so the UI can indicate when the bag is usable
+    """
+    global apiInstance
+    return apiInstance.get_readiness(), 200, {"Content-Type": "application/json"}
+
+
 @app.route("/calibration", methods=["POST"])
 def trigger_calibration():
     """
@@ -78,24 +192,85 @@ def trigger_calibration():
         return '{"msg": "Calibration failed"}', 500
 
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    WSGI server that handles each request on its own thread so slow clients cannot block each other.
+    """
+    daemon_threads = True
+    request_queue_size = 64
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """
+    Request handler that sends the access log to the debug logger instead of writing every poll to stderr.
+    """
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.client_address[0], format % args)
+
+
 class SparpiServer:
-    def __init__(self, port, workout_controller):
-        """Sets up the Flask webserver to run on the port passed in
+    def __init__(self, port, workout_controller, server_mode='dev'):
+        """Sets up the Flask webserver to run on the port passed in. The server_mode selects the HTTP server: 'dev' is
+        the Flask development server, 'threaded' is a multi-threaded WSGI server and 'waitress' uses the waitress
+        server (which must be installed).
         """
         global apiInstance
+        if server_mode not in SERVER_MODES:
+            raise ValueError("Unknown server mode {mode}".format(mode=server_mode))
         self.driver = workout_controller
         self.port = port
+        self.server_mode = server_mode
         self.workout_thread = None
+        self.thread = None
+        self.server = None
+        self.listening = threading.Event()
 
         apiInstance = self
 
     def start(self):
-        thread = threading.Thread(target=self.run_app)
-        thread.daemon = False
-        thread.start()
+        """
+        Starts serving on a background thread. The thread is a daemon so the caller must keep the process alive (see
+        wait) and clean up the workout controller once the server is done with it.
+        """
+        self.thread = threading.Thread(target=self.run_app, name="ui-server")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait(self):
+        """
+        Blocks until the server exits. The thread is joined in short steps since an unbounded join would keep a
+        KeyboardInterrupt from being delivered.
+        """
+        while self.thread is not None and self.thread.isAlive():
+            self.thread.join(1)
+
+    def stop(self):
+        """
+        Stops the server. Only the threaded server can be stopped; the others run until the process exits.
+        """
+        if self.server is not None:
+            self.server.shutdown()
 
     def run_app(self):
-        app.run(host="0.0.0.0", port=self.port)
+        if self.server_mode == 'threaded':
+            self.server = make_server("0.0.0.0", self.port, app, server_class=ThreadingWSGIServer,
+                                      handler_class=QuietRequestHandler)
+            self.listening.set()
+            logger.info("Serving on port {port} with the threaded WSGI server".format(
+                port=self.server.server_address[1]))
+            try:
+                self.server.serve_forever()
+            finally:
+                self.server.server_close()
+        elif self.server_mode == 'waitress':
+            try:
+                import waitress
+            except ImportError:
+                raise ImportError("waitress is not installed. Please install (sudo pip install waitress)")
+            waitress.serve(app, host="0.0.0.0", port=self.port)
+        else:
+            app.run(host="0.0.0.0", port=self.port)
 
     def start_workout(self, config):
         if not self.driver.has_valid_calibration():
@@ -111,15 +286,27 @@ class SparpiServer:
         self.driver.stop_workout()
 
     def get_status(self):
-        workout_data = self.driver.get_state()
-        return json.dumps(workout_data, default=serialize_status)
+        return (self.driver.get_state().to_json(server_time=time.time(), sensor=self.driver.get_sensor_stats()), 200,
+                {"Content-Type": "application/json"})
+
+    def get_waveform(self, since, pps):
+        return json.dumps(self.driver.get_waveform(since, pps), separators=(',', ':'))
+
+    def get_settings(self):
+        return self.driver.get_settings()
+
+    def reload_config(self, updates):
+        return self.driver.reload_config(updates)
+
+    def get_analytics(self, workout):
+        return self.driver.get_analytics(workout)
+
+    def export(self, kind, fmt, start, end, compress):
+        return self.driver.export(kind, fmt, start, end, compress)
+
+    def get_readiness(self):
+        return '{{"sensor": "{status}"}}'.format(status=self.driver.get_readiness())
 
     def trigger_calibration(self):
         self.driver.calibrate_orientation()
 
-
-def serialize_status(obj):
-    if isinstance(obj, HitStats):
-        return obj.__dict__
-    else:
-        return obj.__dict__